@@ -0,0 +1,101 @@
+#########################################################
+#                                                       #
+#                       AdcSweep.py                     #
+#    Timer paced ADC sweeps of several sensor channels  #
+#                                                       #
+#########################################################
+
+# sweep() acquires samplesPerBurst samples of every channel with a
+# single ADC.read_timed_multi: on each tick of the hardware timer, at
+# sampleRate, every channel is converted in turn. The main loop is
+# blocked for samplesPerBurst / sampleRate whatever the number of
+# channels, as long as the conversions of all the channels fit in a
+# timer period; a sweep that did not keep up is counted in overruns.
+#
+# The bursts land in one preallocated array, channel after channel,
+# through a memoryview per channel. The burst total of each channel
+# goes in a ring of the last windowLength sweeps, interleaved: the
+# total of channel c in sweep s is at s * numberOfChannels + c. A
+# burst total of up to 16 samples of 12 bits fits an 'H'. The running
+# sum of each channel is kept up to date, so the window average costs
+# the same whatever the window length, and the work per sample is a
+# single addition.
+#
+# Everything happens in the main loop: nothing is shared with an
+# ISR and no critical section is needed.
+
+from array import array
+from pyb import ADC, Timer
+
+
+MAX_SAMPLES_PER_BURST = const(16)       # 16 * 4095 fits an 'H'
+
+
+class AdcSweep:
+    def __init__(self, pins, timerId, sampleRate=20000, samplesPerBurst=16, windowLength=50):
+        if samplesPerBurst > MAX_SAMPLES_PER_BURST:
+            raise ValueError("at most %d samples per burst" % MAX_SAMPLES_PER_BURST)
+        numberOfChannels = len(pins)
+        self.numberOfChannels = numberOfChannels
+        self._adcs = tuple(ADC(pin) for pin in pins)
+        self._timer = Timer(timerId, freq=sampleRate)
+        self._samplesPerBurst = samplesPerBurst
+        self._windowLength = windowLength
+        self._bursts = array('H', [0 for _ in range(samplesPerBurst * numberOfChannels)])
+        bursts = memoryview(self._bursts)
+        self._burstViews = tuple(bursts[channel * samplesPerBurst:(channel + 1) * samplesPerBurst]
+                                 for channel in range(numberOfChannels))
+        self._ring = array('H', [0 for _ in range(windowLength * numberOfChannels)])
+        self._ringLength = windowLength * numberOfChannels
+        self._head = 0                  # first entry of the oldest sweep
+        self.sums = array('i', [0 for _ in range(numberOfChannels)])
+        self.numberOfSamples = samplesPerBurst * windowLength
+        self.sweeps = 0
+        self.overruns = 0
+
+    def sweep(self):
+        if not ADC.read_timed_multi(self._adcs, self._burstViews, self._timer):
+            self.overruns += 1
+        self.sweeps += 1
+        self._accumulateSweep()
+
+    # Fills the whole window with one sweep, so the averages are real readings from the start
+    def prime(self):
+        self.sweep()
+        numberOfChannels = self.numberOfChannels
+        last = (self._head - numberOfChannels) % self._ringLength
+        for channel in range(numberOfChannels):
+            burstTotal = self._ring[last + channel]
+            for i in range(channel, self._ringLength, numberOfChannels):
+                self._ring[i] = burstTotal
+            self.sums[channel] = burstTotal * self._windowLength
+        self._head = 0
+
+    @micropython.viper
+    def _accumulateSweep(self):
+        bursts = ptr16(self._bursts)
+        ring = ptr16(self._ring)
+        sums = ptr32(self.sums)
+        numberOfChannels = int(self.numberOfChannels)
+        samplesPerBurst = int(self._samplesPerBurst)
+        head = int(self._head)
+        sample = 0
+        channel = 0
+        while channel < numberOfChannels:
+            burstTotal = 0
+            end = sample + samplesPerBurst
+            while sample < end:
+                burstTotal += int(bursts[sample])
+                sample += 1
+            sums[channel] = int(sums[channel]) + burstTotal - int(ring[head + channel])
+            ring[head + channel] = burstTotal
+            channel += 1
+        head += numberOfChannels
+        self._head = head if head < int(self._ringLength) else 0
+
+    # Sum of the last numberOfSamples readings of channel
+    def sum(self, channel):
+        return self.sums[channel]
+
+    def average(self, channel):
+        return self.sums[channel] / self.numberOfSamples
@@ -0,0 +1,125 @@
+#########################################################
+#                                                       #
+#                      Benchmark.py                     #
+#      Hot path timings and heap allocations per call   #
+#                                                       #
+#########################################################
+
+# run(controller) times the hot paths of a built controller one at a
+# time, each called repeats times back to back, then passes of the
+# main loop for mainLoopMs with every task running on the live fans
+# and water. For each one it gives the average microseconds and the
+# heap bytes allocated per call (gc.mem_alloc with the collector off,
+# None where the port has no gc.mem_alloc), and the main loop rate.
+#
+# The results are printed as one line, BENCH followed by JSON, that
+# host/bench.py reads from the REPL output and compares with its
+# baselines. It is not frozen or compiled with the firmware: copy it
+# to the board, host/bench.py --port does through mpremote resume,
+# and from the REPL once main.py is interrupted:
+#
+#     mpremote cp Benchmark.py :
+#     import Benchmark; Benchmark.run(controller)
+#     controller.mainLoop()
+#
+# The PID and the fan health are timed on instances of their own, so
+# that the controller state is left as it was. The ADC sweep and the
+# LCD update are the controller's: the sweep only adds samples to the
+# window and the LCD shows two test screens until the next refresh.
+
+import gc
+import json
+import sys
+import utime
+from PID import FixedPID
+from FanHealth import FanHealth
+import FanController
+
+
+REPEATS = 1000
+SLOW_REPEATS = 100             # paths that block on the ADC or the I2C bus
+MAIN_LOOP_MS = 3000
+LCD_SCREENS = ((b"Benchmark Line 1", b"  31.4 deg C    "), (b"Benchmark Line 2", b"  31.5 deg C    "))
+
+
+HAS_MEM_ALLOC = hasattr(gc, "mem_alloc")     # not on CPython
+
+
+def _memAlloc():
+    return gc.mem_alloc() if HAS_MEM_ALLOC else 0
+
+
+# Average us and heap bytes per call of call(argument)
+def measure(call, argument=None, repeats=REPEATS):
+    gc.collect()
+    gc.disable()
+    startAllocated = _memAlloc()
+    startTime = utime.ticks_us()
+    if argument is None:
+        for _ in range(repeats):
+            call()
+    else:
+        for _ in range(repeats):
+            call(argument)
+    elapsedUs = utime.ticks_diff(utime.ticks_us(), startTime)
+    allocated = _memAlloc() - startAllocated
+    gc.enable()
+    return elapsedUs / repeats, allocated / repeats if HAS_MEM_ALLOC else None
+
+
+# Average us and heap bytes per pass of the main loop, and the passes per second
+def measureMainLoop(controller, durationMs=MAIN_LOOP_MS):
+    scheduler = controller._scheduler
+    poll = controller._pollTachPinsAndUpdatePulseCounters
+    passes = 0
+    gc.collect()
+    gc.disable()
+    startAllocated = _memAlloc()
+    startTime = utime.ticks_us()
+    startMs = utime.ticks_ms()
+    while utime.ticks_diff(utime.ticks_ms(), startMs) < durationMs:
+        scheduler.runOnce()
+        poll()
+        passes += 1
+    elapsedUs = utime.ticks_diff(utime.ticks_us(), startTime)
+    allocated = _memAlloc() - startAllocated
+    gc.enable()
+    passes = max(1, passes)
+    return (elapsedUs / passes, allocated / passes if HAS_MEM_ALLOC else None,
+            passes * 1000000 // max(1, elapsedUs))
+
+
+def run(controller, repeats=REPEATS, slowRepeats=SLOW_REPEATS, mainLoopMs=MAIN_LOOP_MS):
+    results = {}
+
+    def record(name, measurement):
+        results[name] = {"us": round(measurement[0], 2),
+                         "bytes": None if measurement[1] is None else round(measurement[1], 2)}
+
+    record("tachPoll", measure(controller._pollTachPinsAndUpdatePulseCounters, repeats=repeats))
+    pid = FixedPID(setValue=FanController.TARGET_WATER_TEMP, kP=FanController.PID_KP, kI=FanController.PID_KI,
+                   kD=FanController.PID_KD, derivativeFilterMs=FanController.PID_DERIVATIVE_FILTER_MS)
+    record("pidUpdate", measure(pid.update, controller._cpuInWaterCentiDegrees, repeats=repeats))
+    record("temperatureSweep", measure(controller._probeTemperatures, repeats=slowRepeats))
+    record("temperatureUpdate", measure(controller._updateTemperatures, repeats=repeats))
+    fanHealth = FanHealth(FanController.TOTAL_NUMBER_OF_RADIATOR_FANS,
+                          (FanController.TOP_RAD_ZONE_FANS, FanController.BOTTOM_RAD_TOP_ZONE_FANS,
+                           FanController.BOTTOM_RAD_BOTTOM_ZONE_FANS), controller._fanCurve)
+
+    def fanHealthUpdate():
+        fanHealth.update(controller._radFansRPMs, controller._fansPwmDuties)
+    record("fanHealth", measure(fanHealthUpdate, repeats=repeats))
+    lcd = controller._lcd
+    screen = bytearray(1)
+
+    # a screen the LCD does not show yet on every call
+    def lcdUpdate():
+        screen[0] ^= 1
+        lcd.update(LCD_SCREENS[screen[0]])
+    record("lcdUpdate", measure(lcdUpdate, repeats=slowRepeats))
+    record("lcdCommand", measure(lcd.display, repeats=slowRepeats))
+    averageUs, allocated, passesPerSecond = measureMainLoop(controller, mainLoopMs)
+    record("mainLoopPass", (averageUs, allocated))
+    report = {"platform": sys.platform, "passesPerSecond": passesPerSecond, "paths": results}
+    print("BENCH " + json.dumps(report))
+    return report
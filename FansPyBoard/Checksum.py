@@ -0,0 +1,20 @@
+#########################################################
+#                                                       #
+#                      Checksum.py                      #
+#       Checksums of the files kept in flash            #
+#                                                       #
+#########################################################
+
+
+# Fletcher-16 of the first length bytes
+@micropython.viper
+def fletcher16(data, length: int) -> int:
+    source = ptr8(data)
+    sum1 = 0
+    sum2 = 0
+    i = 0
+    while i < length:
+        sum1 = (sum1 + source[i]) % 255
+        sum2 = (sum2 + sum1) % 255
+        i += 1
+    return (sum2 << 8) | sum1
@@ -0,0 +1,799 @@
+#########################################################
+#                                                       #
+#              PyBoard Lite Fan Controller              #
+#                   Philippe Vico 2016                  #
+#                                                       #
+#########################################################
+
+import pyb, utime, stm, math, micropython, gc
+from pyb import Pin, Timer, ExtInt, UART
+from array import array
+from PID import FixedPID
+from LCM1602_I2C import LCM1602_I2C
+from TachPeriodEstimator import TachPeriodEstimator
+from AdcSweep import AdcSweep
+from Thermistor import Thermistor
+from Scheduler import Scheduler
+from Telemetry import Telemetry
+import LcdText
+from Zone import Zone, ZoneCoordinator
+from FanCurve import FanCurve, FanCurveSweep, SWEEP_SAMPLE_MS
+from HistoryLog import HistoryLog
+from FanHealth import FanHealth
+from PumpLink import PumpLink, PumpLinkLoopback, PUMP_STOPPED
+from Instrumentation import Instrumentation
+
+
+LCD_I2C_PORT = const(1)
+LCD_I2C_BAUDRATE = const(400000)
+LCD_COLUMNS = const(16)
+# The following pins should be in IN mode, no pull
+CPU_IN_WATER_TEMP_ADC_PIN = Pin.board.X19
+TOP_RAD_FANS_PWM_PIN = Pin.board.X2
+BOTTOM_RAD_TOP_FANS_PWM_PIN = Pin.board.X3
+BOTTOM_RAD_BOTTOM_FANS_PWM_PIN = Pin.board.X4
+
+# For the following indexes, the byte MSB is 0 for GPIOB & 1 for GPIOC
+TOP_RAD_FAN1_TACH_PIN_IDR_INDEX = const(0x80 + 2)           # PC2 - X21
+TOP_RAD_FAN2_TACH_PIN_IDR_INDEX = const(0x80 + 3)           # PC3 - X22
+TOP_RAD_FAN3_TACH_PIN_IDR_INDEX = const(0x80 + 4)           # PC4 - X11
+TOP_RAD_FAN4_TACH_PIN_IDR_INDEX = const(0x80 + 5)           # PC5 - X12
+BOTTOM_RAD_TOP_FAN1_TACH_PIN_IDR_INDEX = const(12)          # PB12 - Y5
+BOTTOM_RAD_TOP_FAN2_TACH_PIN_IDR_INDEX = const(13)          # PB13 - Y6
+BOTTOM_RAD_TOP_FAN3_TACH_PIN_IDR_INDEX = const(14)          # PB14 - Y7
+BOTTOM_RAD_TOP_FAN4_TACH_PIN_IDR_INDEX = const(15)          # PB15 - Y8
+BOTOM_RAD_BOTTOM_FAN1_TACH_PIN_IDR_INDEX = const(0)         # PB0 - Y11, Y1/Y2 are the pump link UART
+BOTOM_RAD_BOTTOM_FAN2_TACH_PIN_IDR_INDEX = const(1)         # PB1 - Y12
+BOTOM_RAD_BOTTOM_FAN3_TACH_PIN_IDR_INDEX = const(10)        # PB10 - Y3 only for PyBoard Lite (PB8 on full PyBoard)
+BOTOM_RAD_BOTTOM_FAN4_TACH_PIN_IDR_INDEX = const(9)         # PB9 - Y4
+# Fan numbering on the display follows this order. Any GPIOB/GPIOC pin can be added, the poll cost does not grow per fan
+# and the RPM and health arrays are sized from this list
+RADIATOR_FANS_TACH_PINS_IDR_INDEXES = (TOP_RAD_FAN1_TACH_PIN_IDR_INDEX, TOP_RAD_FAN2_TACH_PIN_IDR_INDEX,
+                                       TOP_RAD_FAN3_TACH_PIN_IDR_INDEX, TOP_RAD_FAN4_TACH_PIN_IDR_INDEX,
+                                       BOTTOM_RAD_TOP_FAN1_TACH_PIN_IDR_INDEX, BOTTOM_RAD_TOP_FAN2_TACH_PIN_IDR_INDEX,
+                                       BOTTOM_RAD_TOP_FAN3_TACH_PIN_IDR_INDEX, BOTTOM_RAD_TOP_FAN4_TACH_PIN_IDR_INDEX,
+                                       BOTOM_RAD_BOTTOM_FAN1_TACH_PIN_IDR_INDEX, BOTOM_RAD_BOTTOM_FAN2_TACH_PIN_IDR_INDEX,
+                                       BOTOM_RAD_BOTTOM_FAN3_TACH_PIN_IDR_INDEX, BOTOM_RAD_BOTTOM_FAN4_TACH_PIN_IDR_INDEX)
+TOTAL_NUMBER_OF_RADIATOR_FANS = len(RADIATOR_FANS_TACH_PINS_IDR_INDEXES)
+NO_FAN = const(0xff)
+TICKS_MAX = const(0x1fffffff)   # utime ticks wrap at 2**29 on the stm32 port
+TACH_DEBOUNCE_US = const(1000)
+
+# Polling samples the tach pins from the main loop. With ExtInt, every tach edge raises an interrupt
+# and is counted even while the main loop is blocked; pins whose EXTI line is already taken
+# (PBn and PCn share line n) keep being polled.
+TACH_ACQUISITION_POLLING = const(0)
+TACH_ACQUISITION_EXTINT = const(1)
+TACH_ACQUISITION_MODE = TACH_ACQUISITION_EXTINT
+
+# _radFansRPMs blends two estimators: the pulse count over the 3.75" window (8 RPM steps, up to 7.5" to see a
+# stalled fan) and the average of the last TACH_PERIODS_AVERAGED edge to edge periods, updated on every edge
+# and dropping to 0 after TACH_STALL_TIMEOUT_US without an edge. 100 uses the period estimate only.
+RPM_PERIOD_ESTIMATE_PERCENT = const(100)
+TACH_PERIODS_AVERAGED = const(8)
+TACH_STALL_TIMEOUT_US = const(400000)   # a fan at 100 RPM still gives an edge every 300 ms
+US_PER_MINUTE_PER_PULSE = const(30000000)   # 2 tach pulses per revolution
+
+ADC_SAMPLING_TIMER = const(4)
+
+# Task periods of the main loop scheduler
+FANS_RPM_WINDOW_MS = const(3750)            # this allows rpm = numPulses << 3
+PID_CONTROL_RATE_HZ = const(1)              # 1 to 10
+ADJUST_FANS_RPM_PERIOD_MS = const(1000 // PID_CONTROL_RATE_HZ)
+SPLASH_SCREEN_MS = const(2000)
+
+# Binary state frames on the USB VCP for host/recorder.py, 1 to 100 Hz, 0 for none. The REPL shares the VCP.
+TELEMETRY_RATE_HZ = const(0)
+
+FANS_PWM_TIMER = const(2)
+TOP_RAD_FANS_PWM_CHANNEL = const(4)             # PyBoard Lite only !
+BOTTOM_RAD_TOP_FANS_PWM_CHANNEL = const(1)      # PyBoard Lite only !
+BOTTOM_RAD_BOTTOM_FANS_PWM_CHANNEL = const(2)   # PyBoard Lite only !
+
+MINIMUM_RPM_DUTY_TIME = const(20)
+# At boot the fans get full duty until one of them is seen turning: from standstill they give their first tach
+# periods in about 300 ms instead of 800 ms at minimum duty, and the control takes over from there
+FAN_SPIN_UP_DUTY = const(100)
+FAN_SPIN_UP_MAX_MS = const(1000)
+
+# One zone per PWM channel: the positions of its fans in RADIATOR_FANS_TACH_PINS_IDR_INDEXES, the cooling weight of
+# its side of the radiators (the bottom radiator is shared by the push and the pull fans) and the name of a coolant
+# sensor of its own in TEMPERATURE_SENSORS, None for none. A zone sensor holds the zone at least at the speed that
+# keeps it under ZONE_SENSOR_TARGET_TEMP.
+RADIATOR_FAN_MAX_RPM = const(1500)
+TOP_RAD_ZONE_FANS = (0, 1, 2, 3)
+BOTTOM_RAD_TOP_ZONE_FANS = (4, 5, 6, 7)
+BOTTOM_RAD_BOTTOM_ZONE_FANS = (8, 9, 10, 11)
+ZONE_WEIGHTS = (100, 60, 40)
+ZONE_SENSORS = (None, None, None)                # e.g. ("Rad out", None, None)
+ZONE_SENSOR_TARGET_TEMP = 40.0
+# The PWM duty to RPM curve of each channel is measured by a sweep at the first boot, or on demand, and cached.
+# At the first boot the control starts at once with the proportional curve and the sweep waits for the water to be
+# at or under the target
+FAN_CURVE_DUTY_STEP = const(5)
+FAN_CURVE_CACHE_FILE = 'fancurve.bin'
+FAN_CURVE_SAVE_PERIOD_MS = const(3600000)       # the learned curve is written at most once an hour
+FAN_CURVE_SWEEP_MAX_TEMP_RISE = 5.0             # a sweep is abandoned when the water gets this far above target
+# The controller state is recorded in a ring file, controller.printHistory(minutes) reads it back
+HISTORY_LOG_FILE = 'history.bin'                # '/sd/history.bin' for a longer history on an SD card
+HISTORY_RECORD_PERIOD_MS = const(30000)
+HISTORY_LOG_PAGES = const(40)                   # 40 kB of 24 records per page, 8 hours at one record every 30 s
+HISTORY_PAGE_SIZE = const(1024)
+HISTORY_FLUSH_RECORDS = const(6)                # the page is written every 3 minutes while it fills, 4 writes a page
+# Pump RPM and faults from the pump MCU on a UART, RX only: UART 6, RX on Y2 (PC7), its TX on Y1 is left unconnected.
+# The other UARTs of the PyBoard Lite share their pins with the LCD I2C, the USR switch, the PWM outputs or the USB.
+# With PUMP_LINK_LOOPBACK, PumpLinkLoopback stands in for the pump MCU.
+PUMP_LINK_UART = const(6)
+PUMP_LINK_BAUDRATE = const(9600)
+PUMP_LINK_RX_BUFFER = const(128)        # 100 ms of bytes at 9600 baud
+PUMP_LINK_POLL_MS = const(100)
+PUMP_LINK_TIMEOUT_MS = const(3000)      # a frame every second
+PUMP_LINK_LOOPBACK = False
+# The fans get a floor on the cooling demand from the pump: none at PUMP_NORMAL_RPM, the pump runs at about 3000 RPM,
+# up to 100 % at PUMP_MIN_RPM, where the pump MCU alarms, or with the pump stopped. PUMP_LINK_LOST_DEMAND once the
+# pump MCU stops sending.
+PUMP_NORMAL_RPM = const(2700)
+PUMP_MIN_RPM = const(1500)
+PUMP_LINK_LOST_DEMAND = const(60)
+
+TEMPERATURE_SENSOR_DIVIDER_RESISTANCE = const(2200)    # we have a 2k2 from adc pin to ground, ThermistorTable.py is generated
+                                                        # from it by host/thermtable.py, regenerate it when this changes
+# Every temperature sensor is sampled by the same ADC sweep, which blocks the main loop as long for 7 sensors as for
+# one: a name, the ADC pin and the module of the table host/thermtable.py generated for its thermistor and divider,
+# e.g. python3 -m host.thermtable --output AmbientTable.py --divider 10000 --coefficients A B C D --offset 0.0
+# The CPU inlet water sensor comes first, the PID follows it. Free ADC pins: X1, X5-X8, X20.
+TEMPERATURE_SENSORS = (
+    ("CPU in", CPU_IN_WATER_TEMP_ADC_PIN, "ThermistorTable"),
+    # ("GPU in", Pin.board.X20, "ThermistorTable"),
+    # ("Rad out", Pin.board.X1, "ThermistorTable"),
+    # ("Ambient", Pin.board.X5, "AmbientTable"),
+)
+CPU_IN_WATER_SENSOR = const(0)
+
+SECONDS_BETWEEN_DISPLAY_UPDATE = const(5)
+NUMBER_OF_TEMPERATURE_READINGS_PER_SECOND = const(10)     # each reading is a sweep of TEMPERATURE_SAMPLES_PER_BURST samples
+TEMPERATURE_SAMPLES_PER_BURST = const(16)                 # per sensor, 16 at most
+TEMPERATURE_BURST_SAMPLE_RATE = const(20000)    # Hz, a sweep blocks the main loop for 0.8 ms
+NUMBER_OF_SCREENS = const(2)
+NUMBER_OF_READINGS_ARRAY_SIZE = const(NUMBER_OF_TEMPERATURE_READINGS_PER_SECOND * SECONDS_BETWEEN_DISPLAY_UPDATE)
+TEMPERATURE_READING_PERIOD_MS = const(1000 // NUMBER_OF_TEMPERATURE_READINGS_PER_SECOND)
+
+PID_KP = 2.0
+PID_KI = 0.02
+PID_KD = 0.0
+PID_DERIVATIVE_FILTER_MS = const(2000)
+TARGET_WATER_TEMP = 35.0
+
+# Steps of Controller.bootTimesMs
+BOOT_MAIN = const(0)                # main.py started
+BOOT_IMPORTED = const(1)            # the modules are loaded, the controller is being built
+BOOT_PWM = const(2)                 # the fans run at minimum duty
+BOOT_TACH = const(3)                # the tach pulses are counted
+BOOT_FIRST_RPM = const(4)           # first fan turning
+BOOT_FIRST_CONTROL = const(5)       # first duties from the water temperature
+BOOT_STEPS = ("main.py", "imported", "PWM", "tach", "first RPM", "first control")
+
+micropython.alloc_emergency_exception_buf(100)
+
+# State shared with tachEdgeISR, bound by Controller._initTachPins
+tachExtIntLineToFan = bytearray(NO_FAN for _ in range(16))
+tachExtIntLines = array('I', (0, 0))    # [0] lines wired to GPIOC, [1] last accepted level of each line
+tachExtIntTimeStamps = None
+tachExtIntPulseCounters = None
+tachExtIntPeriodEstimator = None
+
+# Called on both edges of a tach pin, applies the same debounce rule as the polling path
+@micropython.viper
+def tachEdgeISR(line: int):
+    fan = int(ptr8(tachExtIntLineToFan)[line])
+    if fan == NO_FAN:
+        return
+    lines = ptr32(tachExtIntLines)
+    lineBit = uint(1) << line
+    if lines[0] & lineBit:
+        level = uint(readGPIOC_IDR()) & lineBit
+    else:
+        level = uint(readGPIOB_IDR()) & lineBit
+    if level == lines[1] & lineBit:
+        return
+    nowTimeStamp = int(utime.ticks_us())
+    lastTimeStamps = ptr32(tachExtIntTimeStamps)
+    if (nowTimeStamp - int(lastTimeStamps[fan])) & TICKS_MAX > TACH_DEBOUNCE_US:
+        lastTimeStamps[fan] = nowTimeStamp
+        lines[1] = lines[1] ^ lineBit
+        if level:
+            pulseCounters = ptr32(tachExtIntPulseCounters)
+            pulseCounters[fan] += 1
+            tachExtIntPeriodEstimator.risingEdge(fan, nowTimeStamp)
+
+@micropython.asm_thumb
+def readGPIOB_IDR():
+    movwt(r1, stm.GPIOB)        # r1 contains the base address of GPIOB
+    ldr(r0, [r1, stm.GPIO_IDR]) # The content of GPIOB base address + offset of IDR is loaded in r0, r0 is the result of the function
+
+@micropython.asm_thumb
+def readGPIOC_IDR():
+    movwt(r1, stm.GPIOC)        # r1 contains the base address of GPIOC
+    ldr(r0, [r1, stm.GPIO_IDR]) # The content of GPIOC base address + offset of IDR is loaded in r0, r0 is the result of the function
+
+
+class Controller:
+    def __init__(self, bootStartMs=None):
+        # Boot timeline, utime.ticks_ms() counts from the reset
+        self.bootTimesMs = array('i', [-1 for _ in range(len(BOOT_STEPS))])
+        self.bootTimesMs[BOOT_MAIN] = bootStartMs if bootStartMs is not None else utime.ticks_ms()
+        self.bootTimesMs[BOOT_IMPORTED] = utime.ticks_ms()
+
+        # The fans get their minimum duty and the tach acquisition starts before anything else
+        self._timerFansPwm = Timer(FANS_PWM_TIMER, freq=25000)
+        self._channelTopRadPwm = self._timerFansPwm.channel(TOP_RAD_FANS_PWM_CHANNEL, Timer.PWM, pin=TOP_RAD_FANS_PWM_PIN)
+        self._channelBottomRadTopFansPwm = self._timerFansPwm.channel(BOTTOM_RAD_TOP_FANS_PWM_CHANNEL, Timer.PWM, pin=BOTTOM_RAD_TOP_FANS_PWM_PIN)
+        self._channelBottomRadBottomFansPwm = self._timerFansPwm.channel(BOTTOM_RAD_BOTTOM_FANS_PWM_CHANNEL, Timer.PWM, pin=BOTTOM_RAD_BOTTOM_FANS_PWM_PIN)
+        self._controlValue = FAN_SPIN_UP_DUTY
+        self._fansPwmDuties = bytearray(3)          # top, bottom rad top, bottom rad bottom, in percent
+        self._setAllFansPwm()
+        self.bootTimesMs[BOOT_PWM] = utime.ticks_ms()
+
+        self._tachExtInts = []
+        self._initTachPins(RADIATOR_FANS_TACH_PINS_IDR_INDEXES, TACH_ACQUISITION_MODE)
+        # Bit i set for fan i, updated with the RPMs from the FanHealth states
+        self._stoppedFansMask = (1 << TOTAL_NUMBER_OF_RADIATOR_FANS) - 1
+        self._slowFansMask = 0
+        self._wornFansMask = 0
+        self._averageFanRpm = 0
+        self.bootTimesMs[BOOT_TACH] = utime.ticks_ms()
+
+        self._initPumpLink()
+        self._lcd = LCM1602_I2C(cols = LCD_COLUMNS, rows=2, i2cPort=LCD_I2C_PORT, baudrate=LCD_I2C_BAUDRATE)
+        self._displayScreenCounter = 0
+        # The display lines are built in place, the scratch line can be longer than the LCD and is centered in line 2
+        self._lcdLines = (bytearray(LCD_COLUMNS), bytearray(LCD_COLUMNS))
+        self._lcdScratchLine = bytearray(2 * LCD_COLUMNS)
+
+        # The window starts full of a first sweep, the temperatures are right for the first control update
+        self._initTemperatureSensors()
+        self._initFanCurve()
+        self._fanHealth = FanHealth(TOTAL_NUMBER_OF_RADIATOR_FANS,
+                                    (TOP_RAD_ZONE_FANS, BOTTOM_RAD_TOP_ZONE_FANS, BOTTOM_RAD_BOTTOM_ZONE_FANS),
+                                    self._fanCurve)
+        self._historyLog = HistoryLog(HISTORY_LOG_FILE, TOTAL_NUMBER_OF_RADIATOR_FANS, HISTORY_LOG_PAGES, HISTORY_PAGE_SIZE,
+                                      HISTORY_FLUSH_RECORDS)
+        self._historyStoppedFansMask = 0
+        self._initZones()
+        self._pidController = FixedPID(setValue=TARGET_WATER_TEMP, kP=PID_KP, kI=PID_KI, kD=PID_KD,
+                                       derivativeFilterMs=PID_DERIVATIVE_FILTER_MS)
+
+        # Everything but the tach poll runs as a scheduler task, the splash screens do not hold the fans up
+        self._scheduler = Scheduler(maxTasks=12)
+        self._temperatureTaskId = self._scheduler.addTask(self._readTemperatureTask, TEMPERATURE_READING_PERIOD_MS)
+        self._fansRpmTaskId = self._scheduler.addTask(self._calculateFansRpmTask, FANS_RPM_WINDOW_MS, FANS_RPM_WINDOW_MS)
+        self._adjustFansRpmTaskId = self._scheduler.addTask(self._adjustFansRpmTask, ADJUST_FANS_RPM_PERIOD_MS)
+        self._helloMessage()
+        self._displayTaskId = self._scheduler.addTask(self._refreshDisplayTask, 1000 * SECONDS_BETWEEN_DISPLAY_UPDATE,
+                                                      2 * SPLASH_SCREEN_MS)
+        if TELEMETRY_RATE_HZ:
+            self._telemetry = Telemetry(pyb.USB_VCP(), TOTAL_NUMBER_OF_RADIATOR_FANS, TELEMETRY_RATE_HZ)
+            self._telemetryTaskId = self._scheduler.addTask(self._sendTelemetryTask, self._telemetry.periodMs)
+        self._fanCurveSweepTaskId = self._scheduler.addTask(self._fanCurveSweepTask, SWEEP_SAMPLE_MS)
+        self._scheduler.stop(self._fanCurveSweepTaskId)
+        self._saveFanCurveTaskId = self._scheduler.addTask(self._saveFanCurveTask, FAN_CURVE_SAVE_PERIOD_MS,
+                                                           FAN_CURVE_SAVE_PERIOD_MS)
+        self._historyTaskId = self._scheduler.addTask(self._historyTask, HISTORY_RECORD_PERIOD_MS)
+        self._pumpLinkTaskId = self._scheduler.addTask(self._pumpLinkTask, PUMP_LINK_POLL_MS)
+        self._instrumentation = Instrumentation(TOTAL_NUMBER_OF_RADIATOR_FANS)
+        self._instrumentationTachPeriodsUs = array('i', [0 for _ in range(TOTAL_NUMBER_OF_RADIATOR_FANS)])
+        self._instrumentationTaskId = self._scheduler.addTask(self._instrumentationTask, 1000)
+        self._scheduler.stop(self._instrumentationTaskId)
+        self._fanCurveSweepPending = not self._fanCurve.measured
+
+    def _initTachPins(self, pinsIdrIndexes, acquisitionMode):
+        global tachExtIntTimeStamps, tachExtIntPulseCounters, tachExtIntPeriodEstimator
+        for extInt in self._tachExtInts:
+            extInt.disable()
+        self._tachExtInts = []
+        numberOfFans = len(pinsIdrIndexes)
+        self._radFansTachPinsIndexes = array('B', pinsIdrIndexes)
+        nowTimeStamp = utime.ticks_us()
+        self._radFansTachPinsLastTimeStamps = array('i', [nowTimeStamp for _ in range(numberOfFans)])
+        self._radFansTachPulseCounters = array('i', [0 for _ in range(numberOfFans)])
+        self._tachPeriodEstimator = TachPeriodEstimator(numberOfFans, TACH_PERIODS_AVERAGED, TACH_STALL_TIMEOUT_US)
+        self._radFansWindowRPMs = array('i', [0 for _ in range(numberOfFans)])
+        self._radFansRPMs = array('i', [0 for _ in range(numberOfFans)])
+        tachExtIntTimeStamps = self._radFansTachPinsLastTimeStamps
+        tachExtIntPulseCounters = self._radFansTachPulseCounters
+        tachExtIntPeriodEstimator = self._tachPeriodEstimator
+        tachExtIntLines[0] = 0
+        tachExtIntLines[1] = 0
+        for line in range(16):
+            tachExtIntLineToFan[line] = NO_FAN
+
+        self._tachBitToFan = bytearray(NO_FAN for _ in range(32))
+        self._polledFansMask = 0
+        polledMask = 0
+        for i, gpioIdrIndex in enumerate(pinsIdrIndexes):
+            line = gpioIdrIndex & 0x0f
+            onPortC = gpioIdrIndex & 0x80
+            if acquisitionMode == TACH_ACQUISITION_EXTINT and tachExtIntLineToFan[line] == NO_FAN:
+                try:
+                    pin = getattr(Pin.cpu, ('C' if onPortC else 'B') + str(line))
+                    tachExtIntLineToFan[line] = i
+                    if onPortC:
+                        tachExtIntLines[0] |= 1 << line
+                    self._tachExtInts.append(ExtInt(pin, ExtInt.IRQ_RISING_FALLING, Pin.PULL_NONE, tachEdgeISR))
+                    continue
+                except ValueError:      # EXTI line used elsewhere, poll this pin
+                    tachExtIntLineToFan[line] = NO_FAN
+                    tachExtIntLines[0] &= ~(1 << line)
+            bit = line + (16 if onPortC else 0)
+            self._tachBitToFan[bit] = i
+            self._polledFansMask |= 1 << i
+            polledMask |= 1 << bit
+        self._tachPinsMaskAndLastLevels = array('I', (polledMask, 0))
+
+    def _initTemperatureSensors(self):
+        self._sensorNames = tuple(sensor[0] for sensor in TEMPERATURE_SENSORS)
+        self._sensorThermistors = tuple(Thermistor(__import__(sensor[2])) for sensor in TEMPERATURE_SENSORS)
+        self._sensorCentiDegrees = array('i', [0 for _ in TEMPERATURE_SENSORS])
+        self._adcSweep = AdcSweep([sensor[1] for sensor in TEMPERATURE_SENSORS], ADC_SAMPLING_TIMER,
+                                  sampleRate=TEMPERATURE_BURST_SAMPLE_RATE,
+                                  samplesPerBurst=TEMPERATURE_SAMPLES_PER_BURST,
+                                  windowLength=NUMBER_OF_READINGS_ARRAY_SIZE)
+        self._adcSweep.prime()
+        self._updateTemperatures()
+
+    def _initFanCurve(self):
+        setDuties = (self._setTopRadFansPwnInPercent, self._setBottomRadTopFansPwnInPercent,
+                     self._setBottomRadBottomFansPwnInPercent)
+        fans = (TOP_RAD_ZONE_FANS, BOTTOM_RAD_TOP_ZONE_FANS, BOTTOM_RAD_BOTTOM_ZONE_FANS)
+        self._fanCurve = FanCurve(3, MINIMUM_RPM_DUTY_TIME, FAN_CURVE_DUTY_STEP, RADIATOR_FAN_MAX_RPM)
+        self._fanCurve.load(FAN_CURVE_CACHE_FILE)
+        self._fanCurveSweep = FanCurveSweep(self._fanCurve, setDuties, fans, TOTAL_NUMBER_OF_RADIATOR_FANS)
+
+    def _initZones(self):
+        setDuties = (self._setTopRadFansPwnInPercent, self._setBottomRadTopFansPwnInPercent,
+                     self._setBottomRadBottomFansPwnInPercent)
+        fans = (TOP_RAD_ZONE_FANS, BOTTOM_RAD_TOP_ZONE_FANS, BOTTOM_RAD_BOTTOM_ZONE_FANS)
+        zones = []
+        for i, name in enumerate(("top", "bottom top", "bottom bottom")):
+            temperatures = self._sensorCentiDegrees if ZONE_SENSORS[i] is not None else None
+            sensor = self._sensorNames.index(ZONE_SENSORS[i]) if ZONE_SENSORS[i] is not None else 0
+            zones.append(Zone(name, setDuties[i], fans[i], RADIATOR_FAN_MAX_RPM, MINIMUM_RPM_DUTY_TIME,
+                              weight=ZONE_WEIGHTS[i], temperatures=temperatures, sensor=sensor,
+                              setValue=ZONE_SENSOR_TARGET_TEMP, curve=self._fanCurve, channel=i))
+        self._zoneCoordinator = ZoneCoordinator(zones)
+
+    def _initPumpLink(self):
+        if PUMP_LINK_LOOPBACK:
+            self.pumpLoopback = PumpLinkLoopback()
+            stream = self.pumpLoopback
+        else:
+            # read from the receive buffer the UART interrupt fills, never waiting for a byte
+            stream = UART(PUMP_LINK_UART, PUMP_LINK_BAUDRATE, timeout=0, timeout_char=0, rxbuf=PUMP_LINK_RX_BUFFER)
+        self._pumpLink = PumpLink(stream, normalRpm=PUMP_NORMAL_RPM, lowRpm=PUMP_MIN_RPM,
+                                  timeoutMs=PUMP_LINK_TIMEOUT_MS, lostDemand=PUMP_LINK_LOST_DEMAND)
+
+    # Measures the fan curves again, about a minute with the fans stepped from minimum to full speed. From the REPL:
+    #     controller.sweepFanCurve(); controller.mainLoop()
+    def sweepFanCurve(self):
+        self._fanCurveSweep.start()
+        self._scheduler.start(self._fanCurveSweepTaskId, SWEEP_SAMPLE_MS)
+
+    def _print2Lines(self, line1, line2):
+        self._lcd.update((line1, line2))
+
+    # The splash screens are written after the first control update, from the same scheduler pass
+    def _helloMessage(self):
+        self._splashScreen = 0
+        self._splashTaskId = self._scheduler.addTask(self._splashScreenTask, 0)
+
+    def _splashScreenTask(self):
+        if self._splashScreen == 0:
+            self._print2Lines('  Watercooling', ' Fan Controller')
+            self._splashScreen = 1
+            self._scheduler.start(self._splashTaskId, SPLASH_SCREEN_MS)
+        else:
+            self._print2Lines('  Designed by', ' Philippe Vico')
+
+    def _setTopRadFansPwnInPercent(self, dutyTimeInPercent):
+        self._fansPwmDuties[0] = min(100, max(MINIMUM_RPM_DUTY_TIME, dutyTimeInPercent))
+        self._channelTopRadPwm.pulse_width_percent(self._fansPwmDuties[0])
+
+    def _setBottomRadTopFansPwnInPercent(self, dutyTimeInPercent):
+        self._fansPwmDuties[1] = min(100, max(MINIMUM_RPM_DUTY_TIME, dutyTimeInPercent))
+        self._channelBottomRadTopFansPwm.pulse_width_percent(self._fansPwmDuties[1])
+
+    def _setBottomRadBottomFansPwnInPercent(self, dutyTimeInPercent):
+        self._fansPwmDuties[2] = min(100, max(MINIMUM_RPM_DUTY_TIME, dutyTimeInPercent))
+        self._channelBottomRadBottomFansPwm.pulse_width_percent(self._fansPwmDuties[2])
+
+    def _setAllFansPwm(self):
+        self._setTopRadFansPwnInPercent(self._controlValue)
+        self._setBottomRadTopFansPwnInPercent(self._controlValue)
+        self._setBottomRadBottomFansPwnInPercent(self._controlValue)
+
+    # Called by _readTemperatureTask, one sweep for all the sensors
+    def _probeTemperatures(self):
+        self._adcSweep.sweep()
+
+    # Each sensor through its own table, the CPU inlet one from the MatLab curve fitting coefficients, including the
+    # 0.2 compensation with the other temp indicator
+    @micropython.native
+    def _updateTemperatures(self):
+        sweep = self._adcSweep
+        sums = sweep.sums
+        numberOfSamples = sweep.numberOfSamples
+        centiDegrees = self._sensorCentiDegrees
+        thermistors = self._sensorThermistors
+        for sensor in range(len(thermistors)):
+            centiDegrees[sensor] = thermistors[sensor].centiDegrees(sums[sensor], numberOfSamples)
+        self._cpuInWaterCentiDegrees = centiDegrees[CPU_IN_WATER_SENSOR]
+
+    def _refreshDisplay(self):
+        line1, line2 = self._lcdLines
+        LcdText.fill(line2, 0, LCD_COLUMNS, 0x20)
+        if self._fanCurveSweep.active:
+            LcdText.putBytes(line1, 0, b"Fan Curve Sweep ")
+            position = LcdText.putBytes(line2, 0, b"   Duty ")
+            position = LcdText.putInt(line2, position, self._fanCurve.minDuty + self._fanCurveSweep.point * FAN_CURVE_DUTY_STEP, 3)
+            LcdText.putBytes(line2, position, b" %")
+            self._lcd.update(self._lcdLines)
+            return
+        pumpScreens = 1 if self._pumpLink.frames else 0
+        numberOfScreens = (NUMBER_OF_SCREENS + pumpScreens + (1 if self._stoppedFansMask else 0)
+                           + (1 if self._slowFansMask else 0) + (1 if self._wornFansMask else 0))
+        if self._displayScreenCounter >= numberOfScreens:
+            self._displayScreenCounter = 0      # a failed, slow or worn fans screen went away
+
+        if self._displayScreenCounter == 0:
+            LcdText.putBytes(line1, 0, b"CPU Inlet Water ")
+            position = LcdText.putBytes(line2, 0, b"Temp ")
+            position = LcdText.putTenths(line2, position, self._cpuInWaterCentiDegrees)
+            LcdText.putBytes(line2, position, b" deg C")
+        elif self._displayScreenCounter == 1:
+            LcdText.putBytes(line1, 0, b"Radiator Fan RPM")
+            LcdText.putInt(line2, 6, self._averageFanRpm, 4)
+        elif self._displayScreenCounter < NUMBER_OF_SCREENS + pumpScreens:
+            LcdText.putBytes(line1, 0, b"    Pump RPM    ")
+            pumpLink = self._pumpLink
+            if not pumpLink.connected():
+                LcdText.putBytes(line2, 3, b"Link lost")
+            elif pumpLink.faults & PUMP_STOPPED:
+                LcdText.putBytes(line2, 4, b"Stopped")
+            else:
+                LcdText.putInt(line2, 6, pumpLink.rpm, 4)
+        else:
+            # the fan screens that have fans to show, in this order
+            screen = self._displayScreenCounter - NUMBER_OF_SCREENS - pumpScreens
+            if not self._stoppedFansMask:
+                screen += 1
+            if screen > 0 and not self._slowFansMask:
+                screen += 1
+            if screen == 0:
+                LcdText.putBytes(line1, 0, b"  Failed Fans   ")
+                LcdText.center(line2, self._lcdScratchLine, self._formatFans(self._lcdScratchLine, self._stoppedFansMask))
+            elif screen == 1:
+                LcdText.putBytes(line1, 0, b"   Slow Fans    ")
+                LcdText.center(line2, self._lcdScratchLine, self._formatSlowFans(self._lcdScratchLine))
+            else:
+                LcdText.putBytes(line1, 0, b"   Worn Fans    ")
+                LcdText.center(line2, self._lcdScratchLine, self._formatFans(self._lcdScratchLine, self._wornFansMask))
+
+        self._lcd.update(self._lcdLines)
+        self._displayScreenCounter = (self._displayScreenCounter + 1) % numberOfScreens
+
+    # "0 3 11" for the fans of mask, returns the length
+    def _formatFans(self, line, mask):
+        position = 0
+        for i in range(TOTAL_NUMBER_OF_RADIATOR_FANS):
+            if mask & (1 << i):
+                if position:
+                    position = LcdText.putBytes(line, position, b" ")
+                position = LcdText.putInt(line, position, i, 0)
+        return position
+
+    # "#2(612) #7(590)", stops once past the LCD width, returns the length
+    def _formatSlowFans(self, line):
+        position = 0
+        for i in range(TOTAL_NUMBER_OF_RADIATOR_FANS):
+            if position > LCD_COLUMNS:
+                break
+            if self._slowFansMask & (1 << i):
+                if position:
+                    position = LcdText.putBytes(line, position, b" ")
+                position = LcdText.putBytes(line, position, b"#")
+                position = LcdText.putInt(line, position, i, 0)
+                position = LcdText.putBytes(line, position, b"(")
+                position = LcdText.putInt(line, position, self._radFansRPMs[i], 0)
+                position = LcdText.putBytes(line, position, b")")
+        return position
+
+    # Both ports are sampled once per pass and packed in one word, GPIOB in bits 0-15 and GPIOC in bits 16-31.
+    # XORed with the last accepted levels, only the tach pins that changed are walked, so the cost of a pass
+    # does not depend on the number of fans.
+    @micropython.viper
+    def _pollTachPinsAndUpdatePulseCounters(self):
+        tachPins = ptr32(self._tachPinsMaskAndLastLevels)     # [0] mask of polled tach pins, [1] last accepted levels
+        if not tachPins[0]:
+            return
+        levels = (uint(readGPIOB_IDR()) & 0xffff) | ((uint(readGPIOC_IDR()) & 0xffff) << 16)
+        changed = (levels ^ tachPins[1]) & tachPins[0]
+        if not changed:
+            return
+        nowTimeStamp = int(utime.ticks_us())
+        bitToFan = ptr8(self._tachBitToFan)
+        lastTimeStamps = ptr32(self._radFansTachPinsLastTimeStamps)
+        pulseCounters = ptr32(self._radFansTachPulseCounters)
+        periodEstimator = self._tachPeriodEstimator
+        accepted = uint(0)
+        bit = 0
+        while changed:
+            if not (changed & 0xff):
+                changed >>= 8
+                bit += 8
+                continue
+            if changed & 1:
+                fan = int(bitToFan[bit])
+                elapsedTime = (nowTimeStamp - int(lastTimeStamps[fan])) & TICKS_MAX
+                if elapsedTime > TACH_DEBOUNCE_US:     # if it is less than 1 ms, we consider it a bounce and disregard it
+                    # We record the change on any transition, L to H or H to L
+                    lastTimeStamps[fan] = nowTimeStamp
+                    accepted |= uint(1) << bit
+                    # But we only count rising edges
+                    if levels & (uint(1) << bit):
+                        pulseCounters[fan] += 1
+                        periodEstimator.risingEdge(fan, nowTimeStamp)
+            changed >>= 1
+            bit += 1
+        tachPins[1] = tachPins[1] ^ accepted
+
+    @micropython.native
+    def _calculateFansRPM(self):
+        arrPC = self._radFansTachPulseCounters
+        arrRPM = self._radFansWindowRPMs
+        irqState = pyb.disable_irq()    # critical section, tachEdgeISR updates the counters
+        for i in range(len(arrPC)):
+            arrRPM[i] = (arrPC[i] << 3) #if i > 0 else 1245
+            arrPC[i] = 0
+        pyb.enable_irq(irqState)        # end of critical section
+        self._refreshFansRPM()
+
+    # Called 10 times per second and after each pulse count window
+    @micropython.native
+    def _refreshFansRPM(self):
+        irqState = pyb.disable_irq()    # critical section, tachEdgeISR updates the period estimates
+        self._tachPeriodEstimator.checkStalls(utime.ticks_us())
+        pyb.enable_irq(irqState)        # end of critical section
+        periodRPMs = self._tachPeriodEstimator.rpms
+        windowRPMs = self._radFansWindowRPMs
+        arrRPM = self._radFansRPMs
+        sumRpm = 0
+        numberOfRunningFans = 0
+        for i in range(len(arrRPM)):
+            rpm = (periodRPMs[i] * RPM_PERIOD_ESTIMATE_PERCENT + windowRPMs[i] * (100 - RPM_PERIOD_ESTIMATE_PERCENT)) // 100
+            arrRPM[i] = rpm
+            if rpm > 0:
+                sumRpm += rpm
+                numberOfRunningFans += 1
+        # Rounded to 10 RPM
+        self._averageFanRpm = ((sumRpm + 5 * numberOfRunningFans) // (10 * numberOfRunningFans)) * 10 if numberOfRunningFans else 0
+        health = self._fanHealth
+        health.update(arrRPM, self._fansPwmDuties)
+        self._stoppedFansMask = health.stalledMask
+        self._slowFansMask = health.slowMask
+        self._wornFansMask = health.erraticMask | health.degradingMask
+
+    ##### Scheduler tasks
+
+    # Every TEMPERATURE_READING_PERIOD_MS
+    def _readTemperatureTask(self):
+        self._probeTemperatures()
+        self._updateTemperatures()
+        self._refreshFansRPM()
+        if self.bootTimesMs[BOOT_FIRST_RPM] < 0 and self._averageFanRpm:
+            self.bootTimesMs[BOOT_FIRST_RPM] = utime.ticks_ms()
+            self._scheduler.start(self._adjustFansRpmTaskId)     # the spin-up is over, control now
+
+    # Every FANS_RPM_WINDOW_MS
+    def _calculateFansRpmTask(self):
+        self._calculateFansRPM()
+
+    # Every ADJUST_FANS_RPM_PERIOD_MS
+    def _adjustFansRpmTask(self):
+        if (self.bootTimesMs[BOOT_FIRST_RPM] < 0
+                and utime.ticks_diff(utime.ticks_ms(), self.bootTimesMs[BOOT_PWM]) < FAN_SPIN_UP_MAX_MS):
+            return                  # the fans spin up at full duty
+        # Note: the water temperature is updated in the temperature task. The PID output is the cooling demand,
+        # split across the zones, at least the floor the pump state sets
+        self._controlValue = max(self._pidController.update(self._cpuInWaterCentiDegrees), self._pumpLink.demandFloor())
+        if self._fanCurveSweep.active:
+            return                  # the sweep drives the fans, the PID follows the water to take over when it ends
+        self._zoneCoordinator.update(self._controlValue, self._radFansRPMs)
+        if self.bootTimesMs[BOOT_FIRST_CONTROL] < 0:
+            self.bootTimesMs[BOOT_FIRST_CONTROL] = utime.ticks_ms()
+        if self._fanCurveSweepPending and self._cpuInWaterCentiDegrees <= int(100 * TARGET_WATER_TEMP):
+            # the first boot sweep, with the water cool enough for the fans at minimum duty
+            self._fanCurveSweepPending = False
+            self.sweepFanCurve()
+
+    # Every SWEEP_SAMPLE_MS while the fan curves are measured
+    def _fanCurveSweepTask(self):
+        if self._cpuInWaterCentiDegrees > int(100 * (TARGET_WATER_TEMP + FAN_CURVE_SWEEP_MAX_TEMP_RISE)):
+            # back to temperature control, with the points measured so far if there are any
+            if self._fanCurveSweep.stop():
+                self._fanCurve.save(FAN_CURVE_CACHE_FILE)
+        elif self._fanCurveSweep.step(self._radFansRPMs):
+            self._fanCurve.save(FAN_CURVE_CACHE_FILE)
+        if not self._fanCurveSweep.active:
+            self._scheduler.stop(self._fanCurveSweepTaskId)
+            self._zoneCoordinator.restart()
+
+    # Every FAN_CURVE_SAVE_PERIOD_MS, the curve learned from the fans as they age
+    def _saveFanCurveTask(self):
+        if self._fanCurve.measured and not self._fanCurveSweep.active and self._fanCurve.needsSave():
+            self._fanCurve.save(FAN_CURVE_CACHE_FILE)
+
+    # Every HISTORY_RECORD_PERIOD_MS
+    def _historyTask(self):
+        self._historyLog.append(self._cpuInWaterCentiDegrees, self._radFansRPMs, self._fansPwmDuties,
+                                self._pidController, self._stoppedFansMask, self._slowFansMask)
+        if self._stoppedFansMask != self._historyStoppedFansMask:
+            # a fan stopped or started again, in flash now rather than when the page is full
+            self._historyStoppedFansMask = self._stoppedFansMask
+            self._historyLog.flush()
+
+    # Every SECONDS_BETWEEN_DISPLAY_UPDATE
+    def _refreshDisplayTask(self):
+        if not self._lcd.ready():
+            self._scheduler.start(self._displayTaskId, 1)     # a clear is executing, try again in 1 ms
+            return
+        self._refreshDisplay()
+
+    # Every PUMP_LINK_POLL_MS
+    def _pumpLinkTask(self):
+        self._pumpLink.poll()
+
+    # Every second with the instrumentation on. The tach periods the polled fans should have at their duty, or at
+    # their RPM when faster
+    def _instrumentationTask(self):
+        periods = self._instrumentationTachPeriodsUs
+        for channel, fans in enumerate((TOP_RAD_ZONE_FANS, BOTTOM_RAD_TOP_ZONE_FANS, BOTTOM_RAD_BOTTOM_ZONE_FANS)):
+            expectedRpm = self._fanCurve.rpmFor(channel, self._fansPwmDuties[channel])
+            for fan in fans:
+                rpm = max(expectedRpm, self._radFansRPMs[fan])
+                periods[fan] = US_PER_MINUTE_PER_PULSE // rpm if rpm > 0 and self._polledFansMask & (1 << fan) else 0
+        self._instrumentation.second(periods)
+
+    # Every 1000 // TELEMETRY_RATE_HZ ms
+    def _sendTelemetryTask(self):
+        self._telemetry.send(self._cpuInWaterCentiDegrees, self._radFansRPMs, self._fansPwmDuties, self._pidController)
+
+    # From the REPL, once main.py is interrupted: controller.printHistory(60). One line per record of the last
+    # minutes, as in HistoryLog.py with the boot number first, or host/history.py on a copy of the file.
+    def printHistory(self, minutes=60):
+        self._historyLog.printRecords(minutes)
+
+    # From the REPL, once main.py is interrupted: controller.printFanHealth()
+    def printFanHealth(self):
+        self._fanHealth.printState()
+
+    # From the REPL, once main.py is interrupted: controller.printTemperatures()
+    def printTemperatures(self):
+        sweep = self._adcSweep
+        for sensor, name in enumerate(self._sensorNames):
+            print("%-8s %6.2f deg C, ADC %7.2f" % (name, self._sensorCentiDegrees[sensor] / 100, sweep.average(sensor)))
+        print("%d sweeps, %d overruns" % (sweep.sweeps, sweep.overruns))
+
+    # From the REPL, once main.py is interrupted: controller.printPumpLink()
+    def printPumpLink(self):
+        self._pumpLink.printState()
+
+    # From the REPL, once main.py is interrupted: controller.instrument(); controller.mainLoop(), interrupted again
+    # later: controller.printInstrumentation(). stream=True also writes a line of loop figures every second on the
+    # USB VCP. controller.instrument(False) goes back to the plain main loop.
+    def instrument(self, on=True, stream=False):
+        instrumentation = self._instrumentation
+        instrumentation.enabled = on
+        instrumentation.reset()
+        instrumentation.streamTo(pyb.USB_VCP() if on and stream else None)
+        self._scheduler.resetStatistics()
+        if on:
+            self._scheduler.start(self._instrumentationTaskId, 1000)
+        else:
+            self._scheduler.stop(self._instrumentationTaskId)
+
+    def printInstrumentation(self):
+        self._instrumentation.dump()
+        scheduler = self._scheduler
+        for name, task in self._namedTasks():
+            print("%-15s %6d us average, %6d us max, %d runs, %d overruns" % (
+                name, scheduler.averageRunUs[task], scheduler.maxRunUs[task], scheduler.runs[task],
+                scheduler.overruns[task]))
+
+    def _namedTasks(self):
+        tasks = (("temperature", self._temperatureTaskId), ("PID", self._adjustFansRpmTaskId),
+                 ("display", self._displayTaskId), ("splash", self._splashTaskId),
+                 ("fans RPM", self._fansRpmTaskId), ("pump link", self._pumpLinkTaskId),
+                 ("history", self._historyTaskId), ("fan curve sweep", self._fanCurveSweepTaskId),
+                 ("fan curve save", self._saveFanCurveTaskId), ("instrumentation", self._instrumentationTaskId))
+        return tasks + (("telemetry", self._telemetryTaskId),) if TELEMETRY_RATE_HZ else tasks
+
+    # From the REPL, once main.py is interrupted: controller.printBootTimes()
+    def printBootTimes(self):
+        for step, name in enumerate(BOOT_STEPS):
+            print("%-14s %6d ms after reset" % (name, self.bootTimesMs[step]))
+
+    # Tasks run between two tach poll passes. With the instrumentation on, the loop that feeds it runs instead and
+    # this one does not pay for it
+    def mainLoop(self):
+        if self._instrumentation.enabled:
+            self._instrumentedMainLoop()
+        while True:
+            self._scheduler.runOnce()
+            self._pollTachPinsAndUpdatePulseCounters()
+
+    # Two clock reads per pass: the pass time runs from one poll to the next, the scheduler time includes the
+    # instrumentation of the previous pass
+    def _instrumentedMainLoop(self):
+        instrumentation = self._instrumentation
+        scheduler = self._scheduler
+        poll = self._pollTachPinsAndUpdatePulseCounters
+        lastPollTimeStamp = utime.ticks_us()
+        endTimeStamp = lastPollTimeStamp
+        while True:
+            scheduler.runOnce()
+            pollTimeStamp = utime.ticks_us()
+            poll()
+            nowTimeStamp = utime.ticks_us()
+            instrumentation.loopPass(utime.ticks_diff(pollTimeStamp, lastPollTimeStamp),
+                                     utime.ticks_diff(nowTimeStamp, pollTimeStamp),
+                                     utime.ticks_diff(pollTimeStamp, endTimeStamp))
+            lastPollTimeStamp = pollTimeStamp
+            endTimeStamp = nowTimeStamp
+
+    # Runs the main loop for a while with the garbage collector off and prints the heap bytes allocated, in all and by
+    # each task. From the REPL, once main.py is interrupted:
+    #     controller.checkLoopAllocations()
+    # Every running task is made due at the start, so that each one runs at least once in the window, the history
+    # record every 30 s and the hourly fan curve save included; the save only writes, and opens a file, when the curve
+    # moved. Returns the bytes allocated. Only the board can run it, CPython has no gc.mem_alloc.
+    def checkLoopAllocations(self, seconds=5):
+        scheduler = self._scheduler
+        callbacks = scheduler._callbacks
+        numberOfTasks = scheduler._numberOfTasks
+        originals = callbacks[:numberOfTasks]
+        taskBytes = array('i', [0 for _ in range(numberOfTasks)])
+        taskRuns = array('i', [0 for _ in range(numberOfTasks)])
+
+        def measured(task, callback):
+            def run():
+                startAllocated = gc.mem_alloc()
+                callback()
+                taskBytes[task] += gc.mem_alloc() - startAllocated
+                taskRuns[task] += 1
+            return run
+        for task in range(numberOfTasks):
+            callbacks[task] = measured(task, originals[task])
+        durationMs = 1000 * seconds
+        passes = 0
+        gc.collect()
+        gc.disable()
+        try:
+            for task in range(numberOfTasks):
+                if scheduler.isActive(task):
+                    scheduler.start(task)
+            startAllocated = gc.mem_alloc()
+            startTime = utime.ticks_ms()
+            while utime.ticks_diff(utime.ticks_ms(), startTime) < durationMs:
+                scheduler.runOnce()
+                self._pollTachPinsAndUpdatePulseCounters()
+                passes += 1
+            allocated = gc.mem_alloc() - startAllocated
+        finally:
+            gc.enable()
+            for task in range(numberOfTasks):
+                callbacks[task] = originals[task]
+        print("%d loop passes in %d s, %d bytes allocated, %d bytes per pass" % (passes, seconds, allocated, allocated // passes))
+        for name, task in self._namedTasks():
+            print("%-15s %5d runs %6d bytes" % (name, taskRuns[task], taskBytes[task]))
+        micropython.mem_info()
+        return allocated
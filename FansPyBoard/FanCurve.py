@@ -0,0 +1,324 @@
+#########################################################
+#                                                       #
+#                      FanCurve.py                      #
+#     Learned PWM duty to RPM curve per PWM channel     #
+#                                                       #
+#########################################################
+
+# FanCurve holds, per PWM channel, the settled RPM of its fans at
+# duties minDuty, minDuty + dutyStep, ... 100 %. From it a table of
+# the inverse, duty in 1/256 % at evenly spaced RPMs, is rebuilt
+# whenever the curve changes, so dutyQ8For() finds the duty for a
+# target RPM with one index and one interpolation: the zones set
+# their feed-forward duty in one step instead of assuming the RPM is
+# proportional to the duty.
+#
+# The curve starts as the proportional one, is measured by a
+# FanCurveSweep and is then kept up to date by learn() with the RPM
+# of fans that have settled at a duty, as they age. learn() only
+# marks the inverse table of a channel for a rebuild when a point
+# moved, the rebuild happens on the next dutyQ8For(). The measured
+# points, the first measuredPoints of each channel, are cached in a
+# small file so a reboot does not sweep again:
+#
+#     2s    magic b'FC'
+#     6 B   version, number of channels, number of points, minDuty, dutyStep, measured points M
+#     C*M H settled RPMs, channel after channel
+#     H     Fletcher-16 of all the previous bytes
+#
+# A file with another version or layout, or a bad checksum, is
+# ignored and the fans are swept again. A sweep abandoned after M
+# points leaves M measured points; the points above them follow from
+# the last measured one in proportion to the duty, in RAM only, and
+# are learned from then on.
+
+import struct
+import uos
+import utime
+from array import array
+from Checksum import fletcher16
+
+
+CURVE_MAGIC = b'FC'
+CURVE_VERSION = const(2)
+CURVE_HEADER_SIZE = const(8)
+INVERSE_POINTS = const(64)
+LEARN_DIVISOR = const(8)                # learn() moves the points around the duty by 1/8 of the error
+LEARN_SCALE_DIVISOR = const(32)         # and the whole curve by 1/32 of the relative error, fans age evenly
+SAVE_THRESHOLD_PERCENT = const(2)       # a point must move this much from the saved curve to be worth a flash write
+
+
+class FanCurve:
+    def __init__(self, numberOfChannels, minDuty, dutyStep, nominalMaxRpm):
+        if (100 - minDuty) % dutyStep:
+            raise ValueError('dutyStep must divide 100 - minDuty')
+        self.numberOfChannels = numberOfChannels
+        self.minDuty = minDuty
+        self.dutyStep = dutyStep
+        self.numberOfPoints = (100 - minDuty) // dutyStep + 1
+        self.rpms = array('H', (nominalMaxRpm * (minDuty + point * dutyStep) // 100
+                                for _ in range(numberOfChannels) for point in range(self.numberOfPoints)))
+        self._savedRpms = array('H', self.rpms)
+        self._inverse = array('H', [0 for _ in range(numberOfChannels * INVERSE_POINTS)])
+        self._rpmSteps = array('H', [0 for _ in range(numberOfChannels)])
+        self._dirty = bytearray(numberOfChannels)      # the inverse table of the channel is out of date
+        self._file = bytearray(CURVE_HEADER_SIZE + 2 * len(self.rpms) + 2)
+        self.measuredPoints = 0         # points of each channel from a sweep, the lowest ones
+        self.measured = False           # True once at least one point was swept or loaded
+        self.learnedUpdates = 0
+        for channel in range(numberOfChannels):
+            self._rebuild(channel)
+
+    def maxRpm(self, channel):
+        return self.rpms[(channel + 1) * self.numberOfPoints - 1]
+
+    def minRpm(self, channel):
+        return self.rpms[channel * self.numberOfPoints]
+
+    # Settled RPM at duty percent, interpolated between the points
+    def rpmFor(self, channel, duty):
+        offset = max(0, min(100 - self.minDuty, duty - self.minDuty))
+        point = offset // self.dutyStep
+        first = channel * self.numberOfPoints + point
+        if point == self.numberOfPoints - 1:
+            return self.rpms[first]
+        fraction = offset - point * self.dutyStep
+        return self.rpms[first] + (self.rpms[first + 1] - self.rpms[first]) * fraction // self.dutyStep
+
+    # Duty in 1/256 % that gives rpm, minDuty below the curve and 100 % above it
+    def dutyQ8For(self, channel, rpm):
+        if self._dirty[channel]:
+            self._rebuild(channel)
+        step = self._rpmSteps[channel]
+        index = rpm // step
+        first = channel * INVERSE_POINTS + index
+        if index >= INVERSE_POINTS - 1:
+            return self._inverse[channel * INVERSE_POINTS + INVERSE_POINTS - 1]
+        low = self._inverse[first]
+        return low + (self._inverse[first + 1] - low) * (rpm - index * step) // step
+
+    # The fans of channel settled at rpm with duty percent applied
+    def learn(self, channel, duty, rpm):
+        if duty < self.minDuty or duty > 100:
+            return
+        predicted = self.rpmFor(channel, duty)
+        error = rpm - predicted
+        moved = False
+        if predicted:
+            start = channel * self.numberOfPoints
+            for index in range(start, start + self.numberOfPoints):
+                moved |= self._nudge(index, self.rpms[index] * error // (predicted * LEARN_SCALE_DIVISOR))
+            error = rpm - self.rpmFor(channel, duty)
+        offset = duty - self.minDuty
+        point = offset // self.dutyStep
+        fraction = offset - point * self.dutyStep
+        first = channel * self.numberOfPoints + point
+        # the rest of the error goes to the two points around the duty, in proportion to how close each one is
+        moved |= self._nudge(first, error * (self.dutyStep - fraction) // (self.dutyStep * LEARN_DIVISOR))
+        if fraction:
+            moved |= self._nudge(first + 1, error * fraction // (self.dutyStep * LEARN_DIVISOR))
+        if moved:
+            self._dirty[channel] = 1
+        self.learnedUpdates += 1
+
+    # Returns True when the point moved
+    def _nudge(self, index, change):
+        if not change:
+            return False
+        rpm = self.rpms[index]
+        self.rpms[index] = max(0, min(0xffff, rpm + change))
+        return self.rpms[index] != rpm
+
+    # The points from measuredPoints up follow from the last measured one in proportion to the duty
+    def _extendMeasured(self):
+        lastPoint = self.measuredPoints - 1
+        lastDuty = self.minDuty + lastPoint * self.dutyStep
+        for channel in range(self.numberOfChannels):
+            first = channel * self.numberOfPoints
+            lastRpm = self.rpms[first + lastPoint]
+            for point in range(lastPoint + 1, self.numberOfPoints):
+                self.rpms[first + point] = min(0xffff, lastRpm * (self.minDuty + point * self.dutyStep) // lastDuty)
+
+    # Inverse table of channel, duty at rpm = i * rpmStep for i in 0 .. INVERSE_POINTS - 1
+    def _rebuild(self, channel):
+        first = channel * self.numberOfPoints
+        last = first + self.numberOfPoints - 1
+        step = max(1, (self.rpms[last] + INVERSE_POINTS - 2) // (INVERSE_POINTS - 1))
+        self._rpmSteps[channel] = step
+        self._dirty[channel] = 0
+        inverse = self._inverse
+        point = first
+        lowRpm = self.rpms[first]
+        highRpm = max(lowRpm, self.rpms[first + 1])
+        for i in range(INVERSE_POINTS):
+            rpm = i * step
+            # the points are walked once, a measured curve that dips is read as flat
+            while point < last - 1 and rpm >= highRpm:
+                point += 1
+                lowRpm = highRpm
+                highRpm = max(lowRpm, self.rpms[point + 1])
+            dutyQ8 = (self.minDuty + (point - first) * self.dutyStep) << 8
+            if rpm <= lowRpm:
+                duty = dutyQ8
+            elif rpm >= highRpm:
+                duty = dutyQ8 + (self.dutyStep << 8)
+            else:
+                duty = dutyQ8 + (self.dutyStep << 8) * (rpm - lowRpm) // (highRpm - lowRpm)
+            inverse[channel * INVERSE_POINTS + i] = min(100 << 8, duty)
+
+    # True when a measured point moved more than SAVE_THRESHOLD_PERCENT since the last load or save
+    def needsSave(self):
+        for channel in range(self.numberOfChannels):
+            first = channel * self.numberOfPoints
+            for i in range(first, first + self.measuredPoints):
+                if abs(self.rpms[i] - self._savedRpms[i]) * 100 > self._savedRpms[i] * SAVE_THRESHOLD_PERCENT:
+                    return True
+        return False
+
+    # Writes the measured points, there must be some
+    def save(self, path):
+        data = self._file
+        measuredPoints = self.measuredPoints
+        struct.pack_into('<2sBBBBBB', data, 0, CURVE_MAGIC, CURVE_VERSION, self.numberOfChannels,
+                         self.numberOfPoints, self.minDuty, self.dutyStep, measuredPoints)
+        offset = CURVE_HEADER_SIZE
+        for channel in range(self.numberOfChannels):
+            first = channel * self.numberOfPoints
+            for i in range(first, first + measuredPoints):
+                struct.pack_into('<H', data, offset, self.rpms[i])
+                offset += 2
+        struct.pack_into('<H', data, offset, fletcher16(data, offset))
+        # written next to the cache then renamed, a reset while writing leaves the old file
+        temporaryPath = path + '.new'
+        with open(temporaryPath, 'wb') as output:
+            output.write(memoryview(data)[:offset + 2])
+        try:
+            uos.rename(temporaryPath, path)
+        except OSError:         # FAT does not rename over a file
+            uos.remove(path)
+            uos.rename(temporaryPath, path)
+        for i in range(len(self.rpms)):
+            self._savedRpms[i] = self.rpms[i]
+
+    # Returns True when the file holds a valid curve for this layout
+    def load(self, path):
+        data = self._file
+        try:
+            with open(path, 'rb') as source:
+                length = source.readinto(data)
+        except OSError:
+            return False
+        if length < CURVE_HEADER_SIZE + 2:
+            return False
+        (magic, version, numberOfChannels, numberOfPoints, minDuty, dutyStep,
+         measuredPoints) = struct.unpack_from('<2sBBBBBB', data, 0)
+        offset = CURVE_HEADER_SIZE + 2 * numberOfChannels * measuredPoints
+        if (magic != CURVE_MAGIC or version != CURVE_VERSION or numberOfChannels != self.numberOfChannels
+                or numberOfPoints != self.numberOfPoints or minDuty != self.minDuty or dutyStep != self.dutyStep
+                or not 0 < measuredPoints <= numberOfPoints or length != offset + 2
+                or struct.unpack_from('<H', data, offset)[0] != fletcher16(data, offset)):
+            return False
+        offset = CURVE_HEADER_SIZE
+        for channel in range(numberOfChannels):
+            first = channel * numberOfPoints
+            for i in range(first, first + measuredPoints):
+                self.rpms[i] = struct.unpack_from('<H', data, offset)[0]
+                offset += 2
+        self.measuredPoints = measuredPoints
+        self._extendMeasured()
+        for i in range(len(self.rpms)):
+            self._savedRpms[i] = self.rpms[i]
+        for channel in range(self.numberOfChannels):
+            self._rebuild(channel)
+        self.measured = True
+        return True
+
+
+SWEEP_SAMPLE_MS = const(500)            # step() period
+SWEEP_SETTLE_MS = const(3000)           # at least this long at each duty
+SWEEP_MAX_POINT_MS = const(10000)       # a point that has not settled by then is recorded anyway
+SWEEP_SETTLED_PERCENT = const(1)        # settled when two samples in a row are this close
+
+
+class FanCurveSweep:
+    # Measures a FanCurve: steps every channel at once from minDuty to
+    # 100 % and records the RPM of each fan and the average of the
+    # running fans of each channel once they have settled. step() is
+    # called every SWEEP_SAMPLE_MS by a scheduler task and does not
+    # block. rpms are the fan RPMs, setDuties the duty setters of the
+    # channels and fanGroups the fans of each channel.
+    def __init__(self, curve, setDuties, fanGroups, numberOfFans):
+        self._curve = curve
+        self._setDuties = setDuties
+        self._fanGroups = tuple(array('B', fans) for fans in fanGroups)
+        self.fanRpms = array('H', [0 for _ in range(numberOfFans * curve.numberOfPoints)])
+        self._averages = array('H', [0 for _ in range(curve.numberOfChannels)])
+        self.point = 0
+        self.active = False
+        self._pointStart = 0
+
+    def start(self):
+        self.active = True
+        self._startPoint(0)
+
+    # Abandons the sweep. Returns True when it recorded points, they are kept and the curve is worth saving: past
+    # the points the curve had measured before, the ones above follow from the last one in proportion to the duty
+    def stop(self):
+        self.active = False
+        curve = self._curve
+        if not self.point:
+            return False
+        if self.point > curve.measuredPoints:
+            curve.measuredPoints = self.point
+            curve._extendMeasured()
+        for channel in range(curve.numberOfChannels):
+            curve._rebuild(channel)
+        curve.measured = True
+        return True
+
+    def _startPoint(self, point):
+        self.point = point
+        duty = self._curve.minDuty + point * self._curve.dutyStep
+        for setDuty in self._setDuties:
+            setDuty(duty)
+        for channel in range(len(self._averages)):
+            self._averages[channel] = 0
+        self._pointStart = utime.ticks_ms()
+
+    # Returns True when the sweep is over and the curve measured
+    def step(self, rpms):
+        if not self.active:
+            return False
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self._pointStart)
+        if elapsed < SWEEP_SETTLE_MS - SWEEP_SAMPLE_MS:
+            return False
+        curve = self._curve
+        settled = True
+        for channel in range(len(self._fanGroups)):
+            total = 0
+            running = 0
+            for fan in self._fanGroups[channel]:
+                if rpms[fan] > 0:
+                    total += rpms[fan]
+                    running += 1
+            average = total // running if running else 0
+            if abs(average - self._averages[channel]) * 100 > average * SWEEP_SETTLED_PERCENT:
+                settled = False
+            self._averages[channel] = average
+        if elapsed < SWEEP_SETTLE_MS or (not settled and elapsed < SWEEP_MAX_POINT_MS):
+            return False
+        for channel in range(len(self._fanGroups)):
+            # a channel without running fans keeps its curve
+            if self._averages[channel]:
+                curve.rpms[channel * curve.numberOfPoints + self.point] = self._averages[channel]
+            for fan in self._fanGroups[channel]:
+                self.fanRpms[fan * curve.numberOfPoints + self.point] = min(rpms[fan], 0xffff)
+        if self.point < curve.numberOfPoints - 1:
+            self._startPoint(self.point + 1)
+            return False
+        for channel in range(curve.numberOfChannels):
+            curve._rebuild(channel)
+        curve.measuredPoints = curve.numberOfPoints
+        curve.measured = True
+        self.active = False
+        return True
@@ -0,0 +1,225 @@
+#########################################################
+#                                                       #
+#                      FanHealth.py                     #
+#     Stalled, slow, erratic and degrading fans         #
+#                                                       #
+#########################################################
+
+# update() is called with every new set of fan RPMs, 10 times per
+# second. Each fan RPM is divided by the RPM the FanCurve gives for
+# the duty of its PWM channel, so a fan is judged against what its
+# duty should give and not against fans on other channels, and that
+# ratio (Q14, 16384 for a fan right on the curve) feeds per fan:
+#
+#   - a fast EWMA, over about 8 updates, for the slow state
+#   - an EWMA of the squared deviation from the fast EWMA, over about
+#     256 updates, for the erratic state. The deviation is clamped to
+#     twice the erratic threshold, so that a fan changing speed once
+#     does not look erratic
+#
+# The curve learns from the fans as they age (FanCurve.learn), so a
+# fan wearing out is told by the others on its channel instead: the
+# ratio of its RPM to the average of those that are not slow feeds a
+# slow EWMA, over about 1024 updates, for the degrading state. A
+# channel whose fans all age evenly shows in its curve, not here.
+#
+# Each state is entered past one threshold and left past another,
+# the stalled state after a number of updates in a row, so a fan
+# near a threshold does not flap. After a duty change of
+# DUTY_STEP_PERCENT or more on its channel, and after it starts
+# again, a fan is not sampled for SETTLE_UPDATES while it gets to its
+# new speed. A stalled fan is neither slow nor erratic.
+#
+# The states are read as bitmasks, bit i for fan i: stalledMask,
+# slowMask, erraticMask, degradingMask. All the state is in
+# preallocated arrays, update() does not allocate.
+
+from array import array
+
+
+RATIO_ONE = const(16384)                # Q14, a fan at the RPM of the curve
+RATIO_MAX = const(32767)
+DEVIATION_MAX = const(8191)             # 0.5
+FAST_SHIFT = const(3)
+PEER_SHIFT = const(10)
+VARIANCE_SHIFT = const(8)
+SETTLE_UPDATES = const(30)
+DUTY_STEP_PERCENT = const(3)
+STALL_ENTER_UPDATES = const(3)          # 0 RPM this many updates in a row
+STALL_EXIT_UPDATES = const(10)
+SLOW_ENTER_RATIO = const(13107)         # 80 % of the curve
+SLOW_EXIT_RATIO = const(13926)          # 85 %
+DEGRADING_ENTER_RATIO = const(15073)    # 92 % of the other fans of the channel
+DEGRADING_EXIT_RATIO = const(15565)     # 95 %
+ERRATIC_ENTER_DEVIATION = const(819)    # 5 % standard deviation
+ERRATIC_EXIT_DEVIATION = const(573)     # 3.5 %
+ERRATIC_CLAMP_DEVIATION = const(1638)   # 10 %
+
+
+class FanHealth:
+    def __init__(self, numberOfFans, fanGroups, curve):
+        self._numberOfFans = numberOfFans
+        self._curve = curve
+        # fanGroups[channel] are the fans of PWM channel channel
+        self._fanChannels = bytearray(numberOfFans)
+        for channel, fans in enumerate(fanGroups):
+            for fan in fans:
+                self._fanChannels[fan] = channel
+        self._numberOfChannels = len(fanGroups)
+        self._channelDuties = bytearray(self._numberOfChannels)
+        self._expectedRpms = array('i', [0 for _ in range(self._numberOfChannels)])
+        # RPM sums and number of the running fans per channel that are not slow, for the peer ratios
+        self._channelRpmSums = array('i', [0 for _ in range(self._numberOfChannels)])
+        self._channelRunningFans = bytearray(self._numberOfChannels)
+        self._fastRatios = array('i', [RATIO_ONE for _ in range(numberOfFans)])
+        self._peerRatios = array('i', [RATIO_ONE << PEER_SHIFT for _ in range(numberOfFans)])     # Q24
+        self._variances = array('i', [0 for _ in range(numberOfFans)])                          # Q28
+        self._stallCounts = bytearray(numberOfFans)
+        self._holdoffs = bytearray(numberOfFans)
+        self.stalledMask = (1 << numberOfFans) - 1       # until the fans have spun up
+        self.slowMask = 0
+        self.erraticMask = 0
+        self.degradingMask = 0
+
+    # rpms per fan, duties in percent per PWM channel
+    @micropython.native
+    def update(self, rpms, duties):
+        curve = self._curve
+        for channel in range(self._numberOfChannels):
+            duty = duties[channel]
+            if abs(duty - self._channelDuties[channel]) >= DUTY_STEP_PERCENT:
+                self._channelDuties[channel] = duty
+                for fan in range(self._numberOfFans):
+                    if self._fanChannels[fan] == channel:
+                        self._holdoffs[fan] = SETTLE_UPDATES
+            self._expectedRpms[channel] = curve.rpmFor(channel, duty)
+        self._updateFans(rpms)
+
+    @micropython.viper
+    def _updateFans(self, rpms):
+        measured = ptr32(rpms)
+        expected = ptr32(self._expectedRpms)
+        fanChannels = ptr8(self._fanChannels)
+        channelRpmSums = ptr32(self._channelRpmSums)
+        channelRunningFans = ptr8(self._channelRunningFans)
+        fastRatios = ptr32(self._fastRatios)
+        peerRatios = ptr32(self._peerRatios)
+        variances = ptr32(self._variances)
+        stallCounts = ptr8(self._stallCounts)
+        holdoffs = ptr8(self._holdoffs)
+        stalled = int(self.stalledMask)
+        slow = int(self.slowMask)
+        erratic = int(self.erraticMask)
+        degrading = int(self.degradingMask)
+        numberOfFans = int(self._numberOfFans)
+        channel = 0
+        while channel < int(self._numberOfChannels):
+            channelRpmSums[channel] = 0
+            channelRunningFans[channel] = 0
+            channel += 1
+        fan = 0
+        while fan < numberOfFans:
+            if not (stalled | slow) & (1 << fan):
+                channel = int(fanChannels[fan])
+                channelRpmSums[channel] += int(measured[fan])
+                channelRunningFans[channel] += 1
+            fan += 1
+
+        fan = 0
+        while fan < numberOfFans:
+            bit = 1 << fan
+            rpm = int(measured[fan])
+            channel = int(fanChannels[fan])
+            # stalled, counting the updates in a row that say otherwise
+            if stalled & bit:
+                if rpm > 0:
+                    stallCounts[fan] += 1
+                    if int(stallCounts[fan]) >= STALL_EXIT_UPDATES:
+                        stalled &= ~bit
+                        stallCounts[fan] = 0
+                        holdoffs[fan] = SETTLE_UPDATES
+                else:
+                    stallCounts[fan] = 0
+            elif rpm == 0:
+                stallCounts[fan] += 1
+                if int(stallCounts[fan]) >= STALL_ENTER_UPDATES:
+                    stalled |= bit
+                    stallCounts[fan] = 0
+                    slow &= ~bit
+                    erratic &= ~bit
+            else:
+                stallCounts[fan] = 0
+            expectedRpm = int(expected[channel])
+            if stalled & bit or rpm == 0 or expectedRpm <= 0:
+                pass
+            elif holdoffs[fan]:
+                holdoffs[fan] -= 1
+            else:
+                ratio = (rpm << 14) // expectedRpm
+                if ratio > RATIO_MAX:
+                    ratio = RATIO_MAX
+                mean = int(fastRatios[fan])
+                deviation = ratio - mean
+                if deviation > DEVIATION_MAX:
+                    deviation = DEVIATION_MAX
+                elif deviation < 0 - DEVIATION_MAX:
+                    deviation = 0 - DEVIATION_MAX
+                mean += deviation >> FAST_SHIFT
+                fastRatios[fan] = mean
+                if deviation > ERRATIC_CLAMP_DEVIATION:
+                    deviation = ERRATIC_CLAMP_DEVIATION
+                elif deviation < 0 - ERRATIC_CLAMP_DEVIATION:
+                    deviation = 0 - ERRATIC_CLAMP_DEVIATION
+                variance = int(variances[fan])
+                variance += (deviation * deviation - variance) >> VARIANCE_SHIFT
+                variances[fan] = variance
+                if slow & bit:
+                    if mean > SLOW_EXIT_RATIO:
+                        slow &= ~bit
+                elif mean < SLOW_ENTER_RATIO:
+                    slow |= bit
+                if erratic & bit:
+                    if variance < ERRATIC_EXIT_DEVIATION * ERRATIC_EXIT_DEVIATION:
+                        erratic &= ~bit
+                elif variance > ERRATIC_ENTER_DEVIATION * ERRATIC_ENTER_DEVIATION:
+                    erratic |= bit
+
+                # against the average of the other running fans of the channel that are not slow
+                others = int(channelRunningFans[channel])
+                othersSum = int(channelRpmSums[channel])
+                if not (slow & bit):
+                    others -= 1
+                    othersSum -= rpm
+                if others > 0:
+                    othersRpm = othersSum // others
+                    if othersRpm > 0:
+                        ratio = (rpm << 14) // othersRpm
+                        if ratio > RATIO_MAX:
+                            ratio = RATIO_MAX
+                        peerRatio = int(peerRatios[fan])
+                        peerRatio += ((ratio << PEER_SHIFT) - peerRatio) >> PEER_SHIFT
+                        peerRatios[fan] = peerRatio
+                        peerRatio >>= PEER_SHIFT
+                        if degrading & bit:
+                            if peerRatio > DEGRADING_EXIT_RATIO:
+                                degrading &= ~bit
+                        elif peerRatio < DEGRADING_ENTER_RATIO:
+                            degrading |= bit
+            fan += 1
+        self.stalledMask = stalled
+        self.slowMask = slow
+        self.erraticMask = erratic
+        self.degradingMask = degrading
+
+    # Per fan, for the REPL: RPM in % of the curve, standard deviation in %, RPM in % of the other fans of its
+    # channel over the long run
+    def printState(self):
+        for fan in range(self._numberOfFans):
+            print("fan %2d: %5.1f %% of curve, %4.1f %% deviation, %5.1f %% of others%s%s%s%s" % (
+                fan, 100 * self._fastRatios[fan] / RATIO_ONE,
+                100 * self._variances[fan] ** 0.5 / RATIO_ONE,
+                100 * (self._peerRatios[fan] >> PEER_SHIFT) / RATIO_ONE,
+                " stalled" if self.stalledMask & (1 << fan) else "",
+                " slow" if self.slowMask & (1 << fan) else "",
+                " erratic" if self.erraticMask & (1 << fan) else "",
+                " degrading" if self.degradingMask & (1 << fan) else ""))
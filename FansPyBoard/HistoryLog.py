@@ -0,0 +1,222 @@
+#########################################################
+#                                                       #
+#                     HistoryLog.py                     #
+#      Ring of fixed size history records in flash      #
+#                                                       #
+#########################################################
+
+# The log is one file of numberOfPages pages of pageSize bytes,
+# written in full when it is created and afterwards only overwritten
+# in place: the filesystem never allocates or frees anything for it,
+# however long the controller runs. Records are packed in a page in
+# RAM and the page is written when it is full, with one seek and one
+# write of pageSize bytes, every flushRecords records in between, so
+# a reset loses at most the last flushRecords - 1 records, or earlier
+# by flush(). A page, little endian:
+#
+#     H   magic 0x4c48
+#     B   version
+#     B   number of records in the page
+#     I   page sequence number, one more for every new page, never reset
+#     H   record size
+#     H   boot number
+#     records
+#     H   Fletcher-16 of all the previous bytes of the page
+#
+# and a record:
+#
+#     I   log time in s, the time the controller has been running since the log was created
+#     h   water temperature in centi-degrees
+#     N H fan RPMs
+#     3 B PWM duties in percent, top, bottom top, bottom bottom
+#     B   PID output
+#     i   PID integral term, 1/65536 %
+#     H   stopped fans, bit i for fan i, the first 16 fans
+#     H   slow fans
+#
+# The newest page is the valid one with the highest sequence number:
+# there is no head pointer to keep in sync, a page torn by a reset
+# fails its checksum and only that page is lost. The sequence number
+# and the time of the first record of every page are kept in RAM as
+# an index, so records() reads only the pages of the last minutes.
+# host/history.py decodes a copy of the file.
+
+import struct
+import utime
+from array import array
+from Checksum import fletcher16
+
+
+HISTORY_MAGIC = const(0x4c48)
+HISTORY_VERSION = const(1)
+PAGE_HEADER_SIZE = const(12)
+PAGE_HEADER_FORMAT = '<HBBIHH'
+
+
+class HistoryLog:
+    def __init__(self, path, numberOfFans, numberOfPages=40, pageSize=1024, flushRecords=0):
+        self._numberOfFans = numberOfFans
+        self._flushRecords = flushRecords      # 0 for a write only when the page is full
+        self._recordFormat = '<Ih%dH3BBiHH' % numberOfFans
+        self.recordSize = struct.calcsize(self._recordFormat)
+        self.recordsPerPage = (pageSize - PAGE_HEADER_SIZE - 2) // self.recordSize
+        if self.recordsPerPage < 1 or self.recordsPerPage > 255:
+            raise ValueError('pageSize must hold 1 to 255 records')
+        self._numberOfPages = numberOfPages
+        self._pageSize = pageSize
+        self._page = bytearray(pageSize)
+        self._header = bytearray(PAGE_HEADER_SIZE + 4)
+        # Index of the pages in the file, a sequence of 0 for a page never written
+        self._pageSequences = array('I', [0 for _ in range(numberOfPages)])
+        self._pageSeconds = array('I', [0 for _ in range(numberOfPages)])
+        self._rpmsOffset = 6
+        self._dutiesOffset = self._rpmsOffset + 2 * numberOfFans
+        self.pagesWritten = 0
+        self.maxWriteUs = 0
+        self._open(path)
+        self._startPage(self._slot + 1 if self._sequence else 0)
+        self.bootNumber = (self._lastBootNumber + 1) & 0xffff
+        self._lastTicks = utime.ticks_ms()
+
+    def _open(self, path):
+        try:
+            self._file = open(path, 'r+b')
+            valid = self._file.seek(0, 2) == self._numberOfPages * self._pageSize
+        except OSError:
+            valid = False
+        if not valid:
+            self._create(path)
+        self._scan()
+
+    # Written once, in full, so the pages are allocated before the first record
+    def _create(self, path):
+        self._file = open(path, 'wb')
+        for _ in range(self._numberOfPages):
+            self._file.write(self._page)
+        self._file.close()
+        self._file = open(path, 'r+b')
+
+    # Builds the index from the page headers. Only the newest page is read in full: a reset tears at most the page
+    # being written, which is the newest one, and a torn page gives way to the one before it.
+    def _scan(self):
+        header = self._header
+        for slot in range(self._numberOfPages):
+            self._file.seek(slot * self._pageSize)
+            self._pageSequences[slot] = 0
+            if self._file.readinto(header) != len(header):
+                continue
+            magic, version, count, sequence, recordSize, _ = struct.unpack_from(PAGE_HEADER_FORMAT, header, 0)
+            if magic == HISTORY_MAGIC and version == HISTORY_VERSION and recordSize == self.recordSize and count:
+                self._pageSequences[slot] = sequence
+                self._pageSeconds[slot] = struct.unpack_from('<I', header, PAGE_HEADER_SIZE)[0]
+        while True:
+            self._sequence = 0
+            self._slot = 0
+            self._lastBootNumber = 0
+            self._logMs = 0
+            for slot in range(self._numberOfPages):
+                if self._pageSequences[slot] > self._sequence:
+                    self._sequence = self._pageSequences[slot]
+                    self._slot = slot
+            if not self._sequence:
+                return
+            if self._readPage(self._slot, self._page):
+                break
+            self._pageSequences[self._slot] = 0
+        _, _, count, _, _, self._lastBootNumber = struct.unpack_from(PAGE_HEADER_FORMAT, self._page, 0)
+        # the log time goes on from the last record
+        self._logMs = 1000 * struct.unpack_from('<I', self._page, PAGE_HEADER_SIZE + (count - 1) * self.recordSize)[0]
+
+    # Reads the page at slot into page, returns False when its checksum is wrong
+    def _readPage(self, slot, page):
+        self._file.seek(slot * self._pageSize)
+        if self._file.readinto(page) != self._pageSize:
+            return False
+        return struct.unpack_from('<H', page, self._pageSize - 2)[0] == fletcher16(page, self._pageSize - 2)
+
+    def _startPage(self, slot):
+        self._slot = slot % self._numberOfPages
+        self._sequence += 1
+        self._count = 0
+
+    # Log time in s, counted in ms so that it does not drift however often it is read
+    def seconds(self):
+        now = utime.ticks_ms()
+        self._logMs += utime.ticks_diff(now, self._lastTicks)
+        self._lastTicks = now
+        return self._logMs // 1000
+
+    def append(self, centiDegrees, rpms, duties, pid, stoppedFansMask, slowFansMask):
+        page = self._page
+        offset = PAGE_HEADER_SIZE + self._count * self.recordSize
+        seconds = self.seconds()
+        struct.pack_into('<Ih', page, offset, seconds, centiDegrees)
+        position = offset + self._rpmsOffset
+        for i in range(self._numberOfFans):
+            struct.pack_into('<H', page, position, min(rpms[i], 0xffff))
+            position += 2
+        position = offset + self._dutiesOffset
+        struct.pack_into('<3BBiHH', page, position, duties[0], duties[1], duties[2], pid.output, pid.integralTerm,
+                         stoppedFansMask & 0xffff, slowFansMask & 0xffff)
+        if self._count == 0:
+            self._pageSeconds[self._slot] = seconds
+        self._count += 1
+        if self._count == self.recordsPerPage:
+            self.flush()
+            self._startPage(self._slot + 1)
+        elif self._flushRecords and self._count % self._flushRecords == 0:
+            self.flush()
+
+    # Writes the records of the current page, it is written again in full when more records come in
+    def flush(self):
+        if not self._count:
+            return
+        startTimeStamp = utime.ticks_us()
+        page = self._page
+        struct.pack_into(PAGE_HEADER_FORMAT, page, 0, HISTORY_MAGIC, HISTORY_VERSION, self._count, self._sequence,
+                         self.recordSize, self.bootNumber)
+        struct.pack_into('<H', page, self._pageSize - 2, fletcher16(page, self._pageSize - 2))
+        self._file.seek(self._slot * self._pageSize)
+        self._file.write(page)
+        self._file.flush()
+        self._pageSequences[self._slot] = self._sequence
+        self.pagesWritten += 1
+        writeUs = utime.ticks_diff(utime.ticks_us(), startTimeStamp)
+        if writeUs > self.maxWriteUs:
+            self.maxWriteUs = writeUs
+
+    # Yields the records of the last minutes, oldest first, as tuples in the record layout with the
+    # boot number in front. For the REPL or a host: allocates and reads the file, not for the main loop. The pages
+    # are read into a buffer of their own, the page being filled is left to append() however long the reader takes.
+    def records(self, minutes):
+        self.flush()
+        cutoff = self.seconds() - 60 * minutes
+        # the pages are walked back from the newest one with the index, down to the first page that starts before
+        # the cutoff
+        slots = []
+        slot = self._slot
+        sequence = self._sequence
+        if not self._count:         # a new page, nothing written in it yet
+            slot = (slot - 1) % self._numberOfPages
+            sequence -= 1
+        for _ in range(self._numberOfPages):
+            if self._pageSequences[slot] != sequence or sequence == 0:
+                break
+            slots.append(slot)
+            if self._pageSeconds[slot] <= cutoff:
+                break
+            slot = (slot - 1) % self._numberOfPages
+            sequence -= 1
+        page = bytearray(self._pageSize)
+        for slot in reversed(slots):
+            if not self._readPage(slot, page):
+                continue
+            _, _, count, _, _, bootNumber = struct.unpack_from(PAGE_HEADER_FORMAT, page, 0)
+            for i in range(count):
+                record = struct.unpack_from(self._recordFormat, page, PAGE_HEADER_SIZE + i * self.recordSize)
+                if record[0] >= cutoff:
+                    yield (bootNumber,) + record
+
+    def printRecords(self, minutes=60):
+        for record in self.records(minutes):
+            print(','.join(str(value) for value in record))
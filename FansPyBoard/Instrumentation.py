@@ -0,0 +1,177 @@
+#########################################################
+#                                                       #
+#                   Instrumentation.py                  #
+#     Main loop rate, pass times and missed tach edges  #
+#                                                       #
+#########################################################
+
+# Only the instrumented main loop of the controller feeds it, the
+# plain loop does not even test whether it is on. On every pass,
+# loopPass() gets:
+#
+#   - the pass time, from one tach poll to the next: how late an edge
+#     can be seen. It goes in a log2 histogram, bucket b for times of
+#     2**(b-1) to 2**b - 1 us, bucket 0 for 0 us, the last bucket for
+#     everything longer
+#   - the time spent in the tach poll and in the scheduler, counted,
+#     summed and maxed per section, averaged every second
+#
+# The task run times come from the scheduler statistics. second() is
+# called every second and turns the passes of the last second into a
+# loop rate and into an estimate of the tach edges the poll missed:
+# a pass of D us over a fan whose tach period is P us has 2 D / P
+# level changes on average, of which the poll sees one when their
+# number is odd and none when it is even. For k = floor(2 D / P) and
+# f the fraction left, the rising edges missed are k / 2 for an even
+# k and (k - 1) / 2 + f for an odd k, D taken in the middle of its
+# bucket. Fans counted by ExtInt are not polled and get a period of 0.
+#
+# With a stream, every second() writes a line of text to it, dropped
+# if the stream cannot take it right away, like the telemetry frames.
+# Everything but that line and dump() is in preallocated arrays.
+
+import uselect
+import utime
+from array import array
+
+
+HISTOGRAM_BUCKETS = const(24)
+SECTION_POLL = const(0)
+SECTION_SCHEDULER = const(1)
+NUMBER_OF_SECTIONS = const(2)
+SECTION_NAMES = ("tach poll", "scheduler")
+
+
+class Instrumentation:
+    def __init__(self, numberOfFans):
+        self.enabled = False
+        self._numberOfFans = numberOfFans
+        self.histogram = array('I', [0 for _ in range(HISTOGRAM_BUCKETS)])
+        self._lastHistogram = array('I', [0 for _ in range(HISTOGRAM_BUCKETS)])
+        self.sectionCounts = array('I', [0 for _ in range(NUMBER_OF_SECTIONS)])
+        self.sectionTotalsUs = array('I', [0 for _ in range(NUMBER_OF_SECTIONS)])
+        self.sectionMaxUs = array('I', [0 for _ in range(NUMBER_OF_SECTIONS)])
+        self.sectionAveragesUs = array('I', [0 for _ in range(NUMBER_OF_SECTIONS)])      # over the last second
+        self.maxPassUs = 0
+        self.passesPerSecond = 0
+        self.missedEdges = 0                # estimated since reset()
+        self.missedEdgesPerSecond = 0
+        self.expectedEdgesPerSecond = 0     # of the polled fans
+        self._missedQ8 = 0
+        self._lastSecondMs = utime.ticks_ms()
+        self._stream = None
+        self._poller = None
+
+    def reset(self):
+        for bucket in range(HISTOGRAM_BUCKETS):
+            self.histogram[bucket] = 0
+            self._lastHistogram[bucket] = 0
+        for section in range(NUMBER_OF_SECTIONS):
+            self.sectionCounts[section] = 0
+            self.sectionTotalsUs[section] = 0
+            self.sectionMaxUs[section] = 0
+            self.sectionAveragesUs[section] = 0
+        self.maxPassUs = 0
+        self.missedEdges = 0
+        self._missedQ8 = 0
+        self._lastSecondMs = utime.ticks_ms()
+
+    # A line every second on stream, None to stop
+    def streamTo(self, stream):
+        self._stream = stream
+        self._poller = None
+        if stream is not None:
+            self._poller = uselect.poll()
+            self._poller.register(stream, uselect.POLLOUT)
+
+    @micropython.viper
+    def loopPass(self, passUs: int, pollUs: int, schedulerUs: int):
+        histogram = ptr32(self.histogram)
+        bucket = 0
+        value = passUs
+        while value and bucket < HISTOGRAM_BUCKETS - 1:
+            value >>= 1
+            bucket += 1
+        histogram[bucket] += 1
+        if passUs > int(self.maxPassUs):
+            self.maxPassUs = passUs
+        counts = ptr32(self.sectionCounts)
+        totals = ptr32(self.sectionTotalsUs)
+        maxima = ptr32(self.sectionMaxUs)
+        counts[SECTION_POLL] += 1
+        totals[SECTION_POLL] += pollUs
+        if pollUs > int(maxima[SECTION_POLL]):
+            maxima[SECTION_POLL] = pollUs
+        counts[SECTION_SCHEDULER] += 1
+        totals[SECTION_SCHEDULER] += schedulerUs
+        if schedulerUs > int(maxima[SECTION_SCHEDULER]):
+            maxima[SECTION_SCHEDULER] = schedulerUs
+
+    # Every second, tachPeriodsUs per fan, 0 for a fan that is not polled or not running
+    def second(self, tachPeriodsUs):
+        nowMs = utime.ticks_ms()
+        elapsedMs = max(1, utime.ticks_diff(nowMs, self._lastSecondMs))
+        self._lastSecondMs = nowMs
+        passes = 0
+        missedQ8 = 0
+        for bucket in range(HISTOGRAM_BUCKETS):
+            count = (self.histogram[bucket] - self._lastHistogram[bucket]) & 0xffffffff
+            self._lastHistogram[bucket] = self.histogram[bucket]
+            if not count:
+                continue
+            passes += count
+            passUs = max(1, (3 << bucket) >> 2)
+            for fan in range(self._numberOfFans):
+                periodUs = tachPeriodsUs[fan]
+                if periodUs:
+                    changesQ8 = (passUs << 9) // periodUs
+                    changes = changesQ8 >> 8
+                    missedQ8 += count * (((changes >> 1) << 8) + (changesQ8 & 0xff if changes & 1 else 0))
+        for section in range(NUMBER_OF_SECTIONS):
+            count = self.sectionCounts[section]
+            self.sectionAveragesUs[section] = self.sectionTotalsUs[section] // count if count else 0
+            self.sectionCounts[section] = 0
+            self.sectionTotalsUs[section] = 0
+        expected = 0
+        for fan in range(self._numberOfFans):
+            if tachPeriodsUs[fan]:
+                expected += 1000000 // tachPeriodsUs[fan]
+        self.passesPerSecond = passes * 1000 // elapsedMs
+        self.expectedEdgesPerSecond = expected
+        self.missedEdgesPerSecond = (missedQ8 >> 8) * 1000 // elapsedMs
+        self._missedQ8 += missedQ8
+        self.missedEdges = self._missedQ8 >> 8
+        if self._stream is not None:
+            for _ in self._poller.ipoll(0):
+                self._stream.write("loop %d/s, pass p50 <= %d us p99 <= %d us max %d us, missed edges %d/s of %d\r\n" % (
+                    self.passesPerSecond, self.percentileUs(50), self.percentileUs(99), self.maxPassUs,
+                    self.missedEdgesPerSecond, self.expectedEdgesPerSecond))
+                break
+
+    # Upper bound of the bucket holding the percent-th percentile of the pass times
+    def percentileUs(self, percent):
+        total = 0
+        for bucket in range(HISTOGRAM_BUCKETS):
+            total += self.histogram[bucket]
+        rank = (total * percent + 99) // 100
+        seen = 0
+        for bucket in range(HISTOGRAM_BUCKETS):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return (1 << bucket) - 1
+        return 0
+
+    def dump(self):
+        total = 0
+        for bucket in range(HISTOGRAM_BUCKETS):
+            total += self.histogram[bucket]
+        print("loop %d passes/s, %d passes, pass p50 <= %d us, p99 <= %d us, max %d us" % (
+            self.passesPerSecond, total, self.percentileUs(50), self.percentileUs(99), self.maxPassUs))
+        for bucket in range(HISTOGRAM_BUCKETS):
+            if self.histogram[bucket]:
+                print("  %7d - %7d us %10d" % ((1 << bucket) >> 1, (1 << bucket) - 1, self.histogram[bucket]))
+        for section in range(NUMBER_OF_SECTIONS):
+            print("%-13s %6d us average, %6d us max" % (
+                SECTION_NAMES[section], self.sectionAveragesUs[section], self.sectionMaxUs[section]))
+        print("missed tach edges, estimated: %d/s of %d/s, %d since reset" % (
+            self.missedEdgesPerSecond, self.expectedEdgesPerSecond, self.missedEdges))
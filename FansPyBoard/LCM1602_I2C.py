@@ -9,6 +9,7 @@
 #                                                                #
 ##################################################################
 
+import utime
 from pyb import I2C
 from pyb import delay, udelay
 
@@ -42,8 +43,13 @@ LCD_SETCGRAMADDR = const(0x40)
 LCD_SETDDRAMADDR = const(0x80)
 
 
+I2C_BAUDRATE = const(100000)         # the PCF8574 also runs at 400000
+# Cells between two changed runs that are rewritten rather than starting a new run
+UPDATE_MAX_GAP = const(2)
+
+
 class LCM1602_I2C:
-    def __init__(self, cols = 16, rows=2, i2cPort=I2C_PORT):
+    def __init__(self, cols = 16, rows=2, i2cPort=I2C_PORT, baudrate=I2C_BAUDRATE):
         self._En = 1 << HD44780_EN_PIN
         self._Rw = 1 << HD44780_RW_PIN
         self._Rs = 1 << HD44780_RS_PIN
@@ -57,7 +63,18 @@ class LCM1602_I2C:
         self._backlightPinMask = 1 << HD44780_BACKLIGHT_PIN
         self._backlightStsMask = 0
         self._displaycontrol = LCD_DISPLAYON | LCD_CURSOROFF | LCD_BLINKOFF
-        self._i2c = I2C(I2C_PORT, I2C.MASTER, baudrate=100000)
+        # Shadow of what the display shows, one byte per cell, and the cursor position in it
+        self._shadow = bytearray(b' ' * (cols * rows))
+        self._cursor = 0
+        # An enable pulse is 2 bytes per nibble, 4 per character: room for a DDRAM address command and a full row
+        self._txBuffer = bytearray(4 * (cols + 1))
+        # Views of the buffer for every possible run length, slicing at send time would allocate
+        txView = memoryview(self._txBuffer)
+        self._txViews = [txView[:4 * (length + 1)] for length in range(cols + 1)]
+        # clear and home record when the controller will be ready instead of waiting for it
+        self._busy = False
+        self._readyTimeStamp = 0
+        self._i2c = I2C(i2cPort, I2C.MASTER, baudrate=baudrate)
         self._i2c.send(0, I2C_ADDRESS)
         self.display()
         self.backlight()
@@ -73,11 +90,32 @@ class LCM1602_I2C:
 
     def clear(self):
         self._command(LCD_CLEARDISPLAY)           # clear display, set cursor position to zero
-        udelay(HOME_CLEAR_EXEC)                   # this command is time consuming
+        self._busyFor(HOME_CLEAR_EXEC)            # this command is time consuming
+        for i in range(len(self._shadow)):
+            self._shadow[i] = 0x20
+        self._cursor = 0
 
     def home(self):
         self._command(LCD_RETURNHOME)             # set cursor position to zero
-        udelay(HOME_CLEAR_EXEC)                   # this command is time consuming
+        self._busyFor(HOME_CLEAR_EXEC)            # this command is time consuming
+        self._cursor = 0
+
+    # False while a clear or home is executing, the next write would wait for it
+    def ready(self):
+        if self._busy and utime.ticks_diff(self._readyTimeStamp, utime.ticks_us()) <= 0:
+            self._busy = False
+        return not self._busy
+
+    def _busyFor(self, us):
+        self._readyTimeStamp = utime.ticks_add(utime.ticks_us(), us)
+        self._busy = True
+
+    def _waitUntilReady(self):
+        if self._busy:
+            remaining = utime.ticks_diff(self._readyTimeStamp, utime.ticks_us())
+            if remaining > 0:
+                udelay(remaining)
+            self._busy = False
 
     def noDisplay(self):
         self._displaycontrol &= ~LCD_DISPLAYON
@@ -132,6 +170,7 @@ class LCM1602_I2C:
 
         if row >= self._rows:
             row = self._rows - 1        # rows start at 0
+        self._cursor = row * self._cols + col
 
         # 16x4 LCDs have special memory map layout
         if (self._cols == 16) and (self._rows == 4):
@@ -149,15 +188,76 @@ class LCM1602_I2C:
 
     def write(self, character):
         self._send(character, DATA)
+        if self._cursor < len(self._shadow):
+            self._shadow[self._cursor] = character
+        self._cursor += 1
 
     def print(self, text):
         for char in bytes(text, 'utf-8'):
             self.write(char)
 
+    # Shows lines (str, bytes or bytearray, one per row, padded with spaces) by rewriting only the cells that
+    # differ from what is displayed. Each run of changed cells is one I2C transaction: DDRAM address, then
+    # the characters. No clear, no busy wait.
+    def update(self, lines):
+        cols = self._cols
+        shadow = self._shadow
+        for row in range(min(len(lines), self._rows)):
+            line = lines[row]
+            if isinstance(line, str):
+                line = bytes(line, 'utf-8')
+            length = min(len(line), cols)
+            base = row * cols
+            col = 0
+            while col < cols:
+                char = line[col] if col < length else 0x20
+                if shadow[base + col] == char:
+                    col += 1
+                    continue
+                runStart = col
+                runEnd = col + 1            # exclusive
+                col += 1
+                while col < cols and col - runEnd <= UPDATE_MAX_GAP:
+                    char = line[col] if col < length else 0x20
+                    if shadow[base + col] != char:
+                        runEnd = col + 1
+                    col += 1
+                col = runEnd
+                self._sendRun(line, length, row, runStart, runEnd)
+
+    def _sendRun(self, line, length, row, start, end):
+        offsets = ((0x00, 0x40, 0x10, 0x50) if (self._cols == 16) and (self._rows == 4) else (0x00, 0x40, 0x14, 0x54))
+        self._waitUntilReady()
+        size = self._pack(0, LCD_SETDDRAMADDR | (start + offsets[row]), COMMAND)
+        base = row * self._cols
+        for col in range(start, end):
+            char = line[col] if col < length else 0x20
+            self._shadow[base + col] = char
+            size = self._pack(size, char, DATA)
+        self._i2c.send(self._txViews[(size >> 2) - 1], I2C_ADDRESS)
+        self._cursor = base + end
+
+    # Appends the 2 enable pulses of a byte to the transmit buffer. D4-D7 are P4-P7 of the PCF8574.
+    @micropython.viper
+    def _pack(self, size: int, value: int, mode: int) -> int:
+        buffer = ptr8(self._txBuffer)
+        control = int(self._backlightStsMask)
+        if mode == DATA:
+            control |= int(self._Rs)
+        enable = int(self._En)
+        high = (value & 0xf0) | control
+        low = ((value & 0x0f) << 4) | control
+        buffer[size] = high | enable
+        buffer[size + 1] = high
+        buffer[size + 2] = low | enable
+        buffer[size + 3] = low
+        return size + 4
+
     def _command(self, value):
         self._send(value, COMMAND)
 
     def _send(self, value, mode):
+        self._waitUntilReady()
         if mode == FOUR_BITS:
             self._write4bits((value & 0x0f), COMMAND)
         else:
@@ -0,0 +1,98 @@
+#########################################################
+#                                                       #
+#                       LcdText.py                      #
+#       Text formatting into preallocated bytearrays    #
+#                                                       #
+#########################################################
+
+# The display lines are built in place in bytearrays instead of with
+# str formatting, joins and lists, so a display refresh does not
+# allocate. Every put function writes at position, stops at the end
+# of the buffer and returns the position after what it wrote.
+
+
+@micropython.viper
+def fill(buffer, start: int, end: int, char: int):
+    data = ptr8(buffer)
+    size = int(len(buffer))
+    if end > size:
+        end = size
+    while start < end:
+        data[start] = char
+        start += 1
+
+
+@micropython.viper
+def putBytes(buffer, position: int, text) -> int:
+    data = ptr8(buffer)
+    source = ptr8(text)
+    size = int(len(buffer))
+    length = int(len(text))
+    i = 0
+    while i < length and position < size:
+        data[position] = source[i]
+        position += 1
+        i += 1
+    return position
+
+
+# Decimal value right aligned in width characters, padded with spaces, width 0 for no padding
+@micropython.viper
+def putInt(buffer, position: int, value: int, width: int) -> int:
+    data = ptr8(buffer)
+    size = int(len(buffer))
+    negative = value < 0
+    if negative:
+        value = 0 - value
+    digits = 1
+    scale = 1
+    while value // scale >= 10:
+        scale *= 10
+        digits += 1
+    length = digits + (1 if negative else 0)
+    while width > length and position < size:
+        data[position] = 0x20
+        position += 1
+        width -= 1
+    if negative and position < size:
+        data[position] = 0x2d      # -
+        position += 1
+    while scale > 0 and position < size:
+        data[position] = 0x30 + (value // scale) % 10
+        position += 1
+        scale //= 10
+    return position
+
+
+# Hundredths as a number with one decimal, rounded half away from zero: 3147 -> 31.5
+@micropython.viper
+def putTenths(buffer, position: int, hundredths: int) -> int:
+    tenths = (hundredths + 5) // 10 if hundredths >= 0 else 0 - ((5 - hundredths) // 10)
+    magnitude = tenths if tenths >= 0 else 0 - tenths
+    data = ptr8(buffer)
+    size = int(len(buffer))
+    if tenths < 0 and magnitude < 10 and position < size:
+        data[position] = 0x2d       # -0.x, putInt has no sign for 0
+        position += 1
+    position = int(putInt(buffer, position, tenths // 10 if tenths >= 0 else 0 - (magnitude // 10), 0))
+    if position < size:
+        data[position] = 0x2e       # .
+        position += 1
+    if position < size:
+        data[position] = 0x30 + magnitude % 10
+        position += 1
+    return position
+
+
+# The first length bytes of source centered in buffer, cut at its end
+@micropython.viper
+def center(buffer, source, length: int):
+    size = int(len(buffer))
+    start = (size - length) // 2 if length < size else 0
+    fill(buffer, 0, size, 0x20)
+    data = ptr8(buffer)
+    text = ptr8(source)
+    i = 0
+    while i < length and start + i < size:
+        data[start + i] = text[i]
+        i += 1
@@ -6,10 +6,11 @@
 #                                                       #
 #########################################################
 
-# Time reference implemented with time.time() which in
-# MicroPython is an integer equals to the number of seconds
-# since 1/1/2000. This is ok for slow changing processes
-# like temperature
+# PID takes its time from utime.time(), an integer number of
+# seconds since 1/1/2000, which is ok for slow changing processes
+# like temperature as long as it is updated every second or less
+# often. FixedPID below, the one the controller runs, counts time
+# in ms with utime.ticks_ms().
 
 import utime
 
@@ -54,3 +55,188 @@ class PID:
         print("output: %d" % self.output)
         print("lastError: %f" % self.lastError)
         print("lastTime: %d" % self.lastTime)
+
+
+##### Fixed point PID
+
+# Same gains and set value as PID, but the sensed and set values are
+# in hundredths (centi-degrees for the water temperature) and all the
+# arithmetic is on integers, so update() allocates nothing and costs
+# the same every call. Time comes from utime.ticks_ms(), update() can
+# be called at any rate, 1 to 10 Hz is intended.
+#
+# The terms are kept in 1/65536 of a percent (Q16):
+#   - the integral term is clamped so that 50 % + integral stays in
+#     [outputMin, outputMax], on both sides (anti-windup)
+#   - the derivative is taken on the measurement, a set value change
+#     does not kick it, and low pass filtered with derivativeFilterMs
+#     (0 for none)
+# With a constant set value, no filter, the output within bounds and
+# whole second update periods, it computes what PID computes.
+#
+# The products stay within 32 bits for kP < 50, kI < 50000 and
+# kD < 5000, nonzero gains at least 2.4e-8, 2.4e-5 and 2.4e-6,
+# 0 <= outputMin < outputMax <= 100 and derivativeFilterMs up to an
+# hour; the constructor raises ValueError outside. The gain shifts
+# are then in 0 .. 30, none is negative. Each term is kept under TERM_LIMIT (8192 %, far past
+# saturation) by clamping its input, the error times dt for the
+# integral, the rate of change for the derivative.
+
+Q16_PERCENT = const(65536)
+OUTPUT_BIAS = const(50 * 65536)          # the output is centered on 50 %
+MAX_ERROR = const(10000)                 # hundredths, beyond that the error is clamped
+MAX_DT_MS = const(60000)
+GAIN_MANTISSA_BITS = const(15)
+TERM_LIMIT = const(1 << 29)              # Q16, 8192 %
+MAX_FILTER_MS = const(3600000)
+MAX_GAIN_SHIFT = const(30)
+
+
+# gain ~= mantissa / 2**shift with 2**14 <= |mantissa| <= 2**15 and 0 <= shift <= MAX_GAIN_SHIFT
+def _fixedGain(name, gain):
+    if not abs(gain) < 1 << GAIN_MANTISSA_BITS:
+        raise ValueError('%s out of range' % name)
+    if gain == 0:
+        return 0, 0
+    shift = 0
+    while abs(gain) * 2.0 ** shift < 1 << (GAIN_MANTISSA_BITS - 1):
+        shift += 1
+    if shift > MAX_GAIN_SHIFT:
+        raise ValueError('%s out of range' % name)
+    return int(round(gain * 2.0 ** shift)), shift
+
+
+# Largest |x| for which |x * mantissa / 2**shift| stays under TERM_LIMIT, at most limit
+def _inputLimit(mantissa, shift, limit):
+    if not mantissa:
+        return limit
+    return min(limit, (TERM_LIMIT << shift) // abs(mantissa))
+
+
+# x * mantissa / 2**shift, 32 bit safe for |x| < 2**30, |mantissa| <= 2**15, 0 <= shift and a result under 2**30
+@micropython.viper
+def _mulShift(x: int, mantissa: int, shift: int) -> int:
+    negative = False
+    if x < 0:
+        x = 0 - x
+        negative = True
+    if mantissa < 0:
+        mantissa = 0 - mantissa
+        negative = not negative
+    high = (x >> GAIN_MANTISSA_BITS) * mantissa
+    low = (x & 0x7fff) * mantissa
+    if shift >= GAIN_MANTISSA_BITS:
+        result = (high + (low >> GAIN_MANTISSA_BITS)) >> (shift - GAIN_MANTISSA_BITS)
+    else:
+        result = (high << (GAIN_MANTISSA_BITS - shift)) + (low >> shift)
+    return 0 - result if negative else result
+
+
+# numerator / denominator rounded toward zero, denominator > 0
+@micropython.viper
+def _divide(numerator: int, denominator: int) -> int:
+    if numerator < 0:
+        return 0 - ((0 - numerator) // denominator)
+    return numerator // denominator
+
+
+class FixedPID:
+    def __init__(self, setValue=0.0, kP=0.0, kI=0.0, kD=0.0, derivativeFilterMs=1000, outputMin=0, outputMax=100):
+        if not 0 <= outputMin < outputMax <= 100:
+            raise ValueError('outputMin and outputMax must be in 0 .. 100, outputMin below')
+        if not 0 <= derivativeFilterMs <= MAX_FILTER_MS:
+            raise ValueError('derivativeFilterMs out of range')
+        self.kP = kP
+        self.kI = kI
+        self.kD = kD
+        self.setCentiValue = int(round(setValue * 100))
+        self.derivativeFilterMs = derivativeFilterMs
+        # P, Q16 % per hundredth
+        self._pMantissa, self._pShift = _fixedGain('kP', kP * Q16_PERCENT / 100.0)
+        # I, Q16 % per hundredth and ms
+        self._iMantissa, self._iShift = _fixedGain('kI', kI * Q16_PERCENT / 100000.0)
+        # D, Q16 % per (hundredth / 100 s)
+        self._dMantissa, self._dShift = _fixedGain('kD', kD * Q16_PERCENT / 10000.0)
+        self._maxErrorTime = _inputLimit(self._iMantissa, self._iShift, MAX_ERROR * MAX_DT_MS)
+        self._maxRate = _inputLimit(self._dMantissa, self._dShift, MAX_ERROR * 100000)
+        self._integralMin = outputMin * Q16_PERCENT - OUTPUT_BIAS
+        self._integralMax = outputMax * Q16_PERCENT - OUTPUT_BIAS
+        self._outputMin = outputMin
+        self._outputMax = outputMax
+        self.proportionalTerm = 0
+        self.integralTerm = 0
+        self.derivativeTerm = 0
+        self.output = 0
+        self._lastSensedValue = 0
+        self._hasLastSensedValue = False
+        self._lastTime = utime.ticks_ms()
+
+    @micropython.viper
+    def update(self, sensedCentiValue: int) -> int:
+        now = int(utime.ticks_ms())
+        dt = int(utime.ticks_diff(now, self._lastTime))
+        self._lastTime = now
+        if dt > MAX_DT_MS:
+            dt = MAX_DT_MS
+        error = sensedCentiValue - int(self.setCentiValue)
+        if error > MAX_ERROR:
+            error = MAX_ERROR
+        elif error < 0 - MAX_ERROR:
+            error = 0 - MAX_ERROR
+        proportional = int(_mulShift(error, int(self._pMantissa), int(self._pShift)))
+
+        integral = int(self.integralTerm)
+        derivative = int(self.derivativeTerm)
+        if dt > 0:
+            errorTime = error * dt
+            maxErrorTime = int(self._maxErrorTime)
+            if errorTime > maxErrorTime:
+                errorTime = maxErrorTime
+            elif errorTime < 0 - maxErrorTime:
+                errorTime = 0 - maxErrorTime
+            integral += int(_mulShift(errorTime, int(self._iMantissa), int(self._iShift)))
+            integralMin = int(self._integralMin)
+            integralMax = int(self._integralMax)
+            if integral < integralMin:
+                integral = integralMin
+            elif integral > integralMax:
+                integral = integralMax
+            if self._hasLastSensedValue:
+                change = sensedCentiValue - int(self._lastSensedValue)
+                if change > MAX_ERROR:
+                    change = MAX_ERROR
+                elif change < 0 - MAX_ERROR:
+                    change = 0 - MAX_ERROR
+                rate = int(_divide(change * 100000, dt))
+                maxRate = int(self._maxRate)
+                if rate > maxRate:
+                    rate = maxRate
+                elif rate < 0 - maxRate:
+                    rate = 0 - maxRate
+                rawDerivative = int(_mulShift(rate, int(self._dMantissa), int(self._dShift)))
+                # first order low pass, derivative += (raw - derivative) * dt / (filter + dt), the factor in Q15
+                alpha = (dt << 15) // (int(self.derivativeFilterMs) + dt)
+                derivative += int(_mulShift(rawDerivative - derivative, alpha, 15))
+        self._lastSensedValue = sensedCentiValue
+        self._hasLastSensedValue = True
+
+        self.proportionalTerm = proportional
+        self.integralTerm = integral
+        self.derivativeTerm = derivative
+        output = (OUTPUT_BIAS + proportional + integral + derivative) >> 16      # floored like int() of a positive value
+        if output < int(self._outputMin):
+            output = int(self._outputMin)
+        elif output > int(self._outputMax):
+            output = int(self._outputMax)
+        self.output = output
+        return output
+
+    def printState(self):
+        print("kP: %f" % self.kP)
+        print("kI: %f" % self.kI)
+        print("kD: %f" % self.kD)
+        print("proportionalTerm: %f" % (self.proportionalTerm / Q16_PERCENT))
+        print("integralTerm: %f" % (self.integralTerm / Q16_PERCENT))
+        print("derivativeTerm: %f" % (self.derivativeTerm / Q16_PERCENT))
+        print("setCentiValue: %d" % self.setCentiValue)
+        print("output: %d" % self.output)
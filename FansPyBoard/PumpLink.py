@@ -0,0 +1,196 @@
+#########################################################
+#                                                       #
+#                      PumpLink.py                      #
+#      Pump RPM and faults from the pump MCU on UART    #
+#                                                       #
+#########################################################
+
+# The pump MCU (PumpProTrinket/PumpMonitor2.ino) sends one fixed
+# layout frame every second at 9600 baud, little endian:
+#
+#     H   magic 0x7ea5
+#     B   version
+#     B   sequence number, one more for every frame
+#     H   pump RPM, 0 for a stopped pump
+#     B   faults, PUMP_LOW_RPM | PUMP_STOPPED | PUMP_ALERTING
+#     B   pump PWM duty in percent
+#     H   Fletcher-16 of all the previous bytes
+#
+# The UART receives into its buffer from its interrupt, poll() only
+# reads what is already there and never waits for a byte, it is
+# called from a scheduler task. The bytes are assembled into a frame
+# starting at the magic; a frame failing its checksum is counted in
+# badFrames and the search for the magic goes on from its second byte,
+# so a byte lost on the line costs at most two frames. Frames missing
+# from the sequence numbers are counted in lostFrames.
+#
+# demandFloor() is the least cooling demand, in % duty, for the pump
+# state: less flow takes less heat to the radiators, so the fans
+# speed up as the pump slows down, to 100 % for a stopped pump. A link
+# that was up and went quiet gives lostDemand. Without any frame since
+# the boot, no pump MCU is wired and there is no floor.
+#
+# PumpLinkLoopback stands in for the pump MCU and the UART, for the
+# link and the fan response to be tried without the pump.
+
+import struct
+import utime
+from Checksum import fletcher16
+
+
+PUMP_LINK_MAGIC = const(0x7ea5)
+PUMP_LINK_VERSION = const(1)
+FRAME_SIZE = const(10)
+MAGIC_FIRST_BYTE = const(0xa5)
+MAGIC_SECOND_BYTE = const(0x7e)
+READ_CHUNK_SIZE = const(32)
+PUMP_LOW_RPM = const(0x01)          # below the low RPM of the pump MCU, its buzzer is on
+PUMP_STOPPED = const(0x02)          # no tach pulse for a second
+PUMP_ALERTING = const(0x04)
+
+
+# Frame in frame, at the layout above
+def packFrame(frame, sequence, rpm, faults, duty):
+    struct.pack_into('<HBBHBB', frame, 0, PUMP_LINK_MAGIC, PUMP_LINK_VERSION, sequence & 0xff,
+                     min(rpm, 0xffff), faults, duty)
+    struct.pack_into('<H', frame, FRAME_SIZE - 2, fletcher16(frame, FRAME_SIZE - 2))
+
+
+class PumpLink:
+    def __init__(self, stream, normalRpm=2700, lowRpm=1500, timeoutMs=3000, lostDemand=60):
+        self._stream = stream
+        self._normalRpm = normalRpm
+        self._lowRpm = lowRpm
+        self._timeoutMs = timeoutMs
+        self._lostDemand = lostDemand
+        self._chunk = bytearray(READ_CHUNK_SIZE)
+        self._frame = bytearray(FRAME_SIZE)
+        self._fill = 0
+        self._lastFrameMs = utime.ticks_ms()
+        self.rpm = 0
+        self.faults = 0
+        self.pumpDuty = 0
+        self.sequence = 0
+        self.frames = 0
+        self.badFrames = 0
+        self.lostFrames = 0
+
+    # Every PUMP_LINK_POLL_MS
+    def poll(self):
+        stream = self._stream
+        while stream.any():
+            count = stream.readinto(self._chunk)
+            if not count:
+                break
+            self._receive(count)
+
+    @micropython.viper
+    def _receive(self, count: int):
+        chunk = ptr8(self._chunk)
+        frame = ptr8(self._frame)
+        fill = int(self._fill)
+        i = 0
+        while i < count:
+            byte = chunk[i]
+            i += 1
+            if fill == 0:
+                if byte != MAGIC_FIRST_BYTE:
+                    continue
+            elif fill == 1 and byte != MAGIC_SECOND_BYTE:
+                if byte != MAGIC_FIRST_BYTE:
+                    fill = 0
+                continue
+            frame[fill] = byte
+            fill += 1
+            if fill == FRAME_SIZE:
+                fill = int(self._frameComplete())
+        self._fill = fill
+
+    # Returns the number of bytes kept for the next frame
+    @micropython.native
+    def _frameComplete(self):
+        frame = self._frame
+        if (frame[2] == PUMP_LINK_VERSION
+                and fletcher16(frame, FRAME_SIZE - 2) == frame[FRAME_SIZE - 2] | (frame[FRAME_SIZE - 1] << 8)):
+            if self.frames:
+                self.lostFrames += (frame[3] - self.sequence - 1) & 0xff
+            self.sequence = frame[3]
+            self.rpm = frame[4] | (frame[5] << 8)
+            self.faults = frame[6]
+            self.pumpDuty = frame[7]
+            self._lastFrameMs = utime.ticks_ms()
+            self.frames += 1
+            return 0
+        self.badFrames += 1
+        # the next frame may have started inside this one
+        for start in range(1, FRAME_SIZE):
+            if frame[start] == MAGIC_FIRST_BYTE and (start == FRAME_SIZE - 1 or frame[start + 1] == MAGIC_SECOND_BYTE):
+                for i in range(start, FRAME_SIZE):
+                    frame[i - start] = frame[i]
+                return FRAME_SIZE - start
+        return 0
+
+    # A frame within the timeout
+    def connected(self):
+        return self.frames > 0 and utime.ticks_diff(utime.ticks_ms(), self._lastFrameMs) < self._timeoutMs
+
+    # Least cooling demand in % duty
+    def demandFloor(self):
+        if not self.frames:
+            return 0
+        if not self.connected():
+            return self._lostDemand
+        rpm = self.rpm
+        if self.faults & PUMP_STOPPED or rpm <= self._lowRpm:
+            return 100
+        if rpm >= self._normalRpm:
+            return 0
+        return 100 * (self._normalRpm - rpm) // (self._normalRpm - self._lowRpm)
+
+    def printState(self):
+        print("pump %d RPM, %d %% duty, faults 0x%02x, %s" % (
+            self.rpm, self.pumpDuty, self.faults,
+            "connected" if self.connected() else "link lost" if self.frames else "no pump MCU"))
+        print("%d frames, %d bad, %d lost, %d %% demand floor" % (
+            self.frames, self.badFrames, self.lostFrames, self.demandFloor()))
+
+
+# In place of the UART: a frame every periodMs from rpm, faults and duty, which can be changed from the REPL,
+# e.g. controller.pumpLoopback.rpm = 1800. silent stops the frames, glitch() corrupts a byte of the next one.
+class PumpLinkLoopback:
+    def __init__(self, rpm=3000, duty=62, periodMs=1000):
+        self.rpm = rpm
+        self.faults = 0
+        self.duty = duty
+        self.silent = False
+        self._periodMs = periodMs
+        self._sequence = 0
+        self._frame = bytearray(FRAME_SIZE)
+        self._pending = 0           # bytes of _frame not read yet
+        self._glitch = False
+        self._nextFrameMs = utime.ticks_ms()
+
+    def glitch(self):
+        self._glitch = True
+
+    def any(self):
+        if not self._pending and not self.silent and utime.ticks_diff(utime.ticks_ms(), self._nextFrameMs) >= 0:
+            self._nextFrameMs = utime.ticks_add(self._nextFrameMs, self._periodMs)
+            faults = self.faults
+            if self.rpm == 0:
+                faults |= PUMP_STOPPED
+            packFrame(self._frame, self._sequence, self.rpm, faults, self.duty)
+            self._sequence += 1
+            if self._glitch:
+                self._frame[4] ^= 0x10
+                self._glitch = False
+            self._pending = FRAME_SIZE
+        return self._pending
+
+    def readinto(self, buf):
+        count = min(len(buf), self._pending)
+        start = FRAME_SIZE - self._pending
+        for i in range(count):
+            buf[i] = self._frame[start + i]
+        self._pending -= count
+        return count
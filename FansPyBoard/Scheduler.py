@@ -0,0 +1,128 @@
+#########################################################
+#                                                       #
+#                      Scheduler.py                     #
+#       Cooperative deadline scheduler on utime ticks   #
+#                                                       #
+#########################################################
+
+# Tasks are callbacks with a period in ms, all slots are allocated by
+# the constructor. runOnce() runs the tasks whose deadline has come
+# and returns right away when none has, it is called from the main
+# loop between two tach poll passes. Deadlines move by whole periods
+# so periodic tasks do not drift; a task started a whole period or
+# more late skips the missed slots and counts an overrun. Deadlines
+# are compared with ticks_diff and never wrap wrongly.
+#
+# Per task statistics: runs, overruns, worst lateness in ms, worst
+# run time in us and the average run time over the last 32 to 64 runs:
+# the older half of the window is dropped each time it fills, so the
+# sums stay small ints and reading them does not allocate.
+
+import utime
+from array import array
+
+
+AVERAGE_WINDOW_RUNS = const(64)
+
+
+class Scheduler:
+    def __init__(self, maxTasks=8):
+        self._maxTasks = maxTasks
+        self._numberOfTasks = 0
+        self._callbacks = [None for _ in range(maxTasks)]
+        self._periods = array('i', [0 for _ in range(maxTasks)])        # ms, 0 for a one shot task
+        self._deadlines = array('i', [0 for _ in range(maxTasks)])
+        self._active = bytearray(maxTasks)
+        self._nextDeadline = utime.ticks_ms()
+        self.runs = array('i', [0 for _ in range(maxTasks)])
+        self.overruns = array('i', [0 for _ in range(maxTasks)])
+        self.maxLatenessMs = array('i', [0 for _ in range(maxTasks)])
+        self.maxRunUs = array('i', [0 for _ in range(maxTasks)])
+        self.averageRunUs = array('i', [0 for _ in range(maxTasks)])
+        self._windowRuns = array('i', [0 for _ in range(maxTasks)])
+        self._windowTotalUs = array('i', [0 for _ in range(maxTasks)])
+
+    # Returns the task number. periodMs 0 runs the task once, firstDelayMs after now.
+    def addTask(self, callback, periodMs, firstDelayMs=0):
+        if self._numberOfTasks == self._maxTasks:
+            raise ValueError('no free task slot')
+        task = self._numberOfTasks
+        self._numberOfTasks += 1
+        self._callbacks[task] = callback
+        self._periods[task] = periodMs
+        self.start(task, firstDelayMs)
+        return task
+
+    def start(self, task, delayMs=0):
+        self._deadlines[task] = utime.ticks_add(utime.ticks_ms(), delayMs)
+        self._active[task] = 1
+        if utime.ticks_diff(self._deadlines[task], self._nextDeadline) < 0:
+            self._nextDeadline = self._deadlines[task]
+
+    def stop(self, task):
+        self._active[task] = 0
+
+    def isActive(self, task):
+        return self._active[task] == 1
+
+    # Runs the tasks that are due, in task number order
+    def runOnce(self):
+        now = utime.ticks_ms()
+        if utime.ticks_diff(self._nextDeadline, now) > 0:
+            return
+        for task in range(self._numberOfTasks):
+            if not self._active[task]:
+                continue
+            lateness = utime.ticks_diff(now, self._deadlines[task])
+            if lateness < 0:
+                continue
+            period = self._periods[task]
+            if period:
+                deadline = utime.ticks_add(self._deadlines[task], period)
+                if utime.ticks_diff(deadline, now) <= 0:
+                    self.overruns[task] += 1
+                    deadline = utime.ticks_add(now, period)
+                self._deadlines[task] = deadline
+            else:
+                self._active[task] = 0
+            if lateness > self.maxLatenessMs[task]:
+                self.maxLatenessMs[task] = lateness
+            startTimeStamp = utime.ticks_us()
+            self._callbacks[task]()
+            runUs = utime.ticks_diff(utime.ticks_us(), startTimeStamp)
+            self.runs[task] += 1
+            windowRuns = self._windowRuns[task] + 1
+            windowTotalUs = self._windowTotalUs[task] + runUs
+            self.averageRunUs[task] = windowTotalUs // windowRuns
+            if windowRuns == AVERAGE_WINDOW_RUNS:
+                windowRuns >>= 1
+                windowTotalUs >>= 1
+            self._windowRuns[task] = windowRuns
+            self._windowTotalUs[task] = windowTotalUs
+            if runUs > self.maxRunUs[task]:
+                self.maxRunUs[task] = runUs
+        self._updateNextDeadline()
+
+    def _updateNextDeadline(self):
+        now = utime.ticks_ms()
+        nextDeadline = utime.ticks_add(now, 1000)
+        for task in range(self._numberOfTasks):
+            if self._active[task] and utime.ticks_diff(self._deadlines[task], nextDeadline) < 0:
+                nextDeadline = self._deadlines[task]
+        self._nextDeadline = nextDeadline
+
+    # Never returns, idle is called between two runOnce()
+    def run(self, idle):
+        while True:
+            self.runOnce()
+            idle()
+
+    def resetStatistics(self):
+        for task in range(self._maxTasks):
+            self.runs[task] = 0
+            self.overruns[task] = 0
+            self.maxLatenessMs[task] = 0
+            self.maxRunUs[task] = 0
+            self.averageRunUs[task] = 0
+            self._windowRuns[task] = 0
+            self._windowTotalUs[task] = 0
@@ -0,0 +1,82 @@
+#########################################################
+#                                                       #
+#                TachPeriodEstimator.py                 #
+#         Low latency fan RPM from tach edge periods    #
+#                                                       #
+#########################################################
+
+# Every rising tach edge closes a period that goes in a small per
+# fan ring buffer with a running sum, and the fan RPM is published
+# right away from the average of the last periodsAveraged periods.
+# A fan whose last edge is older than stallTimeoutUs reads 0 RPM at
+# the next checkStalls(). Fans give 2 tach pulses per revolution.
+#
+# risingEdge() is called from the tach poll loop and from the tach
+# ISR, it does not allocate.
+
+from array import array
+
+
+TICKS_MAX = const(0x1fffffff)       # utime ticks wrap at 2**29 on the stm32 port
+US_PER_MINUTE_PER_PULSE = const(30000000)
+
+
+class TachPeriodEstimator:
+    def __init__(self, numberOfFans, periodsAveraged=8, stallTimeoutUs=400000):
+        self._numberOfFans = numberOfFans
+        self._periodsAveraged = periodsAveraged
+        self._stallTimeoutUs = stallTimeoutUs
+        self._periods = array('i', [0 for _ in range(numberOfFans * periodsAveraged)])
+        self._periodSums = array('i', [0 for _ in range(numberOfFans)])
+        self._periodCounts = bytearray(numberOfFans)
+        self._periodHeads = bytearray(numberOfFans)
+        self._hasLastEdge = bytearray(numberOfFans)
+        self._lastRisingTimeStamps = array('i', [0 for _ in range(numberOfFans)])
+        self.rpms = array('i', [0 for _ in range(numberOfFans)])
+
+    @micropython.viper
+    def risingEdge(self, fan: int, nowTimeStamp: int):
+        lastTimeStamps = ptr32(self._lastRisingTimeStamps)
+        hasLastEdge = ptr8(self._hasLastEdge)
+        counts = ptr8(self._periodCounts)
+        sums = ptr32(self._periodSums)
+        period = (nowTimeStamp - int(lastTimeStamps[fan])) & TICKS_MAX
+        lastTimeStamps[fan] = nowTimeStamp
+        if not hasLastEdge[fan] or period > int(self._stallTimeoutUs):
+            # first edge, or first edge after a stall: start over
+            hasLastEdge[fan] = 1
+            counts[fan] = 0
+            sums[fan] = 0
+            return
+        periodsAveraged = int(self._periodsAveraged)
+        periods = ptr32(self._periods)
+        heads = ptr8(self._periodHeads)
+        head = int(heads[fan])
+        slot = fan * periodsAveraged + head
+        count = int(counts[fan])
+        if count < periodsAveraged:
+            count += 1
+            counts[fan] = count
+            total = int(sums[fan]) + period
+        else:
+            total = int(sums[fan]) + period - int(periods[slot])
+        periods[slot] = period
+        sums[fan] = total
+        head += 1
+        heads[fan] = head if head < periodsAveraged else 0
+        rpms = ptr32(self.rpms)
+        rpms[fan] = (US_PER_MINUTE_PER_PULSE * count) // total
+
+    @micropython.viper
+    def checkStalls(self, nowTimeStamp: int):
+        lastTimeStamps = ptr32(self._lastRisingTimeStamps)
+        hasLastEdge = ptr8(self._hasLastEdge)
+        rpms = ptr32(self.rpms)
+        stallTimeoutUs = int(self._stallTimeoutUs)
+        fan = 0
+        numberOfFans = int(self._numberOfFans)
+        while fan < numberOfFans:
+            if (nowTimeStamp - int(lastTimeStamps[fan])) & TICKS_MAX > stallTimeoutUs:
+                rpms[fan] = 0
+                hasLastEdge[fan] = 0        # the next edge starts over
+            fan += 1
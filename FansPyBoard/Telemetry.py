@@ -0,0 +1,88 @@
+#########################################################
+#                                                       #
+#                      Telemetry.py                     #
+#       Binary controller state frames over USB VCP     #
+#                                                       #
+#########################################################
+
+# One fixed layout frame per call to send(), little endian:
+#
+#     H   magic 0x5aa5
+#     B   version
+#     B   number of fans N
+#     H   sequence number, incremented for every frame, sent or not
+#     I   utime.ticks_ms()
+#     h   water temperature in centi-degrees
+#     N H fan RPMs
+#     3 B PWM duties in percent, top, bottom top, bottom bottom
+#     3 i PID proportional, integral and derivative terms, 1/65536 %
+#     B   PID output
+#     B   checksum, sum of all the previous bytes modulo 256
+#
+# The frame is packed in place in a preallocated buffer and only
+# written when the stream can take it, a frame that would block is
+# dropped and counted. host/recorder.py decodes the stream, text
+# from the REPL sharing the USB VCP is skipped.
+
+import struct
+import uselect
+import utime
+
+
+TELEMETRY_MAGIC = const(0x5aa5)
+TELEMETRY_VERSION = const(2)
+HEADER_SIZE = const(10)
+MIN_RATE_HZ = const(1)
+MAX_RATE_HZ = const(100)
+
+
+class Telemetry:
+    def __init__(self, stream, numberOfFans, rateHz=10):
+        if rateHz < MIN_RATE_HZ or rateHz > MAX_RATE_HZ:
+            raise ValueError('telemetry rate must be 1 to 100 Hz')
+        self.periodMs = 1000 // rateHz
+        self._stream = stream
+        self._poller = uselect.poll()
+        self._poller.register(stream, uselect.POLLOUT)
+        self._numberOfFans = numberOfFans
+        self._rpmsOffset = HEADER_SIZE + 2
+        self._dutiesOffset = self._rpmsOffset + 2 * numberOfFans
+        self._pidOffset = self._dutiesOffset + 3
+        self._frame = bytearray(self._pidOffset + 12 + 2)
+        self._sequence = 0
+        self.sentFrames = 0
+        self.droppedFrames = 0
+
+    def send(self, centiDegrees, rpms, duties, pid):
+        frame = self._frame
+        struct.pack_into('<HBBHIh', frame, 0, TELEMETRY_MAGIC, TELEMETRY_VERSION, self._numberOfFans,
+                         self._sequence, utime.ticks_ms(), centiDegrees)
+        offset = self._rpmsOffset
+        for i in range(self._numberOfFans):
+            struct.pack_into('<H', frame, offset, min(rpms[i], 0xffff))
+            offset += 2
+        offset = self._dutiesOffset
+        frame[offset] = duties[0]
+        frame[offset + 1] = duties[1]
+        frame[offset + 2] = duties[2]
+        struct.pack_into('<iiiB', frame, self._pidOffset, pid.proportionalTerm, pid.integralTerm,
+                         pid.derivativeTerm, pid.output)
+        self._sequence = (self._sequence + 1) & 0xffff
+        frame[len(frame) - 1] = self._checksum(frame, len(frame) - 1)
+        for _ in self._poller.ipoll(0):
+            # a short write leaves a truncated frame, the recorder skips it on its checksum
+            if self._stream.write(frame) == len(frame):
+                self.sentFrames += 1
+                return
+            break
+        self.droppedFrames += 1
+
+    @micropython.viper
+    def _checksum(self, frame, length: int) -> int:
+        data = ptr8(frame)
+        total = 0
+        i = 0
+        while i < length:
+            total += data[i]
+            i += 1
+        return total & 0xff
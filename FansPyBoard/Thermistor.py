@@ -0,0 +1,40 @@
+#########################################################
+#                                                       #
+#                     Thermistor.py                     #
+#       Table based ADC reading to temperature          #
+#                                                       #
+#########################################################
+
+# Converts an averaged ADC reading to centi-degrees C with a table
+# generated on the host by host/thermtable.py and linear
+# interpolation in integer arithmetic: no float, no allocation.
+# Another sensor type only needs another generated table module.
+#
+# The reading is given as a sum of samples and their count, so the
+# average keeps FRACTION_BITS of sub-code resolution.
+
+FRACTION_BITS = const(4)
+
+
+class Thermistor:
+    def __init__(self, table):
+        self._firstCodeQ4 = table.FIRST_CODE << FRACTION_BITS
+        self._shift = table.CODE_SHIFT + FRACTION_BITS
+        self._centiDegrees = table.CENTI_DEGREES
+        self._lastIndex = len(table.CENTI_DEGREES) - 1
+
+    # ptr16 reads the table unsigned, (v ^ 0x8000) - 0x8000 restores the sign
+    @micropython.viper
+    def centiDegrees(self, sumOfReadings: int, numberOfReadings: int) -> int:
+        centiDegrees = ptr16(self._centiDegrees)
+        lastIndex = int(self._lastIndex)
+        offset = (sumOfReadings << FRACTION_BITS) // numberOfReadings - int(self._firstCodeQ4)
+        if offset <= 0:
+            return (int(centiDegrees[0]) ^ 0x8000) - 0x8000
+        shift = int(self._shift)
+        index = offset >> shift
+        if index >= lastIndex:
+            return (int(centiDegrees[lastIndex]) ^ 0x8000) - 0x8000
+        low = (int(centiDegrees[index]) ^ 0x8000) - 0x8000
+        high = (int(centiDegrees[index + 1]) ^ 0x8000) - 0x8000
+        return low + (((high - low) * (offset & ((1 << shift) - 1))) >> shift)
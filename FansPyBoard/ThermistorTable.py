@@ -0,0 +1,23 @@
+# Generated by host/thermtable.py, do not edit.
+#
+# T = 0.2 + (-0.0019 * R * R + 38.14 * R + 43870.0) / (R + -827.0)
+# R = (4095 / adc - 1) * 2200, 0 to 100 deg C, max interpolation error 0.0263 deg C
+
+from array import array
+
+FIRST_CODE = const(384)
+CODE_SHIFT = const(4)       # one entry every 16 ADC codes
+CENTI_DEGREES = array('h', (
+    0, 196, 378, 548, 708, 858, 1000, 1133, 1260, 1381,
+    1496, 1606, 1711, 1811, 1908, 2001, 2091, 2178, 2262, 2343,
+    2422, 2499, 2574, 2646, 2718, 2787, 2855, 2922, 2988, 3052,
+    3115, 3178, 3239, 3300, 3360, 3419, 3478, 3536, 3593, 3651,
+    3708, 3764, 3820, 3876, 3932, 3988, 4044, 4100, 4155, 4211,
+    4267, 4323, 4379, 4435, 4491, 4548, 4605, 4663, 4720, 4779,
+    4837, 4897, 4956, 5017, 5077, 5139, 5201, 5264, 5328, 5393,
+    5458, 5524, 5592, 5660, 5729, 5800, 5872, 5944, 6019, 6094,
+    6171, 6249, 6329, 6411, 6494, 6579, 6665, 6754, 6845, 6937,
+    7032, 7130, 7229, 7331, 7436, 7544, 7654, 7768, 7884, 8004,
+    8128, 8255, 8386, 8522, 8661, 8805, 8954, 9108, 9268, 9433,
+    9604, 9782, 9966, 10158,
+))
@@ -0,0 +1,183 @@
+#########################################################
+#                                                       #
+#                         Zone.py                       #
+#      Per PWM channel fan zones and their coordinator  #
+#                                                       #
+#########################################################
+
+# A zone is a PWM channel, the fans it drives (by position in the
+# RPM array) and optionally a coolant sensor of its own.
+#
+# ZoneCoordinator.update() turns the cooling demand (0-100 %, from
+# the water temperature PID) into a target RPM per zone. A fan on a
+# radiator removes heat with diminishing returns, modelled as
+#     h(rpm) = weight * (rpm - rpm * rpm / (4 * maxRpm))
+# so the marginal cooling per RPM, weight * (1 - rpm / (2 * maxRpm)),
+# drops as the fan speeds up. The demand asks for demand % of the
+# cooling all the running fans give at maxRpm, and the lowest total
+# RPM that delivers it has the same marginal cooling in every zone
+# not held at its minimum or maximum speed: it is found by bisection
+# on that marginal. Stopped fans neither count nor cool.
+#
+# Each zone then runs its own loops: the zone sensor, when there is
+# one (entry sensor of the temperatures array the controller fills
+# from its ADC sweep), feeds a FixedPID whose output is a floor for
+# the zone RPM, and the duty follows the target RPM with a
+# feed-forward plus an integral trim on the tach feedback of the zone
+# fans. The feed-forward is the duty the FanCurve of the channel
+# gives for the target RPM, or the proportional one from maxRpm
+# without a curve. The zone min and max RPM come from the curve, and
+# the RPM of fans held at one duty for LEARN_SETTLE_MS is fed back to
+# it.
+#
+# Everything is integer arithmetic on preallocated state.
+
+import utime
+from array import array
+from PID import FixedPID
+
+
+MARGINAL_SCALE = const(256)             # marginal cooling per RPM in 1/256 of a weight unit
+BISECTION_STEPS = const(16)
+TRIM_MAX_Q8 = const(20 * 256)           # the tach trim moves the duty by at most 20 %
+LEARN_SETTLE_MS = const(5000)           # the fan curve learns from fans held at one duty this long
+SETTLED_PERCENT = const(2)              # fans whose RPM moved less than this since the last update have settled
+STEP_Q8 = const(256)                    # a feed-forward change of more than 1 % is a step the trim does not see
+
+
+class Zone:
+    def __init__(self, name, setDuty, fanIndexes, maxRpm, minDuty, weight=100,
+                 temperatures=None, sensor=0, setValue=40.0, kP=5.0, kI=0.05, kD=0.0, curve=None, channel=0):
+        self.name = name
+        self._setDuty = setDuty
+        self.fanIndexes = array('B', fanIndexes)
+        self.maxRpm = maxRpm
+        self.minDuty = minDuty
+        self.minRpm = maxRpm * minDuty // 100
+        self.weight = weight
+        self._temperatures = temperatures
+        self._sensor = sensor
+        self._pid = FixedPID(setValue=setValue, kP=kP, kI=kI, kD=kD) if temperatures is not None else None
+        self.centiDegrees = 0
+        self.runningFans = len(fanIndexes)
+        self.measuredRpm = 0
+        self._previousMeasuredRpm = 0
+        self.targetRpm = self.minRpm
+        self.duty = minDuty
+        self._trimQ8 = 0
+        self._feedForwardQ8 = 0
+        self._curve = curve
+        self._channel = channel
+        self._dutySetMs = utime.ticks_ms()
+        self._refreshLimits()
+
+    def _refreshLimits(self):
+        if self._curve is not None:
+            self.maxRpm = max(1, self._curve.maxRpm(self._channel))
+            self.minRpm = min(self.maxRpm, self._curve.minRpm(self._channel))
+
+    def hasSensor(self):
+        return self._temperatures is not None
+
+    def measure(self, rpms):
+        total = 0
+        running = 0
+        for i in self.fanIndexes:
+            if rpms[i] > 0:
+                total += rpms[i]
+                running += 1
+        self.runningFans = running
+        self._previousMeasuredRpm = self.measuredRpm
+        self.measuredRpm = total // running if running else 0
+        self._refreshLimits()
+
+    # RPM the zone sensor loop asks for at least, 0 without a sensor
+    def floorRpm(self):
+        if self._pid is None:
+            return 0
+        self.centiDegrees = self._temperatures[self._sensor]
+        return self.maxRpm * self._pid.update(self.centiDegrees) // 100
+
+    # Cooling of the running fans at rpm, in weight * RPM units
+    def cooling(self, rpm):
+        return self.runningFans * self.weight * (rpm - rpm * rpm // (4 * self.maxRpm))
+
+    # Speed at which the marginal cooling per RPM is marginal, between minRpm and maxRpm
+    def rpmForMarginal(self, marginal):
+        scaledWeight = self.weight * MARGINAL_SCALE
+        if marginal >= scaledWeight:
+            return self.minRpm
+        rpm = 2 * self.maxRpm * (scaledWeight - marginal) // scaledWeight
+        return max(self.minRpm, min(self.maxRpm, rpm))
+
+    # The duty was changed behind the zone's back, e.g. by a FanCurveSweep
+    def restart(self):
+        self.duty = 0
+        self._trimQ8 = 0
+        self._dutySetMs = utime.ticks_ms()
+
+    def drive(self, targetRpm):
+        self.targetRpm = targetRpm
+        # the fans are still speeding up or slowing down while their RPM moves
+        settled = (self.runningFans and self.measuredRpm
+                   and abs(self.measuredRpm - self._previousMeasuredRpm) * 100 <= self.measuredRpm * SETTLED_PERCENT)
+        if self._curve is not None:
+            if settled and utime.ticks_diff(utime.ticks_ms(), self._dutySetMs) >= LEARN_SETTLE_MS:
+                self._curve.learn(self._channel, self.duty, self.measuredRpm)
+            feedForwardQ8 = self._curve.dutyQ8For(self._channel, targetRpm)
+        else:
+            feedForwardQ8 = (targetRpm * 100 << 8) // self.maxRpm
+        stepped = abs(feedForwardQ8 - self._feedForwardQ8) > STEP_Q8
+        self._feedForwardQ8 = feedForwardQ8
+        duty = (feedForwardQ8 + self._trimQ8 + 128) >> 8
+        if settled and not stepped:
+            # integral trim on the tach feedback of settled fans, a quarter of the duty error per update, not
+            # winding past the bounds
+            errorQ8 = (targetRpm - self.measuredRpm) * 100 * 256 // self.maxRpm
+            if (errorQ8 > 0 and duty < 100) or (errorQ8 < 0 and duty > self.minDuty):
+                self._trimQ8 = max(-TRIM_MAX_Q8, min(TRIM_MAX_Q8, self._trimQ8 + errorQ8 // 4))
+        duty = max(self.minDuty, min(100, duty))
+        if duty != self.duty:
+            self._dutySetMs = utime.ticks_ms()
+        self.duty = duty
+        self._setDuty(duty)
+
+
+class ZoneCoordinator:
+    def __init__(self, zones):
+        self.zones = zones
+        self.demand = 0
+        self._maxMarginal = max(zone.weight for zone in zones) * MARGINAL_SCALE
+
+    def update(self, demandPercent, rpms):
+        self.demand = demandPercent
+        zones = self.zones
+        capacity = 0
+        for zone in zones:
+            zone.measure(rpms)
+            capacity += zone.cooling(zone.maxRpm)
+        required = capacity // 100 * demandPercent
+        # largest marginal, i.e. lowest speeds, whose total cooling still meets the demand
+        low = 0
+        high = self._maxMarginal
+        for _ in range(BISECTION_STEPS):
+            middle = (low + high + 1) >> 1
+            total = 0
+            for zone in zones:
+                total += zone.cooling(zone.rpmForMarginal(middle))
+            if total >= required:
+                low = middle
+            else:
+                high = middle - 1
+        for zone in zones:
+            zone.drive(max(zone.rpmForMarginal(low), zone.floorRpm()))
+
+    def restart(self):
+        for zone in self.zones:
+            zone.restart()
+
+    def totalTargetRpm(self):
+        total = 0
+        for zone in self.zones:
+            total += zone.targetRpm * zone.runningFans
+        return total
@@ -0,0 +1,2 @@
+# Host side tools for the FansPyBoard firmware. Nothing in this
+# package is copied to the board.
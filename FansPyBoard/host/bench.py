@@ -0,0 +1,210 @@
+#########################################################
+#                                                       #
+#                        bench.py                       #
+#     Hot path benchmarks against stored baselines      #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.bench                           # on the simulator, against host/baselines/sim.json
+#     python3 -m host.bench --save                    # records the baseline instead
+#     python3 -m host.bench --target host --save      # interpreter time charged, a baseline per host machine
+#     python3 -m host.bench --port /dev/ttyACM0       # on the board, against host/baselines/pyboard.json
+#     python3 -m host.bench --results capture.txt --target pyboard
+#
+# Runs Benchmark.run() (Benchmark.py, the same module the board runs
+# from its REPL) and compares every hot path with the baseline of the
+# target: slower by more than --threshold percent, more heap bytes
+# per call, or a lower main loop rate is a regression, and the exit
+# status is 1.
+#
+# sim: the controller on the virtual board with a scripted load, 250 W
+# then 400 W, fan 4 stalled, every tach pin polled so that the poll
+# does the work it does without ExtInt. Times follow the board cost
+# model (CALL_COSTS_US, I2C and ADC timings in host/sim/board.py) and
+# are the same on every host: a regression there is more clock and
+# register reads, I2C traffic or ADC blocking. The PID update, the
+# temperature conversion and the fan health are pure Python that the
+# model does not charge, they are left out of the sim target.
+# host: the same with the host interpreter time charged one for one
+# (--cpu-scale 1), every path included, for changes to the Python
+# itself. The best of HOST_RUNS runs, with the time of a fixed loop of
+# Python (referenceUs) that scales the times to the machine speed of
+# the baseline; what is left varies by 15 %, hence the 30 % threshold.
+# The committed host.json was saved on the development machine, save
+# one on yours before relying on it.
+# pyboard: Benchmark.py copied to the board flash, it is not part of
+# the firmware, and Benchmark.run(controller) through mpremote. With
+# resume, mpremote interrupts main.py instead of soft resetting the
+# board, and the controller of main.py stays stopped at the REPL; on
+# a board where main.py did not run, the controller is built first.
+# With --results, the BENCH line is read from a capture of the REPL
+# output instead. No pyboard.json is committed, record one from a
+# board with --port and --save.
+#
+# CPython has no gc.mem_alloc and the simulator does not import under
+# the unix MicroPython port: sim and host give no heap bytes, an
+# allocation regression only shows against the pyboard baseline.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from host.simulate import heatSchedule
+from host.sim.harness import Simulation
+
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+WARM_UP_SECONDS = 10
+FAILED_FAN = 3
+FAN_FAILURE_SECONDS = 5
+HEAT_STEPS = ((400.0, 12.0),)
+# pure Python, the board cost model charges them nothing or only their clock reads
+SIM_UNCHARGED_PATHS = ('pidUpdate', 'temperatureUpdate', 'fanHealth')
+HOST_RUNS = 5
+REFERENCE_LOOPS = 20000
+
+
+def runOnSimulator(cpuScale):
+    def configure(firmware):
+        firmware.TACH_ACQUISITION_MODE = firmware.TACH_ACQUISITION_POLLING
+    simulation = Simulation(cpuScale=cpuScale, heatW=heatSchedule(250.0, HEAT_STEPS), configure=configure)
+    # the fans follow the proportional curve, not a minute long sweep
+    simulation.controller._fanCurveSweepPending = False
+    simulation.run(FAN_FAILURE_SECONDS)
+    simulation.board.fans[FAILED_FAN].failed = True
+    simulation.run(WARM_UP_SECONDS - FAN_FAILURE_SECONDS)
+    import Benchmark
+    if not cpuScale:
+        results = Benchmark.run(simulation.controller)
+        for name in SIM_UNCHARGED_PATHS:
+            del results['paths'][name]
+        return results
+    # the best of a few runs, the host scheduler only ever adds time
+    runs = [Benchmark.run(simulation.controller) for _ in range(HOST_RUNS)]
+    results = runs[0]
+    for name, path in results['paths'].items():
+        path['us'] = min(run['paths'][name]['us'] for run in runs)
+    results['passesPerSecond'] = max(run['passesPerSecond'] for run in runs)
+    results['referenceUs'] = round(referenceUs(), 2)
+    return results
+
+
+# Host us of a fixed piece of Python, the best of a few: how fast the machine runs right now
+def referenceUs():
+    best = None
+    for _ in range(HOST_RUNS):
+        startNs = time.perf_counter_ns()
+        total = 0
+        for i in range(REFERENCE_LOOPS):
+            total += i & 7
+        elapsedUs = (time.perf_counter_ns() - startNs) / 1000.0
+        best = elapsedUs if best is None else min(best, elapsedUs)
+    return best
+
+
+def parseResults(text):
+    for line in text.splitlines():
+        if line.startswith('BENCH '):
+            return json.loads(line[len('BENCH '):])
+    raise ValueError('no BENCH line in the output')
+
+
+# The controller of main.py, or a new one when main.py did not run
+BOARD_COMMANDS = '''import Benchmark
+try:
+    controller
+except NameError:
+    from FanController import Controller
+    controller = Controller()
+Benchmark.run(controller)
+'''
+
+
+def runOnBoard(port):
+    benchmark = os.path.join(os.path.dirname(BASELINES_DIR), '..', 'Benchmark.py')
+    output = subprocess.run(['mpremote', 'connect', port, 'resume', 'cp', benchmark, ':Benchmark.py', '+',
+                             'exec', BOARD_COMMANDS],
+                            capture_output=True, text=True, timeout=300, check=True).stdout
+    return parseResults(output)
+
+
+def compare(baseline, results, thresholdPercent):
+    if 'referenceUs' in baseline and 'referenceUs' in results:
+        # host times brought to the speed the machine had for the baseline
+        scale = baseline['referenceUs'] / results['referenceUs']
+        print('machine speed against the baseline: x%.2f, times scaled' % (1.0 / scale))
+        for path in results['paths'].values():
+            path['us'] *= scale
+        results['passesPerSecond'] = int(results['passesPerSecond'] / scale)
+    regressions = 0
+    print('%-18s %12s %12s %8s %14s' % ('', 'baseline us', 'us', 'change', 'bytes per call'))
+    for name, base in baseline['paths'].items():
+        current = results['paths'].get(name)
+        if current is None:
+            print('%-18s %12.2f %12s' % (name, base['us'], 'missing'))
+            regressions += 1
+            continue
+        change = 100.0 * (current['us'] - base['us']) / base['us'] if base['us'] else 0.0
+        slower = current['us'] > base['us'] * (1.0 + thresholdPercent / 100.0)
+        allocates = (current['bytes'] is not None and base['bytes'] is not None and current['bytes'] > base['bytes'])
+        bytesText = '-' if current['bytes'] is None else '%.2f' % current['bytes']
+        if base['bytes'] is not None and current['bytes'] is not None:
+            bytesText = '%.2f -> %s' % (base['bytes'], bytesText)
+        print('%-18s %12.2f %12.2f %+7.1f%% %14s%s' % (name, base['us'], current['us'], change, bytesText,
+                                                       '  REGRESSION' if slower or allocates else ''))
+        regressions += slower or allocates
+    slower = results['passesPerSecond'] < baseline['passesPerSecond'] * (1.0 - thresholdPercent / 100.0)
+    print('%-18s %12d %12d %+7.1f%%%s' % ('loop passes/s', baseline['passesPerSecond'], results['passesPerSecond'],
+                                          100.0 * (results['passesPerSecond'] - baseline['passesPerSecond'])
+                                          / max(1, baseline['passesPerSecond']), '  REGRESSION' if slower else ''))
+    return regressions + slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the firmware hot paths against a stored baseline')
+    parser.add_argument('--target', choices=('sim', 'host', 'pyboard'), default=None,
+                        help='baseline to compare with (default sim, pyboard with --port)')
+    parser.add_argument('--port', help='serial device of the board, runs the benchmark there with mpremote')
+    parser.add_argument('--results', metavar='FILE', help='text holding a BENCH line, e.g. a REPL capture')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='slowdown counted as a regression, %% (default 10, 30 for the host target)')
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline of the target')
+    args = parser.parse_args()
+
+    target = args.target or ('pyboard' if args.port else 'sim')
+    threshold = args.threshold if args.threshold is not None else 30.0 if target == 'host' else 10.0
+    if args.results:
+        with open(args.results) as capture:
+            results = parseResults(capture.read())
+    elif args.port:
+        results = runOnBoard(args.port)
+    elif target == 'pyboard':
+        parser.error('the pyboard target needs --port or --results')
+    else:
+        results = runOnSimulator(1.0 if target == 'host' else 0.0)
+
+    path = os.path.join(BASELINES_DIR, target + '.json')
+    if args.save:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(path, 'w') as baseline:
+            json.dump(results, baseline, indent=2, sort_keys=True)
+            baseline.write('\n')
+        print('baseline saved to %s' % path)
+        return
+    if not os.path.exists(path):
+        print('no baseline for %s, make one with --save' % target)
+        sys.exit(2)
+    with open(path) as baseline:
+        regressions = compare(json.load(baseline), results, threshold)
+    if regressions:
+        print('%d regressions past %.0f %%' % (regressions, threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#########################################################
+#                                                       #
+#                   bench_fancurve.py                   #
+#     Zone RPM steps with and without the fan curve     #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.bench_fancurve
+#
+# The rig fans run at 35 % of their top speed at the minimum duty,
+# like most 4-pin fans, not at 20 % as the proportional feed-forward
+# assumes. The controller boots, sweeps the fan curves and caches
+# them, then boots again on the cache. With the PID task stopped, the
+# top zone is given RPM steps once per second like the PID task does,
+# and the number of updates until its fans are within 2 % of the
+# target is counted with the curve and with the proportional
+# feed-forward. Last, the fans lose 10 % of their speed, as they do
+# when they age, and the same steps show how the curve follows.
+
+from host.sim.harness import Simulation
+
+
+MIN_RPM_FRACTION = 0.35
+STEPS = (600, 1200, 800, 1250, 700)
+UPDATES_PER_STEP = 30
+TOLERANCE_PERCENT = 2
+
+
+def rig(agedFraction=1.0):
+    def build(board, firmware):
+        board.addDefaultRig(firmware)
+        for fan in board.fans:
+            fan.maxRpm *= agedFraction
+            fan.minRpm = MIN_RPM_FRACTION * fan.maxRpm
+    return build
+
+
+def stepResponse(simulation, useCurve):
+    controller = simulation.controller
+    controller._scheduler.stop(controller._adjustFansRpmTaskId)
+    zone = controller._zoneCoordinator.zones[0]
+    if not useCurve:
+        curve = zone._curve
+        zone._curve = None
+        zone.maxRpm = simulation.firmware.RADIATOR_FAN_MAX_RPM
+        zone.minRpm = zone.maxRpm * zone.minDuty // 100
+    updates = []
+    for target in STEPS:
+        settledAfter = None
+        for update in range(UPDATES_PER_STEP):
+            zone.measure(controller._radFansRPMs)
+            if abs(zone.measuredRpm - target) * 100 <= target * TOLERANCE_PERCENT:
+                if settledAfter is None:
+                    settledAfter = update
+            else:
+                settledAfter = None
+            zone.drive(target)
+            simulation.run(1.0)
+        updates.append(settledAfter)
+    if not useCurve:
+        zone._curve = curve
+    return updates
+
+
+def curveError(simulation):
+    # largest difference between the cached curve of the top channel and its fans, in RPM
+    curve = simulation.controller._fanCurve
+    fans = simulation.board.fans[:4]
+    worst = 0
+    for point in range(curve.numberOfPoints):
+        duty = curve.minDuty + point * curve.dutyStep
+        true = sum(fan.minRpm + (fan.maxRpm - fan.minRpm) * (duty - fan.minDuty) / (100.0 - fan.minDuty)
+                   for fan in fans) / len(fans)
+        worst = max(worst, abs(curve.rpms[point] - true))
+    return worst
+
+
+def formatUpdates(updates):
+    return ' '.join('%3s' % ('-' if update is None else update) for update in updates)
+
+
+def main():
+    first = Simulation(rig=rig())
+    sweepSeconds = 0.0
+    while not first.controller._fanCurve.measured:
+        first.run(1.0)
+        sweepSeconds += 1.0
+    print('boot sweep         %5.0f s, curve within %.0f RPM of the fans, cached in %s' % (
+        sweepSeconds, curveError(first), first.flashDir))
+
+    print('updates to within %d %% of %s' % (TOLERANCE_PERCENT, ' '.join('%d' % step for step in STEPS)))
+    for label, useCurve in (('proportional', False), ('fan curve', True)):
+        simulation = Simulation(rig=rig(), flashDir=first.flashDir)
+        assert simulation.controller._fanCurve.measured and not simulation.controller._fanCurveSweep.active
+        simulation.run(5.0)
+        print('  %-16s %s' % (label, formatUpdates(stepResponse(simulation, useCurve))))
+
+    aged = Simulation(rig=rig(0.9), flashDir=first.flashDir)
+    aged.run(5.0)
+    errorBefore = curveError(aged)
+    updates = stepResponse(aged, True)
+    print('  %-16s %s   curve error %.0f RPM -> %.0f RPM, %d learned updates' % (
+        'aged 10 %', formatUpdates(updates), errorBefore, curveError(aged), aged.controller._fanCurve.learnedUpdates))
+    print('  %-16s %s' % ('aged, again', formatUpdates(stepResponse(aged, True))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#########################################################
+#                                                       #
+#                      bench_lcd.py                     #
+#       I2C cost of one LCD refresh, before/after       #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.bench_lcd
+#
+# Counts the I2C transactions, bytes and virtual microseconds of one
+# 2 line refresh done the previous way (clear, print, setCursor,
+# print: one transaction per nibble strobe edge and a 2 ms clear) and
+# with LCM1602_I2C.update(), at 100 and 400 kHz, when the screen
+# changes and when only the temperature digits change. The decoded
+# display content is checked after every refresh.
+
+from host.sim.harness import Simulation
+
+
+SCREENS = (
+    ('CPU Inlet Water', 'Temp 31.4 deg C'),
+    ('Radiator Fan RPM', '      1250      '),
+)
+TEMPERATURES = ('Temp 31.4 deg C', 'Temp 31.5 deg C')
+
+
+def legacyRefresh(lcd, line1, line2):
+    lcd.clear()
+    lcd.print(line1)
+    lcd.setCursor(0, 1)
+    lcd.print(line2)
+
+
+def updateRefresh(lcd, line1, line2):
+    lcd.update((line1, line2))
+
+
+def measure(simulation, baudrate, refresh, frames, repeats=20):
+    board = simulation.board
+    firmware = simulation.firmware
+    lcd = firmware.LCM1602_I2C(cols=16, rows=2, i2cPort=firmware.LCD_I2C_PORT, baudrate=baudrate)
+    device = board.lcd()
+    refresh(lcd, *frames[-1])
+    transactions, bytesSent, startUs = board.stats['i2cTransactions'], board.stats['i2cBytes'], board.nowUs()
+    violations = device.timingViolations
+    for i in range(repeats):
+        line1, line2 = frames[i % len(frames)]
+        refresh(lcd, line1, line2)
+        if device.lines() != [line1.ljust(16), line2.ljust(16)]:
+            raise AssertionError('display shows %r instead of %r' % (device.lines(), (line1, line2)))
+    return ((board.stats['i2cTransactions'] - transactions) / float(repeats),
+            (board.stats['i2cBytes'] - bytesSent) / float(repeats),
+            (board.nowUs() - startUs) / repeats,
+            device.timingViolations - violations)
+
+
+def run():
+    simulation = Simulation()
+    results = []
+    for label, frames in (('screen change', SCREENS),
+                          ('temperature', [(SCREENS[0][0], line2) for line2 in TEMPERATURES])):
+        for baudrate in (100000, 400000):
+            before = measure(simulation, baudrate, legacyRefresh, frames)
+            after = measure(simulation, baudrate, updateRefresh, frames)
+            results.append((label, baudrate, before, after))
+    return results
+
+
+def main():
+    print('%-14s %6s %28s %28s' % ('', 'kHz', 'clear + print', 'update()'))
+    for label, baudrate, before, after in run():
+        print('%-14s %6d %6.0f tx %5.0f B %7.0f us %6.0f tx %5.0f B %7.0f us   %d/%d late' % (
+            label, baudrate // 1000, before[0], before[1], before[2], after[0], after[1], after[2],
+            before[3], after[3]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#########################################################
+#                                                       #
+#                    bench_sensors.py                   #
+#     ADC sweep of 1, 4 and 7 temperature sensors       #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.bench_sensors
+#
+# Times AdcSweep on the virtual board for 1, 4 and 7 sensor channels:
+# how long a sweep blocks the main loop, the sweep and conversion
+# rates back to back and whether the conversions kept up with the
+# timer, against one burst per sensor after the other as with one
+# sampler per sensor before. Virtual times follow the board cost
+# model (ADC_CONVERSION_US in host/sim/board.py).
+#
+# Then runs the whole controller with 1, 4 and 7 entries in
+# TEMPERATURE_SENSORS and compares the temperature task run time and
+# the main loop rate, next to the CPython time of folding a sweep
+# into the ring and converting every channel, which the board cost
+# model does not charge: host microseconds are only meaningful
+# relative to each other.
+
+import time
+
+from host import sim
+from host.sim.devices import ThermalModel
+from host.sim.harness import Simulation
+
+
+SENSOR_PINS = ('X19', 'X20', 'X1', 'X5', 'X6', 'X7', 'X8')
+CHANNEL_COUNTS = (1, 4, 7)
+SWEEPS = 100
+
+
+def timeSweeps(board, sweeps):
+    startUs = board.nowUs()
+    for _ in range(SWEEPS):
+        for sweep in sweeps:
+            sweep.sweep()
+    return (board.nowUs() - startUs) / SWEEPS
+
+
+def benchSweep(channels):
+    board = sim.install(sim.VirtualBoard())
+    firmware = sim.loadFirmware('AdcSweep')
+    import pyb
+    model = ThermalModel(temperatureC=35.0)
+    for name in SENSOR_PINS:
+        board.analogSources[name] = model
+    pins = [pyb.Pin(name) for name in SENSOR_PINS[:channels]]
+    timerId = 4
+    together = firmware.AdcSweep(pins, timerId, sampleRate=20000, samplesPerBurst=16, windowLength=50)
+    oneByOne = [firmware.AdcSweep([pin], timerId, sampleRate=20000, samplesPerBurst=16, windowLength=50)
+                for pin in pins]
+    togetherUs = timeSweeps(board, [together])
+    oneByOneUs = timeSweeps(board, oneByOne)
+    return togetherUs, oneByOneUs, together.overruns
+
+
+# Host microseconds of the fold of one sweep into the ring and the conversion of every channel to centi-degrees
+def hostFoldAndConvertUs(channels):
+    sim.install(sim.VirtualBoard())
+    firmware = sim.loadFirmware('AdcSweep')
+    thermistor = sim.loadFirmware('Thermistor').Thermistor(sim.loadFirmware('ThermistorTable'))
+    import pyb
+    sweep = firmware.AdcSweep([pyb.Pin(name) for name in SENSOR_PINS[:channels]], 4)
+    startNs = time.perf_counter_ns()
+    for _ in range(SWEEPS):
+        sweep._accumulateSweep()
+        for channel in range(channels):
+            thermistor.centiDegrees(sweep.sums[channel] + 1, sweep.numberOfSamples)
+    return (time.perf_counter_ns() - startNs) / 1000.0 / SWEEPS
+
+
+def benchController(channels, seconds=30):
+    def configure(firmware):
+        firmware.TEMPERATURE_SENSORS = tuple(
+            ("sensor %d" % i, getattr(firmware.Pin.board, SENSOR_PINS[i]), "ThermistorTable") for i in range(channels))
+    simulation = Simulation(configure=configure)
+    report = simulation.run(seconds)
+    scheduler = simulation.controller._scheduler
+    task = simulation.controller._temperatureTaskId
+    return scheduler.averageRunUs[task], report['pollPassesPerSecond']
+
+
+def main():
+    print('%8s %12s %14s %16s %9s %14s' % ('channels', 'sweep', 'sweeps/s', 'conversions/s', 'overruns',
+                                            'one by one'))
+    for channels in CHANNEL_COUNTS:
+        togetherUs, oneByOneUs, overruns = benchSweep(channels)
+        print('%8d %9.0f us %14.0f %16.0f %9d %11.0f us' % (
+            channels, togetherUs, 1e6 / togetherUs, 16 * channels * 1e6 / togetherUs, overruns, oneByOneUs))
+    print()
+    print('%8s %22s %20s %16s' % ('channels', 'fold + convert (host)', 'temperature task', 'loop passes/s'))
+    for channels in CHANNEL_COUNTS:
+        averageUs, passes = benchController(channels)
+        print('%8d %19.1f us %17.0f us %16.0f' % (channels, hostFoldAndConvertUs(channels), averageUs, passes))
+
+
+if __name__ == '__main__':
+    main()
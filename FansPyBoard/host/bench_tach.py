@@ -0,0 +1,126 @@
+#########################################################
+#                                                       #
+#                     bench_tach.py                     #
+#        Tach poll passes per second, before/after      #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.bench_tach
+#
+# Times Controller._pollTachPinsAndUpdatePulseCounters against the
+# previous per-fan implementation (kept below as the reference) on
+# the virtual board, for the 12 fans of FanController.py and for a
+# tach pin on every GPIOB and GPIOC line. Virtual rates follow the board cost
+# model (host/sim/board.py CALL_COSTS_US), host rates are CPython
+# microseconds and only meaningful relative to each other.
+#
+# Then runs the whole controller with fast fans in each tach
+# acquisition mode and compares the CPU time spent acquiring tach
+# edges and the share of edges lost: every counted edge is matched to
+# the true rising edge of its fan (host/sim/harness.py), a lost edge
+# is a true edge of the run no count was matched to, and a count with
+# no new true edge is spurious.
+
+import time
+
+from host.sim.devices import FanModel
+from host.sim.harness import Simulation
+
+
+class LegacyPoll:
+    # The poll loop as it was before the port-parallel engine: one
+    # register read per fan and per-fan bit extraction.
+    def __init__(self, firmware, pinsIdrIndexes):
+        self._firmware = firmware
+        self._indexes = firmware.array('B', pinsIdrIndexes)
+        self._lastLevels = firmware.array('B', [0 for _ in pinsIdrIndexes])
+        nowTimeStamp = firmware.utime.ticks_us()
+        self._lastTimeStamps = firmware.array('i', [nowTimeStamp for _ in pinsIdrIndexes])
+        self.pulseCounters = firmware.array('i', [0 for _ in pinsIdrIndexes])
+
+    def __call__(self):
+        firmware = self._firmware
+        nowTimeStamp = firmware.utime.ticks_us()
+        for i, gpioIdrIndex in enumerate(self._indexes):
+            bitNumber = gpioIdrIndex & 0x0f
+            gpioLevels = firmware.readGPIOC_IDR() if gpioIdrIndex & 0x80 else firmware.readGPIOB_IDR()
+            newLevel = (gpioLevels & (1 << bitNumber)) >> bitNumber
+            if newLevel != self._lastLevels[i]:
+                elapsedTime = firmware.utime.ticks_diff(nowTimeStamp, self._lastTimeStamps[i])
+                if elapsedTime > 1000:
+                    self._lastLevels[i] = newLevel
+                    self._lastTimeStamps[i] = nowTimeStamp
+                    if newLevel:
+                        irqState = firmware.pyb.disable_irq()
+                        self.pulseCounters[i] += 1
+                        firmware.pyb.enable_irq(irqState)
+
+
+def allPinsRig(board, firmware):
+    board.addDefaultRig(firmware)
+    used = set(fan.idrIndex for fan in board.fans)
+    for port in (0, 0x80):
+        for bit in range(16):
+            if port + bit not in used:
+                board.addFan(FanModel(port + bit, maxRpm=900 + 40 * bit))
+
+
+def measure(board, poll, passes):
+    startUs = board.nowUs()
+    hostStart = time.perf_counter()
+    for _ in range(passes):
+        poll()
+    hostUs = (time.perf_counter() - hostStart) * 1e6
+    virtualS = (board.nowUs() - startUs) / 1e6
+    return passes / virtualS, hostUs / passes
+
+
+def run(passes=20000):
+    results = []
+    for label, rig in (('12 fans', None), ('32 fans', allPinsRig)):
+        simulation = Simulation(rig=rig)
+        board = simulation.board
+        indexes = [fan.idrIndex for fan in board.fans]
+        controller = simulation.controller
+        controller._initTachPins(indexes, simulation.firmware.TACH_ACQUISITION_POLLING)
+        legacy = LegacyPoll(simulation.firmware, indexes)
+        board.advance(2e6)                  # let the fans spin up
+        before = measure(board, legacy, passes)
+        after = measure(board, controller._pollTachPinsAndUpdatePulseCounters, passes)
+        results.append((label, before, after))
+    return results
+
+
+def fastFansRig(board, firmware):
+    board.addDefaultRig(firmware)
+    for i, fan in enumerate(board.fans):
+        fan.schedule = [(0, 2200 + 25 * i)]
+
+
+def runAcquisitionModes(seconds=30):
+    results = []
+    for label, mode in (('polling', 'TACH_ACQUISITION_POLLING'), ('ExtInt', 'TACH_ACQUISITION_EXTINT')):
+        def configure(firmware, mode=mode):
+            firmware.TACH_ACQUISITION_MODE = getattr(firmware, mode)
+        simulation = Simulation(rig=fastFansRig, configure=configure)
+        results.append((label, simulation.run(seconds)))
+    return results
+
+
+def main():
+    print('%-8s %22s %22s %8s' % ('', 'per-fan reads', 'port-parallel', 'speedup'))
+    for label, before, after in run():
+        print('%-8s %10.0f /s %6.1f us %10.0f /s %6.1f us %7.1fx' % (
+            label, before[0], before[1], after[0], after[1], after[0] / before[0]))
+    print()
+    print('%-8s %14s %14s %14s %14s' % ('', 'tach CPU', 'edges lost', 'spurious', 'I2C busy'))
+    for label, report in runAcquisitionModes():
+        print('%-8s %12.1f %% %12.2f %% %14d %12.2f s' % (
+            label, 100.0 * (report['pollCpuShare'] + report['isrCpuShare']),
+            100.0 * report['missedEdgeRate'], report['spuriousEdges'], report['i2cBusySeconds']))
+
+
+if __name__ == '__main__':
+    main()
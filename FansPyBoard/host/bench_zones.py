@@ -0,0 +1,70 @@
+#########################################################
+#                                                       #
+#                     bench_zones.py                    #
+#       Total fan RPM, shared duty against zones        #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.bench_zones
+#
+# Runs the controller on a rig whose three fan groups do not cool
+# equally: each fan adds weight * 12 * (1 - exp(-rpm / 1500)) W/K,
+# with the weights of ZONE_WEIGHTS in FanController.py (the top
+# radiator fans do the most, the pull fans of the bottom radiator the
+# least). Once
+# the water temperature has settled at the PID target, the total RPM
+# of the 12 fans is compared between equal zone weights, which gives
+# every channel the same duty like before the zones, and the
+# configured weights.
+
+import math
+
+from host.sim.harness import Simulation
+
+
+def zonedRig(weights, heatW):
+    # weights is filled by configure(), before the rig is built
+    def rig(board, firmware):
+        board.addDefaultRig(firmware, heatW=heatW)
+        model = board.analogSources[firmware.CPU_IN_WATER_TEMP_ADC_PIN.name()]
+        fanWeights = {}
+        for i, fan in enumerate(board.fans):
+            fanWeights[id(fan)] = weights[i // 4] / 100.0
+        model.fanConductance = lambda fan: fanWeights[id(fan)] * 12.0 * (1.0 - math.exp(-fan.rpm / 1500.0))
+        model.capacityJPerK = 2000.0
+        model.temperatureC = 35.0
+    return rig
+
+
+def run(seconds=240, heatW=400.0):
+    results = []
+    for label, shared in (('shared duty', True), ('zones', False)):
+        physicalWeights = []
+
+        def configure(firmware, shared=shared):
+            physicalWeights[:] = firmware.ZONE_WEIGHTS
+            if shared:
+                firmware.ZONE_WEIGHTS = (100, 100, 100)
+        simulation = Simulation(configure=configure, rig=zonedRig(physicalWeights, heatW))
+        simulation.run(seconds - 60)
+        samples = []
+        for _ in range(12):
+            report = simulation.run(5)
+            samples.append((report['waterTemperature'], sum(fan.rpm for fan in simulation.board.fans)))
+        temperature = sum(sample[0] for sample in samples) / len(samples)
+        totalRpm = sum(sample[1] for sample in samples) / len(samples)
+        zones = simulation.controller._zoneCoordinator.zones
+        results.append((label, temperature, totalRpm, [zone.duty for zone in zones]))
+    return results
+
+
+def main():
+    print('%-12s %10s %10s   %s' % ('', 'water', 'total RPM', 'duties top / bottom top / bottom bottom'))
+    for label, temperature, totalRpm, duties in run():
+        print('%-12s %8.2f C %10.0f   %s' % (label, temperature, totalRpm, ' / '.join('%d' % duty for duty in duties)))
+
+
+if __name__ == '__main__':
+    main()
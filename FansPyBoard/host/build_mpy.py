@@ -0,0 +1,98 @@
+#########################################################
+#                                                       #
+#                      build_mpy.py                     #
+#       Precompiled firmware modules for /flash         #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.build_mpy                     # mpy-cross on the PATH, or pip install mpy-cross
+#     python3 -m host.build_mpy --mpy-cross ~/micropython/mpy-cross/build/mpy-cross
+#
+# Compiles every firmware module but main.py, boot.py and Benchmark.py
+# (host/bench.py copies it when it runs) to .mpy in build/flash, the
+# native and viper functions for the Cortex-M4F of the STM32F411
+# (-march=armv7emsp), and copies main.py and boot.py
+# next to them, so only the few lines of main.py are compiled at
+# boot. Copy the directory to the board and remove the .py modules
+# that were there before, they would be imported first:
+#
+#     mpremote cp build/flash/* :
+#
+# mpy-cross must come from the MicroPython release the board runs,
+# the .mpy version is checked on import. For a firmware image with
+# the modules frozen in, see host/firmware/manifest.py.
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+
+FIRMWARE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_ONLY = ('main.py', 'boot.py')
+NOT_ON_BOARD = ('Benchmark.py',)        # host/bench.py copies it to the board when it runs
+MANIFEST = os.path.join(FIRMWARE_DIR, 'host', 'firmware', 'manifest.py')
+ARCHITECTURE = 'armv7emsp'
+
+
+def firmwareModules():
+    return sorted(os.path.basename(path) for path in glob.glob(os.path.join(FIRMWARE_DIR, '*.py'))
+                  if os.path.basename(path) not in SOURCE_ONLY + NOT_ON_BOARD)
+
+
+def manifestModules():
+    with open(MANIFEST) as source:
+        return sorted(re.findall(r'"(\w+\.py)"', source.read()))
+
+
+def findMpyCross(path):
+    if path:
+        return [path]
+    if shutil.which('mpy-cross'):
+        return ['mpy-cross']
+    try:
+        import mpy_cross            # noqa: F401, the pip package runs as a module
+        return [sys.executable, '-m', 'mpy_cross']
+    except ImportError:
+        return None
+
+
+def build(mpyCross, output):
+    os.makedirs(output, exist_ok=True)
+    sizes = []
+    for module in firmwareModules():
+        target = os.path.join(output, module[:-3] + '.mpy')
+        subprocess.run(mpyCross + ['-march=' + ARCHITECTURE, '-o', target, os.path.join(FIRMWARE_DIR, module)],
+                       check=True)
+        sizes.append((module, os.path.getsize(os.path.join(FIRMWARE_DIR, module)), os.path.getsize(target)))
+    for module in SOURCE_ONLY:
+        shutil.copy(os.path.join(FIRMWARE_DIR, module), output)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the firmware modules to .mpy files')
+    parser.add_argument('--mpy-cross', help='mpy-cross executable (default: on the PATH or the pip package)')
+    parser.add_argument('--output', default=os.path.join('build', 'flash'))
+    args = parser.parse_args()
+
+    missing = set(firmwareModules()) ^ set(manifestModules())
+    if missing:
+        print('host/firmware/manifest.py and the firmware modules differ: %s' % ', '.join(sorted(missing)))
+    mpyCross = findMpyCross(args.mpy_cross)
+    if mpyCross is None:
+        sys.exit('mpy-cross not found, build it from the MicroPython release of the board or pip install mpy-cross')
+    subprocess.run(mpyCross + ['--version'], check=True)
+    sizes = build(mpyCross, args.output)
+    for module, sourceSize, mpySize in sizes:
+        print('%-24s %6d -> %6d bytes' % (module, sourceSize, mpySize))
+    print('%s: copy to the board with  mpremote cp %s/* :' % (args.output, args.output))
+
+
+if __name__ == '__main__':
+    main()
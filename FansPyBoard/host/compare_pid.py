@@ -0,0 +1,198 @@
+#########################################################
+#                                                       #
+#                     compare_pid.py                    #
+#        FixedPID against the float PID on traces       #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.compare_pid
+#     python3 -m host.compare_pid --trace run1 --interval 30
+#
+# Replays water temperature traces through FixedPID and checks it
+# on every update, the exit status is 1 when a check fails:
+#
+#   - against a float model of its own law (ms time, integral stopped
+#     at the output bounds on both sides, derivative on the
+#     measurement, no filter), saturated and wound up updates
+#     included: each term within TERM_TOLERANCE and the output within
+#     OUTPUT_TOLERANCE percent of duty, one for a value floored on
+#     the other side of a whole percent
+#   - against PID, at whole second intervals only: PID only sees whole
+#     seconds, at sub second intervals its integral and derivative
+#     are wrong, which is what FixedPID is for. Updates where the PID
+#     integral has wound up past the output bounds, which FixedPID
+#     does not allow, are counted in the windup column and left out,
+#     the model covers them
+#
+# The traces are synthetic (step, ramp, spike, a cold start that
+# winds the integral down followed by a step past the top of the
+# range, with ADC noise) or a telemetry recording made with
+# host/recorder.py (timeMs and waterCentiDegrees columns). The
+# largest differences are printed in percent of duty.
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+from array import array
+
+from host import sim
+
+
+SET_VALUE = 35.0
+GAINS = (
+    ('board gains', 2.0, 0.02, 0.0),
+    ('with kD', 2.0, 0.02, 5.0),
+)
+TERM_TOLERANCE = 0.05           # % duty, FixedPID against its float model, Q16 rounding adds up over short periods
+OUTPUT_TOLERANCE = 1
+LEGACY_TERM_TOLERANCE = 0.01    # % duty, FixedPID against PID at whole second intervals
+OUTPUT_MIN = 0
+OUTPUT_MAX = 100
+MAX_ERROR = 10000               # hundredths
+MAX_DT_MS = 60000
+
+
+class ReferencePID:
+    # The FixedPID law in floats
+    def __init__(self, setValue, kP, kI, kD, nowMs):
+        self.setCentiValue = int(round(setValue * 100))
+        self.kP = kP
+        self.kI = kI
+        self.kD = kD
+        self.proportionalTerm = 0.0
+        self.integralTerm = 0.0
+        self.derivativeTerm = 0.0
+        self._lastMs = nowMs
+        self._lastSensedValue = None
+
+    def update(self, sensedCentiValue, nowMs):
+        dt = min(MAX_DT_MS, nowMs - self._lastMs)
+        self._lastMs = nowMs
+        error = max(-MAX_ERROR, min(MAX_ERROR, sensedCentiValue - self.setCentiValue))
+        self.proportionalTerm = self.kP * error / 100.0
+        if dt > 0:
+            self.integralTerm = max(OUTPUT_MIN - 50.0, min(OUTPUT_MAX - 50.0,
+                                                           self.integralTerm + self.kI * error * dt / 100000.0))
+            if self._lastSensedValue is not None:
+                change = max(-MAX_ERROR, min(MAX_ERROR, sensedCentiValue - self._lastSensedValue))
+                self.derivativeTerm = self.kD * change * 10.0 / dt
+        self._lastSensedValue = sensedCentiValue
+        total = 50.0 + self.proportionalTerm + self.integralTerm + self.derivativeTerm
+        return max(OUTPUT_MIN, min(OUTPUT_MAX, int(math.floor(total))))
+
+
+def syntheticTraces(seconds=1800, stepMs=100, seed=1):
+    noise = random.Random(seed)
+    traces = []
+    for name, shape in (
+            ('step 30 -> 40', lambda t: 3000 if t < 300 else 4000),
+            ('ramp 28 -> 45', lambda t: 2800 + int(1700 * min(1.0, t / seconds))),
+            ('spike', lambda t: 3300 + (900 if 600 <= t < 660 else 0)),
+            ('cold then hot', lambda t: 2500 if t < 900 else 6000)):
+        times = list(range(0, seconds * 1000, stepMs))
+        traces.append((name, times, [shape(t / 1000.0) + noise.randint(-2, 2) for t in times]))
+    return traces
+
+
+def recordedTrace(directory):
+    with open(os.path.join(directory, 'columns.json')) as index:
+        frames = json.load(index)['frames']
+    columns = {}
+    for name, typecode in (('timeMs', 'I'), ('waterCentiDegrees', 'h')):
+        column = array(typecode)
+        with open(os.path.join(directory, '%s.%s' % (name, typecode)), 'rb') as source:
+            column.fromfile(source, frames)
+        columns[name] = column
+    start = columns['timeMs'][0]
+    times = [(t - start) & 0x1fffffff for t in columns['timeMs']]
+    return [(directory, times, list(columns['waterCentiDegrees']))]
+
+
+# Largest differences (P, I, D, output) against the model and against PID, and the PID windup updates
+def compare(firmwarePID, trace, intervalMs, kP, kI, kD):
+    _, times, centiDegrees = trace
+    board = sim.install(sim.VirtualBoard())
+    import utime
+    floatPid = firmwarePID.PID(setValue=SET_VALUE, kP=kP, kI=kI, kD=kD)
+    fixedPid = firmwarePID.FixedPID(setValue=SET_VALUE, kP=kP, kI=kI, kD=kD, derivativeFilterMs=0,
+                                    outputMin=OUTPUT_MIN, outputMax=OUTPUT_MAX)
+    reference = ReferencePID(SET_VALUE, kP, kI, kD, utime.ticks_ms())
+    startUs = board.nowUs()
+    worst = [0.0, 0.0, 0.0, 0]
+    legacyWorst = [0.0, 0.0, 0.0, 0]
+    windupUpdates = 0
+    firstUpdate = True
+    nextUpdateMs = intervalMs
+    for timeMs, value in zip(times, centiDegrees):
+        if timeMs < nextUpdateMs:
+            continue
+        nextUpdateMs += intervalMs
+        board.advance(startUs + timeMs * 1000.0 - board.nowUs())
+        floatOutput = floatPid.update(value / 100.0)
+        fixedOutput = fixedPid.update(value)
+        referenceOutput = reference.update(value, utime.ticks_ms())
+        differences = (reference.proportionalTerm - fixedPid.proportionalTerm / 65536.0,
+                       reference.integralTerm - fixedPid.integralTerm / 65536.0,
+                       reference.derivativeTerm - fixedPid.derivativeTerm / 65536.0,
+                       referenceOutput - fixedOutput)
+        worst = [max(w, abs(d)) for w, d in zip(worst, differences)]
+        if not 0.0 <= 50.0 + floatPid.correctionIntegral <= 100.0:
+            # PID only bounds the integral below, FixedPID stops it at the output bounds on both sides
+            windupUpdates += 1
+            continue
+        if firstUpdate:
+            # PID takes the first error change from 0, FixedPID has no derivative until the second measurement
+            firstUpdate = False
+            continue
+        differences = (floatPid.correctionProportional - fixedPid.proportionalTerm / 65536.0,
+                       floatPid.correctionIntegral - fixedPid.integralTerm / 65536.0,
+                       floatPid.correctionDerivative - fixedPid.derivativeTerm / 65536.0,
+                       floatOutput - fixedOutput)
+        legacyWorst = [max(w, abs(d)) for w, d in zip(legacyWorst, differences)]
+    return worst, legacyWorst, windupUpdates
+
+
+def failed(worst, termTolerance):
+    return max(worst[:3]) > termTolerance or worst[3] > OUTPUT_TOLERANCE
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare FixedPID with the float PID on water temperature traces')
+    parser.add_argument('--trace', help='telemetry recording directory (default: synthetic traces)')
+    parser.add_argument('--interval', type=float, default=None, help='control interval in s (default: 30 and 0.5)')
+    args = parser.parse_args()
+
+    sim.install(sim.VirtualBoard())
+    import PID as firmwarePID
+    traces = recordedTrace(args.trace) if args.trace else syntheticTraces()
+    intervals = [args.interval] if args.interval else [30.0, 0.5]
+    failures = 0
+    for interval in intervals:
+        legacy = interval == int(interval)
+        print('every %.1f s, largest |model - FixedPID|%s in %% duty' % (interval, ' and |PID - FixedPID|' if legacy else ''))
+        print('%-16s %-12s %7s %7s %7s %6s %s' % ('trace', 'gains', 'P', 'I', 'D', 'output',
+                                                 '       P       I       D output  windup' if legacy else ''))
+        for trace in traces:
+            for label, kP, kI, kD in GAINS:
+                worst, legacyWorst, windupUpdates = compare(firmwarePID, trace, int(interval * 1000), kP, kI, kD)
+                fail = failed(worst, TERM_TOLERANCE) or (legacy and failed(legacyWorst, LEGACY_TERM_TOLERANCE))
+                failures += fail
+                line = '%-16s %-12s %7.4f %7.4f %7.4f %6d' % (trace[0][-16:], label, worst[0], worst[1], worst[2], worst[3])
+                if legacy:
+                    line += ' %7.4f %7.4f %7.4f %6d %7d' % (legacyWorst[0], legacyWorst[1], legacyWorst[2], legacyWorst[3],
+                                                            windupUpdates)
+                print(line + ('  FAIL' if fail else ''))
+        print()
+    print('P, I and D within %.2f %% of the model%s, output within %d %%: %s' % (
+        TERM_TOLERANCE, ' (%.2f %% of PID)' % LEGACY_TERM_TOLERANCE, OUTPUT_TOLERANCE,
+        '%d failed' % failures if failures else 'all passed'))
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+# Frozen modules of a PYBLITEV10 firmware with the fan controller
+# built in. From a MicroPython checkout of the release the board runs:
+#
+#     make -C mpy-cross
+#     make -C ports/stm32 submodules BOARD=PYBLITEV10
+#     make -C ports/stm32 BOARD=PYBLITEV10 FROZEN_MANIFEST=/path/to/FansPyBoard/host/firmware/manifest.py
+#
+# and flash ports/stm32/build-PYBLITEV10/firmware.dfu. Leave only
+# main.py and boot.py on /flash: a module file there is imported
+# before the frozen one. host/build_mpy.py checks that this list has
+# every firmware module; Benchmark.py is not one, host/bench.py copies
+# it to the board with mpremote when it runs.
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+freeze("../..", (
+    "AdcSweep.py",
+    "Checksum.py",
+    "FanController.py",
+    "FanCurve.py",
+    "FanHealth.py",
+    "HistoryLog.py",
+    "Instrumentation.py",
+    "LCM1602_I2C.py",
+    "LcdText.py",
+    "PID.py",
+    "PumpLink.py",
+    "Scheduler.py",
+    "TachPeriodEstimator.py",
+    "Telemetry.py",
+    "Thermistor.py",
+    "ThermistorTable.py",
+    "Zone.py",
+))
@@ -0,0 +1,112 @@
+#########################################################
+#                                                       #
+#                       history.py                      #
+#        History log file to CSV                        #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory, with a copy of the log from the board:
+#
+#     mpremote cp :history.bin .
+#     python3 -m host.history history.bin --minutes 480 --output night.csv
+#
+# Decodes the ring file written by HistoryLog.py (layout in its
+# header): the valid pages are put back in sequence order and the
+# records of the last minutes of log time written as CSV, oldest
+# first, temperatures in deg C and the PID integral in % of duty.
+# Pages with a bad checksum, torn by a reset, are counted and skipped.
+
+import argparse
+import csv
+import struct
+import sys
+
+
+MAGIC = 0x4c48
+VERSION = 1
+PAGE_HEADER = struct.Struct('<HBBIHH')
+
+
+def fletcher16(data):
+    sum1 = 0
+    sum2 = 0
+    for byte in data:
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+
+def recordFormat(numberOfFans):
+    return struct.Struct('<Ih%dH3BBiHH' % numberOfFans)
+
+
+def columnNames(numberOfFans):
+    return (['boot', 'seconds', 'water'] + ['rpm%d' % fan for fan in range(numberOfFans)]
+            + ['dutyTop', 'dutyBottomTop', 'dutyBottomBottom', 'pidOutput', 'pidIntegral',
+               'stoppedFans', 'slowFans'])
+
+
+def readPages(data, pageSize, numberOfFans):
+    # (sequence, boot number, records) of the valid pages, in sequence order, and the number of torn pages
+    record = recordFormat(numberOfFans)
+    pages = []
+    tornPages = 0
+    for start in range(0, len(data) - pageSize + 1, pageSize):
+        page = data[start:start + pageSize]
+        magic, version, count, sequence, recordSize, bootNumber = PAGE_HEADER.unpack_from(page)
+        if magic != MAGIC or version != VERSION or not count:
+            continue
+        if recordSize != record.size or struct.unpack_from('<H', page, pageSize - 2)[0] != fletcher16(page[:-2]):
+            tornPages += 1
+            continue
+        records = [record.unpack_from(page, PAGE_HEADER.size + i * record.size) for i in range(count)]
+        pages.append((sequence, bootNumber, records))
+    pages.sort()
+    return pages, tornPages
+
+
+def lastMinutes(pages, minutes):
+    if not pages:
+        return []
+    cutoff = pages[-1][2][-1][0] - 60 * minutes if minutes else -1
+    rows = []
+    for _, bootNumber, records in pages:
+        for record in records:
+            if record[0] >= cutoff:
+                rows.append((bootNumber,) + record)
+    return rows
+
+
+def formatRow(row, numberOfFans):
+    values = list(row)
+    values[2] = '%.2f' % (row[2] / 100.0)
+    integral = 3 + numberOfFans + 4
+    values[integral] = '%.3f' % (row[integral] / 65536.0)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode the FansPyBoard history log to CSV')
+    parser.add_argument('path', help='copy of the history log file')
+    parser.add_argument('--minutes', type=float, default=0, help='only the last minutes of log time (default all)')
+    parser.add_argument('--fans', type=int, default=12, help='number of fans (default 12)')
+    parser.add_argument('--page-size', type=int, default=1024)
+    parser.add_argument('--output', help='CSV file (default stdout)')
+    args = parser.parse_args()
+
+    with open(args.path, 'rb') as source:
+        data = source.read()
+    pages, tornPages = readPages(data, args.page_size, args.fans)
+    rows = lastMinutes(pages, args.minutes)
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    writer = csv.writer(output)
+    writer.writerow(columnNames(args.fans))
+    for row in rows:
+        writer.writerow(formatRow(row, args.fans))
+    if args.output:
+        output.close()
+    print('%d records from %d pages, %d torn pages skipped' % (len(rows), len(pages), tornPages), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#########################################################
+#                                                       #
+#                      recorder.py                      #
+#        Telemetry stream to columnar files             #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.recorder --port /dev/ttyACM0 --output run1      # needs pyserial
+#     python3 -m host.recorder --input capture.bin --output run1
+#
+# Decodes the frames sent by Telemetry.py (layout in its header) and
+# writes one raw little endian array file per column in the output
+# directory, e.g. run1/rpm3.H, plus run1/columns.json naming the
+# columns, their array typecode and the frame count, and listing the
+# sequence gaps (frames dropped by the board) and the bytes skipped
+# while looking for a frame (REPL text, truncated or corrupt frames).
+# Load a column with array.array(typecode).fromfile() or
+# numpy.fromfile(path, dtype).
+
+import argparse
+import json
+import os
+import struct
+import sys
+from array import array
+
+
+MAGIC = b'\xa5\x5a'
+VERSION = 2
+HEADER = struct.Struct('<HBBHIh')
+TRAILER = struct.Struct('<3B3iBB')
+Q16_PERCENT = 65536.0
+NUMPY_DTYPES = {'B': 'u1', 'H': '<u2', 'h': '<i2', 'I': '<u4', 'f': '<f4'}
+
+
+def frameSize(numberOfFans):
+    return HEADER.size + 2 * numberOfFans + TRAILER.size
+
+
+def columnTypes(numberOfFans):
+    return ([('sequence', 'H'), ('timeMs', 'I'), ('waterCentiDegrees', 'h')]
+            + [('rpm%d' % fan, 'H') for fan in range(numberOfFans)]
+            + [('dutyTop', 'B'), ('dutyBottomTop', 'B'), ('dutyBottomBottom', 'B'),
+               ('pidProportional', 'f'), ('pidIntegral', 'f'), ('pidDerivative', 'f'), ('pidOutput', 'B')])
+
+
+class FrameDecoder:
+    # feed() bytes as they arrive, get back the decoded frames as tuples in columnTypes() order
+    def __init__(self):
+        self._buffer = bytearray()
+        self.numberOfFans = None
+        self.frames = 0
+        self.skippedBytes = 0
+        self.badFrames = 0
+        self.lostFrames = 0
+        self.gaps = []              # (sequence expected, sequence received)
+        self._nextSequence = None
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        while True:
+            start = self._buffer.find(MAGIC)
+            if start < 0:
+                keep = 1 if self._buffer.endswith(MAGIC[:1]) else 0
+                self.skippedBytes += len(self._buffer) - keep
+                del self._buffer[:len(self._buffer) - keep]
+                return frames
+            if start:
+                self.skippedBytes += start
+                del self._buffer[:start]
+            if len(self._buffer) < HEADER.size:
+                return frames
+            _, version, numberOfFans, _, _, _ = HEADER.unpack_from(self._buffer)
+            size = frameSize(numberOfFans)
+            if version != VERSION or (self.numberOfFans is not None and numberOfFans != self.numberOfFans):
+                self._reject()
+                continue
+            if len(self._buffer) < size:
+                return frames
+            if sum(self._buffer[:size - 1]) & 0xff != self._buffer[size - 1]:
+                self._reject()
+                continue
+            self.numberOfFans = numberOfFans
+            frames.append(self._decode(numberOfFans))
+            del self._buffer[:size]
+
+    def _reject(self):
+        # not a frame after all, look for the next magic after this one
+        self.badFrames += 1
+        self.skippedBytes += 1
+        del self._buffer[:1]
+
+    def _decode(self, numberOfFans):
+        _, _, _, sequence, timeMs, centiDegrees = HEADER.unpack_from(self._buffer)
+        rpms = struct.unpack_from('<%dH' % numberOfFans, self._buffer, HEADER.size)
+        trailer = TRAILER.unpack_from(self._buffer, HEADER.size + 2 * numberOfFans)
+        if self._nextSequence is not None and sequence != self._nextSequence:
+            self.lostFrames += (sequence - self._nextSequence) & 0xffff
+            self.gaps.append((self._nextSequence, sequence))
+        self._nextSequence = (sequence + 1) & 0xffff
+        self.frames += 1
+        duties, terms, output = trailer[:3], trailer[3:6], trailer[6]
+        return (sequence, timeMs, centiDegrees) + rpms + duties + tuple(term / Q16_PERCENT for term in terms) + (output,)
+
+
+class ColumnWriter:
+    def __init__(self, directory, flushEvery=100):
+        self.directory = directory
+        self._flushEvery = flushEvery
+        self._columns = None
+        self._files = None
+        self.frames = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, frames, numberOfFans):
+        for frame in frames:
+            if self._columns is None:
+                self._open(numberOfFans)
+            for (_, column), value in zip(self._columns, frame):
+                column.append(value)
+            self.frames += 1
+        if self._columns is not None and len(self._columns[0][1]) >= self._flushEvery:
+            self._flush()
+
+    def _open(self, numberOfFans):
+        self._types = columnTypes(numberOfFans)
+        self._columns = [(name, array(typecode)) for name, typecode in self._types]
+        self._files = [open(os.path.join(self.directory, '%s.%s' % (name, typecode)), 'wb')
+                       for name, typecode in self._types]
+
+    def _flush(self):
+        for (_, column), output in zip(self._columns, self._files):
+            if sys.byteorder != 'little':
+                column.byteswap()
+            column.tofile(output)
+            del column[:]
+
+    def close(self, decoder):
+        if self._columns is not None:
+            self._flush()
+            for output in self._files:
+                output.close()
+        index = {
+            'frames': self.frames,
+            'numberOfFans': decoder.numberOfFans,
+            'columns': [{'name': name, 'typecode': typecode, 'dtype': NUMPY_DTYPES[typecode],
+                         'file': '%s.%s' % (name, typecode)} for name, typecode in (self._types if self._columns else [])],
+            'lostFrames': decoder.lostFrames,
+            'sequenceGaps': decoder.gaps,
+            'badFrames': decoder.badFrames,
+            'skippedBytes': decoder.skippedBytes,
+        }
+        with open(os.path.join(self.directory, 'columns.json'), 'w') as output:
+            json.dump(index, output, indent=1)
+        return index
+
+
+def record(chunks, directory):
+    decoder = FrameDecoder()
+    writer = ColumnWriter(directory)
+    try:
+        for chunk in chunks:
+            writer.write(decoder.feed(chunk), decoder.numberOfFans)
+    except KeyboardInterrupt:
+        pass
+    return writer.close(decoder)
+
+
+def serialChunks(port, baudrate=115200):
+    import serial                   # pyserial, only needed to record from a board
+    with serial.Serial(port, baudrate, timeout=0.1) as stream:
+        while True:
+            chunk = stream.read(4096)
+            if chunk:
+                yield chunk
+
+
+def fileChunks(path):
+    with open(path, 'rb') as stream:
+        while True:
+            chunk = stream.read(65536)
+            if not chunk:
+                return
+            yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record FansPyBoard telemetry frames to columnar files')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--port', help='USB VCP serial device, recording stops with Ctrl-C')
+    source.add_argument('--input', help='raw capture of the stream')
+    parser.add_argument('--output', required=True, help='directory for the column files')
+    args = parser.parse_args()
+
+    chunks = serialChunks(args.port) if args.port else fileChunks(args.input)
+    index = record(chunks, args.output)
+    print('%s: %d frames, %d lost, %d bad, %d bytes skipped' % (
+        args.output, index['frames'], index['lostFrames'], index['badFrames'], index['skippedBytes']))
+
+
+if __name__ == '__main__':
+    main()
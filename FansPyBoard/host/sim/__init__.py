@@ -0,0 +1,98 @@
+#########################################################
+#                                                       #
+#                  host.sim package                     #
+#     Runs the FansPyBoard firmware on a virtual board  #
+#                                                       #
+#########################################################
+
+# Usage, from the FansPyBoard directory:
+#
+#     from host import sim
+#     board = sim.install(sim.VirtualBoard(cpuScale=0))
+#     firmware = sim.loadFirmware()
+#     board.addDefaultRig(firmware)
+#     controller = firmware.Controller()
+#
+# install() puts the pyb/stm/utime/micropython stand-ins ahead of
+# anything else on sys.path and provides the names the MicroPython
+# compiler knows natively (const, the viper pointer casts), so the
+# firmware modules import unchanged.
+
+import sys
+
+import builtins
+
+from host.sim.board import VirtualBoard, SimulationEnd, current, setCurrent
+
+
+def _parent(path, levels):
+    parts = path.split('/')
+    return '/'.join(parts[:-levels]) or '.'
+
+
+_STUBS_DIR = _parent(__file__, 1) + '/stubs'
+_FIRMWARE_DIR = _parent(__file__, 3)
+
+
+class _Pointer:
+    # Emulates viper ptr8/ptr16/ptr32 on buffers and on register addresses
+    def __init__(self, target, typecode):
+        if isinstance(target, int):
+            self._view = None
+            self._address = target
+            self._size = {'B': 1, 'H': 2, 'I': 4}[typecode]
+        else:
+            self._view = memoryview(target).cast('B').cast(typecode)
+
+    def __getitem__(self, index):
+        if self._view is None:
+            return current().readRegister32(self._address + index * self._size)
+        return self._view[index]
+
+    def __setitem__(self, index, value):
+        if self._view is None:
+            raise NotImplementedError('register writes are not simulated')
+        self._view[index] = value & ((1 << (8 * self._view.itemsize)) - 1)
+
+
+def ptr8(target):
+    return _Pointer(target, 'B')
+
+
+def ptr16(target):
+    return _Pointer(target, 'H')
+
+
+def ptr32(target):
+    return _Pointer(target, 'I')
+
+
+def uint(value):
+    return value & 0xffffffff
+
+
+def install(board=None):
+    if board is None:
+        board = VirtualBoard()
+    setCurrent(board)
+    for path in (_FIRMWARE_DIR, _STUBS_DIR):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    if sys.implementation.name != 'micropython':
+        import micropython
+        builtins.micropython = micropython
+        builtins.const = micropython.const
+        builtins.ptr8 = ptr8
+        builtins.ptr16 = ptr16
+        builtins.ptr32 = ptr32
+        builtins.uint = uint
+    return board
+
+
+def loadFirmware(name='FanController'):
+    # A fresh import each time, so every simulation starts from the
+    # module level state (ISR flags) the board would boot with.
+    if name in sys.modules:
+        del sys.modules[name]
+    return __import__(name)
@@ -0,0 +1,465 @@
+#########################################################
+#                                                       #
+#                       board.py                        #
+#          Virtual PyBoard Lite for host simulation     #
+#                                                       #
+#########################################################
+
+# The virtual board owns the simulated time base and every
+# peripheral the firmware touches. Virtual time only moves
+# forward by the cost of what the firmware does: blocking
+# delays and bus transfers are charged in full but never slept,
+# each clock or register read is charged a fixed cost measured
+# on a PyBoard Lite (CALL_COSTS_US), and optionally the host time
+# spent interpreting in between is charged multiplied by
+# cpuScale. The default cpuScale=0 is fully deterministic and
+# runs far faster than real time.
+#
+# Timer callbacks and pin interrupts are dispatched whenever the
+# firmware reads the clock or a peripheral, which is as often as
+# the real main loop would be preempted for our purposes.
+
+import time
+
+from host.sim.devices import FanModel, ThermalModel, HD44780Backpack, PumpModel
+
+
+TIMER_SOURCE_HZ = 96000000      # PyBoard Lite: SYSCLK 96 MHz, all timers clocked at 96 MHz
+TICKS_PERIOD = 1 << 29          # MicroPython ticks wrap on stm32 (small int positive range >> 1)
+GPIO_PORT_NAMES = 'ABCDEFGH'
+GPIO_BASE = 0x40020000
+GPIO_PORT_STRIDE = 0x400
+GPIO_IDR = 0x10
+
+I2C_TRANSACTION_OVERHEAD_US = 15    # start/stop conditions plus the pyb.I2C call itself
+ADC_CONVERSION_US = 5
+# Cost of one call from native code, including the call overhead
+CALL_COSTS_US = {
+    'ticks': 4.0,           # utime.ticks_us() / pyb.millis()
+    'register': 6.0,        # asm_thumb or stm.mem32 register read, with the code around it
+    'isr': 12.0,            # interrupt entry and dispatch to a Python/viper handler
+}
+
+
+class SimulationEnd(Exception):
+    pass
+
+
+_current = None
+
+
+def current():
+    if _current is None:
+        raise RuntimeError('no virtual board installed, call host.sim.install() first')
+    return _current
+
+
+def setCurrent(board):
+    global _current
+    _current = board
+
+
+if hasattr(time, 'perf_counter_ns'):
+    def _hostNs():
+        return time.perf_counter_ns()
+else:                                   # unix MicroPython port
+    def _hostNs():
+        return time.ticks_us() * 1000
+
+
+class VirtualTimer:
+    def __init__(self, board, timerId):
+        self._board = board
+        self.id = timerId
+        self.periodUs = 0.0
+        self.deadlineUs = None
+        self.callback = None
+        self.fired = 0
+
+    def configure(self, freq=None, prescaler=None, period=None):
+        if freq is not None:
+            self.periodUs = 1e6 / freq
+        elif prescaler is not None and period is not None:
+            self.periodUs = 1e6 * (prescaler + 1) * (period + 1) / TIMER_SOURCE_HZ
+        self.deadlineUs = self._board.nowUs() + self.periodUs if self.periodUs else None
+        self._board.rescheduleEvents()
+
+    def setCallback(self, callback):
+        self.callback = callback
+        self._board.rescheduleEvents()
+
+    def fire(self, eventUs):
+        self.deadlineUs += self.periodUs
+        self.fired += 1
+        self._board._raise(self.callback, self, eventUs)
+
+
+EXTINT_RISING = 1
+EXTINT_FALLING = 2
+
+
+class ExtIntLine:
+    # One EXTI line. The event source is the tach edge of the fan
+    # wired to the pin, raised at the exact time of the edge.
+    def __init__(self, board, line, fan, mode, callback):
+        self._board = board
+        self.line = line
+        self.fan = fan
+        self.mode = mode
+        self.callback = callback
+        self.enabled = True
+        self.level = fan.level if fan is not None else 0
+
+    def nextEventUs(self):
+        if self.level != self.fan.level:        # the change was already seen by a register read
+            return self.fan._lastUs
+        return self.fan._nextCheckUs
+
+    def fire(self, eventUs):
+        level = self.fan.levelAt(eventUs, self._board)
+        if level != self.level:
+            self.level = level
+            if self.mode & (EXTINT_RISING if level else EXTINT_FALLING):
+                self._board._raise(self.callback, self.line, eventUs)
+
+
+class VirtualUsbVcp:
+    # USB CDC device side: writes go in a transmit buffer the host
+    # drains at bytesPerSecond while it is reading. Whatever the host
+    # has read is in received. Without a host, data is discarded.
+    def __init__(self, board, bufferSize=1024, bytesPerSecond=1000000.0):
+        self._board = board
+        self.bufferSize = bufferSize
+        self.bytesPerSecond = bytesPerSecond
+        self.connected = True
+        self.hostReading = True
+        self.received = bytearray()
+        self._pending = bytearray()
+        self._drainedUpToUs = 0.0
+
+    def _drain(self):
+        nowUs = self._board.nowUs()
+        if self.hostReading and self._pending:
+            count = int((nowUs - self._drainedUpToUs) * self.bytesPerSecond / 1e6)
+            if count > 0:
+                self.received += self._pending[:count]
+                del self._pending[:count]
+                self._drainedUpToUs = nowUs
+        if not self._pending or not self.hostReading:
+            self._drainedUpToUs = nowUs
+
+    def writable(self):
+        self._drain()
+        return not self.connected or len(self._pending) < self.bufferSize
+
+    def write(self, data):
+        self._board.advance(self._board.callCostsUs['register'])
+        if not self.connected:
+            return len(data)
+        self._drain()
+        count = min(len(data), self.bufferSize - len(self._pending))
+        self._pending += data[:count]
+        return count
+
+
+class VirtualUart:
+    # Receive side of a UART: what the device wired to RX has sent by
+    # now lands in a receive buffer of bufferSize bytes, as the UART
+    # interrupt puts it there. Bytes arriving with the buffer full are
+    # lost and counted in overruns, bytes sent at another baud rate
+    # are lost and counted in framingErrors.
+    def __init__(self, board, uartId):
+        self._board = board
+        self.uartId = uartId
+        self.baudrate = 9600
+        self.bufferSize = 64
+        self.device = None              # object with baudrate and transmitted(nowUs) -> bytes
+        self.overruns = 0
+        self.framingErrors = 0
+        self._buffer = bytearray()
+
+    def configure(self, baudrate, bufferSize):
+        self.baudrate = baudrate
+        self.bufferSize = bufferSize
+
+    def _receive(self):
+        if self.device is None:
+            return
+        data = self.device.transmitted(self._board.nowUs())
+        if not data:
+            return
+        if self.device.baudrate != self.baudrate:
+            self.framingErrors += len(data)
+            return
+        count = min(len(data), self.bufferSize - len(self._buffer))
+        self._buffer += data[:count]
+        self.overruns += len(data) - count
+
+    def any(self):
+        self._board.advance(self._board.callCostsUs['register'])
+        self._receive()
+        return len(self._buffer)
+
+    def readinto(self, buf, nbytes):
+        self._board.advance(self._board.callCostsUs['register'])
+        self._receive()
+        count = min(nbytes, len(buf), len(self._buffer))
+        buf[:count] = self._buffer[:count]
+        del self._buffer[:count]
+        return count
+
+
+class VirtualBoard:
+    def __init__(self, cpuScale=0.0, seed=1, callCostsUs=None):
+        self.cpuScale = cpuScale
+        self.callCostsUs = dict(CALL_COSTS_US if callCostsUs is None else callCostsUs)
+        self.seed = seed
+        self._chargedUs = 0.0
+        self._hostStartNs = _hostNs()
+        self._lastNowUs = 0.0
+        self._nextEventUs = None
+        self._dispatching = False
+        self.stopAtUs = None
+
+        self.timers = {}
+        self.pwmDuties = {}             # (timer, channel) -> duty in percent
+        self.fans = []
+        self._fansByPort = {}
+        self.analogSources = {}         # pin name -> object with adcCode(nowUs)
+        self.i2cDevices = {}            # (bus, address) -> device with write(data)
+        self.i2cBaudrates = {}
+        self.usbVcp = VirtualUsbVcp(self)
+        self.uarts = {}
+        self.pump = None
+        self.asmEmulations = {
+            'readGPIOB_IDR': lambda: self.readIdr('B'),
+            'readGPIOC_IDR': lambda: self.readIdr('C'),
+        }
+
+        self.extIntLines = {}
+        self.irqEnabled = True
+        self._pendingCallbacks = []
+        self._isrStartUs = 0.0
+        self._isrChargedUs = 0.0
+
+        self.stats = {
+            'i2cTransactions': 0,
+            'i2cBytes': 0,
+            'i2cBusyUs': 0.0,
+            'idrReads': 0,
+            'adcReads': 0,
+            'delayUs': 0.0,
+            'isrCalls': 0,
+            'isrUs': 0.0,
+        }
+
+    # ---------------------------------------------------------------- time
+
+    def nowUs(self):
+        if self._dispatching:
+            # inside an interrupt handler: time runs from the event that raised it
+            return self._isrStartUs + (self._chargedUs - self._isrChargedUs)
+        nowUs = self._chargedUs
+        if self.cpuScale:
+            nowUs += (_hostNs() - self._hostStartNs) * self.cpuScale / 1000.0
+            if nowUs < self._lastNowUs:
+                nowUs = self._lastNowUs
+            self._lastNowUs = nowUs
+        if self.stopAtUs is not None and nowUs >= self.stopAtUs:
+            raise SimulationEnd()
+        if self._nextEventUs is not None and nowUs >= self._nextEventUs:
+            self._dispatchEvents(nowUs)
+        return nowUs
+
+    def advance(self, us):
+        self._chargedUs += us
+        return self.nowUs()
+
+    def ticksUs(self):
+        return int(self.advance(self.callCostsUs['ticks'])) & (TICKS_PERIOD - 1)
+
+    def ticksMs(self):
+        return int(self.advance(self.callCostsUs['ticks']) / 1000) & (TICKS_PERIOD - 1)
+
+    def seconds(self):
+        return int(self.advance(self.callCostsUs['ticks']) / 1000000)
+
+    # -------------------------------------------------------------- events
+
+    def timer(self, timerId):
+        if timerId not in self.timers:
+            self.timers[timerId] = VirtualTimer(self, timerId)
+        return self.timers[timerId]
+
+    def uart(self, uartId):
+        if uartId not in self.uarts:
+            self.uarts[uartId] = VirtualUart(self, uartId)
+        return self.uarts[uartId]
+
+    def attachExtInt(self, pinName, mode, callback):
+        port, bit = pinName[0], int(pinName[1:])
+        if bit in self.extIntLines:
+            raise ValueError('ExtInt vector %d is already in use' % bit)
+        fans = [fan for fan in self.fans if fan.port == port and fan.bit == bit]
+        line = ExtIntLine(self, bit, fans[0] if fans else None, mode, callback)
+        self.extIntLines[bit] = line
+        self.rescheduleEvents()
+        return line
+
+    def _earliestEvent(self):
+        eventUs, source = None, None
+        for timer in self.timers.values():
+            if timer.callback is not None and timer.deadlineUs is not None:
+                if eventUs is None or timer.deadlineUs < eventUs:
+                    eventUs, source = timer.deadlineUs, timer
+        for line in self.extIntLines.values():
+            if line.enabled and line.fan is not None:
+                lineEventUs = line.nextEventUs()
+                if eventUs is None or lineEventUs < eventUs:
+                    eventUs, source = lineEventUs, line
+        return eventUs, source
+
+    def rescheduleEvents(self):
+        self._nextEventUs = self._earliestEvent()[0]
+
+    def _dispatchEvents(self, nowUs):
+        try:
+            while True:
+                eventUs, source = self._earliestEvent()
+                if source is None or eventUs > nowUs:
+                    break
+                source.fire(eventUs)
+        finally:
+            self.rescheduleEvents()
+
+    def _raise(self, callback, argument, eventUs):
+        if self.irqEnabled:
+            self._runIsr(callback, argument, eventUs)
+        elif (callback, argument) not in self._pendingCallbacks:      # pending flags do not queue up
+            self._pendingCallbacks.append((callback, argument))
+
+    def _runIsr(self, callback, argument, eventUs):
+        self._dispatching = True
+        self._isrStartUs = eventUs
+        self._isrChargedUs = self._chargedUs
+        try:
+            self._chargedUs += self.callCostsUs['isr']
+            callback(argument)
+        finally:
+            self.stats['isrCalls'] += 1
+            self.stats['isrUs'] += self._chargedUs - self._isrChargedUs
+            self._dispatching = False
+
+    def disableIrq(self):
+        state = self.irqEnabled
+        self.irqEnabled = False
+        return state
+
+    def enableIrq(self, state=True):
+        self.irqEnabled = state
+        if state and self._pendingCallbacks and not self._dispatching:
+            nowUs = self.nowUs()
+            pending = self._pendingCallbacks
+            self._pendingCallbacks = []
+            for callback, argument in pending:
+                self._runIsr(callback, argument, nowUs)
+
+    # ------------------------------------------------------------- devices
+
+    def delayUs(self, us):
+        self.stats['delayUs'] += us
+        self.advance(us)
+
+    def readIdr(self, port):
+        nowUs = self.advance(self.callCostsUs['register'])
+        self.stats['idrReads'] += 1
+        value = 0
+        for fan in self._fansByPort.get(port, ()):
+            level = fan.level if nowUs < fan._nextCheckUs else fan.levelAt(nowUs, self)
+            if level:
+                value |= 1 << fan.bit
+        return value
+
+    def readRegister32(self, address):
+        offset = address - GPIO_BASE
+        if 0 <= offset < GPIO_PORT_STRIDE * len(GPIO_PORT_NAMES) and offset % GPIO_PORT_STRIDE == GPIO_IDR:
+            return self.readIdr(GPIO_PORT_NAMES[offset // GPIO_PORT_STRIDE])
+        raise NotImplementedError('register 0x%08x is not simulated' % address)
+
+    def setPwmDuty(self, timerId, channel, percent):
+        self.pwmDuties[(timerId, channel)] = percent
+
+    def pwmDuty(self, timerId, channel):
+        return self.pwmDuties.get((timerId, channel), 0.0)
+
+    def readAdc(self, pinName, conversionUs=ADC_CONVERSION_US):
+        self.stats['adcReads'] += 1
+        nowUs = self.advance(conversionUs)
+        source = self.analogSources.get(pinName)
+        return source.adcCode(nowUs, self) if source is not None else 0
+
+    def i2cWrite(self, bus, address, data):
+        baudrate = self.i2cBaudrates.get(bus, 100000)
+        byteUs = 9 * 1e6 / baudrate
+        busyUs = I2C_TRANSACTION_OVERHEAD_US + (1 + len(data)) * byteUs
+        self.stats['i2cTransactions'] += 1
+        self.stats['i2cBytes'] += len(data)
+        self.stats['i2cBusyUs'] += busyUs
+        nowUs = self.advance(busyUs)
+        device = self.i2cDevices.get((bus, address))
+        if device is None:
+            raise OSError(5)            # EIO, nobody acknowledged the address
+        device.write(data, nowUs, byteUs)
+
+    def asmEmulation(self, name):
+        if name not in self.asmEmulations:
+            raise NotImplementedError('no host emulation for asm_thumb function ' + name)
+        return self.asmEmulations[name]
+
+    # ------------------------------------------------------------------ rig
+
+    def addFan(self, fan):
+        self.fans.append(fan)
+        self._fansByPort.setdefault(fan.port, []).append(fan)
+        return fan
+
+    def addDefaultRig(self, firmware, maxRpm=1500, heatW=250.0, ambientC=24.0):
+        # Mirrors the wiring declared in FanController.py: 4 fans per PWM channel,
+        # tach pins on GPIOB/GPIOC, the thermistor divider on X19 and the pump
+        # MCU on the RX of the pump link UART.
+        channels = (firmware.TOP_RAD_FANS_PWM_CHANNEL,
+                    firmware.BOTTOM_RAD_TOP_FANS_PWM_CHANNEL,
+                    firmware.BOTTOM_RAD_BOTTOM_FANS_PWM_CHANNEL)
+        indexes = (firmware.TOP_RAD_FAN1_TACH_PIN_IDR_INDEX, firmware.TOP_RAD_FAN2_TACH_PIN_IDR_INDEX,
+                   firmware.TOP_RAD_FAN3_TACH_PIN_IDR_INDEX, firmware.TOP_RAD_FAN4_TACH_PIN_IDR_INDEX,
+                   firmware.BOTTOM_RAD_TOP_FAN1_TACH_PIN_IDR_INDEX, firmware.BOTTOM_RAD_TOP_FAN2_TACH_PIN_IDR_INDEX,
+                   firmware.BOTTOM_RAD_TOP_FAN3_TACH_PIN_IDR_INDEX, firmware.BOTTOM_RAD_TOP_FAN4_TACH_PIN_IDR_INDEX,
+                   firmware.BOTOM_RAD_BOTTOM_FAN1_TACH_PIN_IDR_INDEX, firmware.BOTOM_RAD_BOTTOM_FAN2_TACH_PIN_IDR_INDEX,
+                   firmware.BOTOM_RAD_BOTTOM_FAN3_TACH_PIN_IDR_INDEX, firmware.BOTOM_RAD_BOTTOM_FAN4_TACH_PIN_IDR_INDEX)
+        for i, idrIndex in enumerate(indexes):
+            # a few percent of spread between fans, like real ones
+            ratio = 1.0 - 0.01 * ((i * 7 + self.seed) % 5)
+            self.addFan(FanModel(idrIndex, (firmware.FANS_PWM_TIMER, channels[i // 4]), maxRpm=maxRpm * ratio))
+        self.analogSources[firmware.CPU_IN_WATER_TEMP_ADC_PIN.name()] = ThermalModel(
+            dividerResistance=firmware.TEMPERATURE_SENSOR_DIVIDER_RESISTANCE,
+            heatW=heatW, ambientC=ambientC, seed=self.seed)
+        # the other temperature sensors read the same coolant
+        for sensor in firmware.TEMPERATURE_SENSORS:
+            self.analogSources.setdefault(sensor[1].name(), self.analogSources[firmware.CPU_IN_WATER_TEMP_ADC_PIN.name()])
+        self.i2cDevices[(firmware.LCD_I2C_PORT, 0x27)] = HD44780Backpack()
+        self.pump = PumpModel(baudrate=firmware.PUMP_LINK_BAUDRATE)
+        self.uart(firmware.PUMP_LINK_UART).device = self.pump
+
+    def lcd(self):
+        for device in self.i2cDevices.values():
+            if isinstance(device, HD44780Backpack):
+                return device
+        return None
+
+    def trueRisingEdges(self):
+        nowUs = self.nowUs()
+        counts = []
+        for fan in self.fans:
+            fan.refresh(nowUs, self)
+            counts.append(fan.risingEdges)
+        return counts
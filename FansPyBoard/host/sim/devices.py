@@ -0,0 +1,300 @@
+#########################################################
+#                                                       #
+#                      devices.py                       #
+#   Fan tach, thermal, pump and LCD models for the sim  #
+#                                                       #
+#########################################################
+
+import math
+import struct
+
+
+TACH_PULSES_PER_REVOLUTION = 2
+REFRESH_US = 10000.0                # fan speed is re-evaluated at least this often
+
+
+class FanModel:
+    # A 4-pin PWM fan. Its speed follows the duty of its PWM channel
+    # with a first order spin-up lag, unless a schedule of
+    # (seconds, rpm) steps is given. The speed is proportional to the
+    # duty, or linear from minRpm at minDuty to maxRpm when minRpm is
+    # given, like most 4-pin fans. The open collector tach output
+    # is a 50 % square wave with 2 pulses per revolution; the phase is
+    # integrated lazily each time the pin is sampled.
+    def __init__(self, idrIndex, pwmKey=None, maxRpm=1500.0, minDuty=20.0, lagS=1.0, schedule=None, minRpm=None):
+        self.port = 'C' if idrIndex & 0x80 else 'B'
+        self.bit = idrIndex & 0x0f
+        self.idrIndex = idrIndex
+        self.pwmKey = pwmKey
+        self.maxRpm = maxRpm
+        self.minDuty = minDuty
+        self.minRpm = minRpm
+        self.lagS = lagS
+        self.schedule = schedule
+        self.failed = False
+        self.rpm = 0.0
+        self.phase = 0.0               # in tach periods
+        self.risingEdges = 0
+        self.level = 1
+        self._lastUs = None
+        self._nextCheckUs = 0.0
+
+    def targetRpm(self, nowUs, board):
+        if self.failed:
+            return 0.0
+        if self.schedule is not None:
+            rpm = 0.0
+            for atS, stepRpm in self.schedule:
+                if nowUs >= atS * 1e6:
+                    rpm = stepRpm
+            return rpm
+        duty = max(self.minDuty, min(100.0, board.pwmDuty(*self.pwmKey) if self.pwmKey is not None else 100.0))
+        if self.minRpm is not None:
+            return self.minRpm + (self.maxRpm - self.minRpm) * (duty - self.minDuty) / (100.0 - self.minDuty)
+        return self.maxRpm * duty / 100.0
+
+    def levelAt(self, nowUs, board):
+        # The level is only recomputed when the next half period is due,
+        # so sampling the pin thousands of times per edge stays cheap.
+        if nowUs < self._nextCheckUs:
+            return self.level
+        if self._lastUs is None:
+            self._lastUs = nowUs
+            self.rpm = self.targetRpm(nowUs, board) if self.schedule is not None else 0.0
+        dtUs = nowUs - self._lastUs
+        if dtUs > 0:
+            self.phase += self.rpm * TACH_PULSES_PER_REVOLUTION * dtUs / 60e6
+            target = self.targetRpm(nowUs, board)
+            if self.schedule is not None or self.lagS <= 0:
+                self.rpm = target
+            else:
+                self.rpm += (target - self.rpm) * (1.0 - math.exp(-dtUs / (self.lagS * 1e6)))
+            self._lastUs = nowUs
+            self.risingEdges = int(self.phase)
+        fraction = self.phase - int(self.phase)
+        self.level = 1 if fraction < 0.5 else 0
+        untilToggleUs = REFRESH_US
+        if self.rpm > 0:
+            pulsesPerUs = self.rpm * TACH_PULSES_PER_REVOLUTION / 60e6
+            untilToggleUs = min(REFRESH_US, ((0.5 if fraction < 0.5 else 1.0) - fraction) / pulsesPerUs + 0.01)
+        self._nextCheckUs = nowUs + untilToggleUs
+        return self.level
+
+    def refresh(self, nowUs, board):
+        self._nextCheckUs = 0.0
+        return self.levelAt(nowUs, board)
+
+
+def thermistorTemperature(resistance):
+    # The rational fit used by FanController.py, so the simulated sensor reads
+    # back exactly the temperature the thermal model holds.
+    return 0.2 + (-.0019 * resistance * resistance + 38.14 * resistance + 43870) / (resistance - 827)
+
+
+def thermistorResistance(temperature):
+    low, high = 1000.0, 200000.0     # fit is monotonic decreasing over this range
+    for _ in range(48):
+        middle = 0.5 * (low + high)
+        if thermistorTemperature(middle) > temperature:
+            low = middle
+        else:
+            high = middle
+    return 0.5 * (low + high)
+
+
+class ThermalModel:
+    # Lumped coolant loop: a heat source, radiators whose conductance
+    # grows with the total fan speed, and an NTC in a divider whose
+    # lower leg is dividerResistance. adcCode() integrates the model up
+    # to now and returns a 12-bit reading with a little noise.
+    # fanConductance(fan), when given, replaces the linear total RPM
+    # term with a per fan contribution in W/K. With a pump on the
+    # board, the conductance is scaled by its flowFactor().
+    def __init__(self, dividerResistance=2200, heatW=250.0, ambientC=24.0, temperatureC=None,
+                 capacityJPerK=8000.0, baseConductance=4.0, conductancePerKRpm=1.5,
+                 noiseLsb=2, seed=1, fanConductance=None):
+        self.dividerResistance = dividerResistance
+        self.heatW = heatW
+        self.ambientC = ambientC
+        self.temperatureC = ambientC + 1.0 if temperatureC is None else temperatureC
+        self.capacityJPerK = capacityJPerK
+        self.baseConductance = baseConductance
+        self.conductancePerKRpm = conductancePerKRpm
+        self.noiseLsb = noiseLsb
+        self.fanConductance = fanConductance
+        self._random = seed & 0x7fffffff or 1
+        self._lastUs = None
+
+    def _noise(self):
+        self._random = (self._random * 1103515245 + 12345) & 0x7fffffff
+        return (self._random >> 16) % (2 * self.noiseLsb + 1) - self.noiseLsb if self.noiseLsb else 0
+
+    def heatAt(self, nowUs):
+        if callable(self.heatW):
+            return self.heatW(nowUs / 1e6)
+        return self.heatW
+
+    def step(self, nowUs, board):
+        if self._lastUs is None:
+            self._lastUs = nowUs
+        dtS = (nowUs - self._lastUs) / 1e6
+        if dtS > 0:
+            if self.fanConductance is None:
+                totalRpm = 0.0
+                for fan in board.fans:
+                    totalRpm += fan.rpm
+                conductance = self.baseConductance + self.conductancePerKRpm * totalRpm / 1000.0
+            else:
+                conductance = self.baseConductance
+                for fan in board.fans:
+                    conductance += self.fanConductance(fan)
+            if board.pump is not None:
+                conductance *= board.pump.flowFactor()
+            # exact solution of C dT/dt = P - G (T - Tamb) over dt
+            equilibrium = self.ambientC + self.heatAt(nowUs) / conductance
+            self.temperatureC = equilibrium + (self.temperatureC - equilibrium) * math.exp(-dtS * conductance / self.capacityJPerK)
+            self._lastUs = nowUs
+        return self.temperatureC
+
+    def adcCode(self, nowUs, board):
+        resistance = thermistorResistance(self.step(nowUs, board))
+        code = int(4095.0 * self.dividerResistance / (resistance + self.dividerResistance) + 0.5) + self._noise()
+        return max(0, min(4095, code))
+
+
+PUMP_LINK_MAGIC = 0x7ea5
+PUMP_LINK_VERSION = 1
+PUMP_LOW_RPM = 0x01
+PUMP_STOPPED = 0x02
+PUMP_ALERTING = 0x04
+
+
+def fletcher16(data):
+    sum1 = 0
+    sum2 = 0
+    for byte in data:
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+
+class PumpModel:
+    # The pump MCU of PumpProTrinket/PumpMonitor2.ino with its pump: a
+    # frame of the PumpLink.py layout every periodMs with the pump RPM
+    # and faults, sent on the line at baudrate, 10 bits a byte.
+    # transmitted(nowUs) returns the bytes whose stop bit has ended
+    # since the last call. rpm can be changed while running, 0 stops
+    # the pump; unplugged stops the frames. The flow, and with it the
+    # heat the water takes to the radiators, goes down with the pump
+    # speed: flowFactor() is the square root of the speed ratio, at
+    # least 0.1 for what the stopped loop still carries.
+    def __init__(self, rpm=3000.0, nominalRpm=3000.0, lowRpm=1500.0, duty=62, periodMs=1000, baudrate=9600):
+        self.rpm = rpm
+        self.nominalRpm = nominalRpm
+        self.lowRpm = lowRpm
+        self.duty = duty
+        self.periodMs = periodMs
+        self.baudrate = baudrate
+        self.unplugged = False
+        self.framesSent = 0
+        self._sequence = 0
+        self._nextFrameUs = 0.0
+        self._line = []                 # (end of stop bit us, byte) not received yet
+
+    def frame(self):
+        rpm = int(round(self.rpm))
+        faults = 0
+        if rpm < self.lowRpm:
+            faults |= PUMP_LOW_RPM | PUMP_ALERTING
+        if rpm == 0:
+            faults |= PUMP_STOPPED
+        frame = struct.pack('<HBBHBB', PUMP_LINK_MAGIC, PUMP_LINK_VERSION, self._sequence & 0xff, min(rpm, 0xffff),
+                            faults, self.duty)
+        return frame + struct.pack('<H', fletcher16(frame))
+
+    def transmitted(self, nowUs):
+        byteUs = 10e6 / self.baudrate
+        while self._nextFrameUs <= nowUs:
+            if not self.unplugged:
+                for i, byte in enumerate(self.frame()):
+                    self._line.append((self._nextFrameUs + (i + 1) * byteUs, byte))
+                self._sequence += 1
+                self.framesSent += 1
+            self._nextFrameUs += self.periodMs * 1000.0
+        count = 0
+        while count < len(self._line) and self._line[count][0] <= nowUs:
+            count += 1
+        data = bytes(byte for _, byte in self._line[:count])
+        del self._line[:count]
+        return data
+
+    def flowFactor(self):
+        return max(0.1, min(1.0, self.rpm / self.nominalRpm) ** 0.5)
+
+
+LCD_EN = 0x04
+LCD_RS = 0x01
+LCD_BACKLIGHT = 0x08
+LCD_CLEAR_EXEC_US = 1520
+LCD_COMMAND_EXEC_US = 37
+
+
+class HD44780Backpack:
+    # HD44780 behind a PCF8574 backpack wired like LCM1602_I2C expects:
+    # P0 RS, P1 RW, P2 EN, P3 backlight, P4-P7 D4-D7, already in 4-bit
+    # mode. Data is latched on the falling edge of EN. Writes arriving
+    # while the controller is still executing the previous instruction
+    # are counted in timingViolations.
+    def __init__(self, cols=16, rows=2):
+        self.cols = cols
+        self.rows = rows
+        self.ddram = bytearray(b' ' * 0x68)
+        self.address = 0
+        self.backlight = False
+        self.timingViolations = 0
+        self.commands = 0
+        self.characters = 0
+        self._port = 0
+        self._highNibble = None
+        self._busyUntilUs = 0.0
+
+    def write(self, data, nowUs, byteUs=0.0):
+        # nowUs is the end of the transaction, each byte reaches the port byteUs after the previous one
+        for i, byte in enumerate(data):
+            if (self._port & LCD_EN) and not (byte & LCD_EN):
+                self._latch(self._port, nowUs - (len(data) - 1 - i) * byteUs)
+            self._port = byte
+            self.backlight = bool(byte & LCD_BACKLIGHT)
+
+    def _latch(self, port, nowUs):
+        nibble = port >> 4
+        if self._highNibble is None:
+            self._highNibble = nibble
+            return
+        value = (self._highNibble << 4) | nibble
+        self._highNibble = None
+        if nowUs < self._busyUntilUs:
+            self.timingViolations += 1
+        if port & LCD_RS:
+            self.characters += 1
+            self.ddram[self.address] = value
+            self.address = (self.address + 1) % len(self.ddram)
+            self._busyUntilUs = nowUs + LCD_COMMAND_EXEC_US
+            return
+        self.commands += 1
+        if value == 0x01:
+            for i in range(len(self.ddram)):
+                self.ddram[i] = 0x20
+            self.address = 0
+            self._busyUntilUs = nowUs + LCD_CLEAR_EXEC_US
+        elif value == 0x02:
+            self.address = 0
+            self._busyUntilUs = nowUs + LCD_CLEAR_EXEC_US
+        else:
+            if value & 0x80:
+                self.address = (value & 0x7f) % len(self.ddram)
+            self._busyUntilUs = nowUs + LCD_COMMAND_EXEC_US
+
+    def lines(self):
+        offsets = (0x00, 0x40, 0x14, 0x54)
+        return [bytes(self.ddram[offsets[row]:offsets[row] + self.cols]).decode('latin-1') for row in range(self.rows)]
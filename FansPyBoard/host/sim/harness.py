@@ -0,0 +1,146 @@
+#########################################################
+#                                                       #
+#                      harness.py                       #
+#     Boots the real Controller on a virtual board      #
+#                                                       #
+#########################################################
+
+import os
+import tempfile
+import time
+
+from host import sim
+
+
+class Simulation:
+    # Builds a virtual board wired like FanController.py, imports the firmware,
+    # constructs the real Controller and runs its mainLoop() for a
+    # given amount of virtual time. The controller is observed through
+    # instance level wrappers only, its code runs unchanged. The files
+    # the firmware keeps in flash, named by its *_FILE constants, are
+    # put in flashDir, a new temporary directory unless one is given
+    # to boot again on the files of a previous simulation.
+    def __init__(self, cpuScale=0.0, seed=1, maxRpm=1500, heatW=250.0, ambientC=24.0, rig=None, configure=None,
+                 flashDir=None):
+        self.board = sim.install(sim.VirtualBoard(cpuScale=cpuScale, seed=seed))
+        self.firmware = sim.loadFirmware()
+        if configure is not None:
+            configure(self.firmware)                # e.g. change module constants before the controller is built
+        self.flashDir = flashDir if flashDir is not None else tempfile.mkdtemp(prefix='fanspyboard-flash-')
+        os.makedirs(self.flashDir, exist_ok=True)
+        for name in dir(self.firmware):
+            value = getattr(self.firmware, name)
+            if name.endswith('_FILE') and isinstance(value, str):
+                setattr(self.firmware, name, os.path.join(self.flashDir, os.path.basename(value)))
+        if rig is None:
+            self.board.addDefaultRig(self.firmware, maxRpm=maxRpm, heatW=heatW, ambientC=ambientC)
+        else:
+            rig(self.board, self.firmware)
+        self.controller = self.firmware.Controller()
+        self.pollPasses = 0
+        self.pollUs = 0.0
+        self.loopSeconds = 0.0
+        self.hostSeconds = 0.0
+        # Each rising edge the controller counts is matched to the last true rising edge of its fan; a count with
+        # no new true edge since the previous one is spurious (the first level seen at boot, a bounce)
+        self._lastMatchedEdges = [0] * len(self.board.fans)
+        self._matchedEdges = [0] * len(self.board.fans)         # true edges after the start of the first run
+        self._spuriousEdges = 0
+        self._trueEdgesAtStart = None
+        self._stopAtUs = float('inf')        # the poll only ends the main loop inside run()
+        self._observe()
+
+    def _observe(self):
+        controller = self.controller
+        poll = controller._pollTachPinsAndUpdatePulseCounters
+        estimator = controller._tachPeriodEstimator
+        risingEdge = estimator.risingEdge
+
+        def countedPoll():
+            self.pollPasses += 1
+            startUs = self.board.nowUs()
+            poll()
+            endUs = self.board.nowUs()
+            self.pollUs += endUs - startUs
+            if endUs >= self._stopAtUs:
+                raise sim.SimulationEnd()       # between two passes of the main loop, no task is cut short
+
+        # the poll and tachEdgeISR both hand every counted rising edge to the period estimator
+        def matchedRisingEdge(fan, nowTimeStamp):
+            self._matchEdge(fan)
+            risingEdge(fan, nowTimeStamp)
+
+        controller._pollTachPinsAndUpdatePulseCounters = countedPoll
+        estimator.risingEdge = matchedRisingEdge
+
+    def _matchEdge(self, fan):
+        model = self.board.fans[fan]
+        model.refresh(self.board.nowUs(), self.board)
+        edge = model.risingEdges
+        if edge <= self._lastMatchedEdges[fan]:
+            self._spuriousEdges += 1
+            return
+        self._lastMatchedEdges[fan] = edge
+        if self._trueEdgesAtStart is not None and edge > self._trueEdgesAtStart[fan]:
+            self._matchedEdges[fan] += 1
+
+    def run(self, seconds):
+        board = self.board
+        startUs = board.nowUs()
+        if self._trueEdgesAtStart is None:
+            self._trueEdgesAtStart = board.trueRisingEdges()
+            self._spuriousEdges = 0
+        self._stopAtUs = startUs + seconds * 1e6
+        hostStart = time.time()
+        try:
+            self.controller.mainLoop()
+        except sim.SimulationEnd:
+            pass
+        finally:
+            self._stopAtUs = float('inf')
+        self.hostSeconds += time.time() - hostStart
+        self.loopSeconds += (board.nowUs() - startUs) / 1e6
+        return self.report()
+
+    def report(self):
+        board = self.board
+        trueEdges = board.trueRisingEdges()
+        expected = 0
+        counted = 0
+        for i in range(len(board.fans)):
+            # the same window for both: the last true edge may not have been polled yet, it is left out
+            expected += max(0, trueEdges[i] - 1 - self._trueEdgesAtStart[i])
+            counted += self._matchedEdges[i] - (1 if self._lastMatchedEdges[i] == trueEdges[i] else 0)
+        lcd = board.lcd()
+        return {
+            'virtualSeconds': self.loopSeconds,
+            'hostSeconds': self.hostSeconds,
+            'speedup': self.loopSeconds / self.hostSeconds if self.hostSeconds else 0.0,
+            'pollPassesPerSecond': self.pollPasses / self.loopSeconds if self.loopSeconds else 0.0,
+            'expectedEdges': expected,
+            'countedEdges': counted,
+            'missedEdgeRate': (expected - counted) / expected if expected else 0.0,
+            'spuriousEdges': self._spuriousEdges,
+            'pollCpuShare': self.pollUs / 1e6 / self.loopSeconds if self.loopSeconds else 0.0,
+            'isrCpuShare': board.stats['isrUs'] / 1e6 / self.loopSeconds if self.loopSeconds else 0.0,
+            'i2cTransactions': board.stats['i2cTransactions'],
+            'i2cBusySeconds': board.stats['i2cBusyUs'] / 1e6,
+            'waterTemperature': self.controller._cpuInWaterCentiDegrees / 100.0,
+            'controlValue': self.controller._controlValue,
+            'fanRpms': list(self.controller._radFansRPMs),
+            'lcd': lcd.lines() if lcd is not None else [],
+            'tasks': self._taskStatistics(),
+            'boot': [(name, self.controller.bootTimesMs[step]) for step, name in enumerate(self.firmware.BOOT_STEPS)],
+        }
+
+    def _taskStatistics(self):
+        # (name, runs, overruns, worst lateness ms, worst run time us) per scheduler task
+        controller = self.controller
+        scheduler = controller._scheduler
+        names = {}
+        for name in dir(controller):
+            if name.endswith('TaskId'):
+                names[getattr(controller, name)] = name[1:-len('TaskId')]
+        return [(names.get(task, 'task%d' % task), scheduler.runs[task], scheduler.overruns[task],
+                 scheduler.maxLatenessMs[task], scheduler.maxRunUs[task])
+                for task in range(scheduler._numberOfTasks)]
@@ -0,0 +1,42 @@
+# Host stand-in for the micropython module under CPython. The code
+# emitters become no-ops; asm_thumb functions are replaced by the
+# emulation the virtual board registers under the same name.
+
+from host.sim import board as _board
+
+
+def const(value):
+    return value
+
+
+def native(function):
+    return function
+
+
+def viper(function):
+    return function
+
+
+def asm_thumb(function):
+    name = function.__name__
+
+    def emulated(*args):
+        return _board.current().asmEmulation(name)(*args)
+    emulated.__name__ = name
+    return emulated
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def schedule(function, argument):
+    function(argument)
+
+
+def opt_level(level=None):
+    return 0
+
+
+def mem_info(verbose=False):
+    print('mem: not available on the host simulator')
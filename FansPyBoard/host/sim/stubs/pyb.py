@@ -0,0 +1,231 @@
+# Host stand-in for the pyb module, backed by the virtual board.
+# Only the parts of the API the firmware uses are implemented.
+
+from host.sim import board as _board
+
+
+def millis():
+    return _board.current().ticksMs()
+
+
+def micros():
+    return _board.current().ticksUs()
+
+
+def elapsed_millis(start):
+    return (millis() - start) & (_board.TICKS_PERIOD - 1)
+
+
+def elapsed_micros(start):
+    return (micros() - start) & (_board.TICKS_PERIOD - 1)
+
+
+def delay(ms):
+    _board.current().delayUs(ms * 1000)
+
+
+def udelay(us):
+    _board.current().delayUs(us)
+
+
+def disable_irq():
+    return _board.current().disableIrq()
+
+
+def enable_irq(state=True):
+    _board.current().enableIrq(state)
+
+
+def freq():
+    return (_board.TIMER_SOURCE_HZ, _board.TIMER_SOURCE_HZ, _board.TIMER_SOURCE_HZ // 2, _board.TIMER_SOURCE_HZ)
+
+
+class _PinNamespace:
+    def __getattr__(self, name):
+        return Pin(name)
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OUT_PP = 1
+    OUT_OD = 17
+    AF_PP = 2
+    AF7_USART1 = 7
+    ANALOG = 3
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 0x10110000
+    IRQ_FALLING = 0x10210000
+
+    board = _PinNamespace()
+    cpu = _PinNamespace()
+
+    def __init__(self, name, mode=None, pull=None, **kwargs):
+        self._name = name if isinstance(name, str) else name.name()
+
+    def name(self):
+        return self._name
+
+    def __repr__(self):
+        return 'Pin(Pin.board.%s)' % self._name
+
+
+class ExtInt:
+    IRQ_RISING = _board.EXTINT_RISING
+    IRQ_FALLING = _board.EXTINT_FALLING
+    IRQ_RISING_FALLING = _board.EXTINT_RISING | _board.EXTINT_FALLING
+    EVT_RISING = IRQ_RISING
+    EVT_FALLING = IRQ_FALLING
+    EVT_RISING_FALLING = IRQ_RISING_FALLING
+
+    def __init__(self, pin, mode, pull, callback):
+        name = pin.name() if isinstance(pin, Pin) else str(pin)
+        self._line = _board.current().attachExtInt(name, mode, callback)
+
+    def line(self):
+        return self._line.line
+
+    def enable(self):
+        self._line.enabled = True
+        _board.current().rescheduleEvents()
+
+    def disable(self):
+        self._line.enabled = False
+        _board.current().rescheduleEvents()
+
+    def swint(self):
+        board = _board.current()
+        board._raise(self._line.callback, self._line.line, board.nowUs())
+
+
+class TimerChannel:
+    def __init__(self, timer, channel, mode, pin):
+        self._timer = timer
+        self._channel = channel
+        self._percent = 0.0
+
+    def pulse_width_percent(self, value=None):
+        if value is None:
+            return self._percent
+        self._percent = value
+        _board.current().setPwmDuty(self._timer._id, self._channel, value)
+
+
+class Timer:
+    UP = 0
+    PWM = 0
+    PWM_INVERTED = 1
+    IC = 8
+
+    def __init__(self, id, freq=None, prescaler=None, period=None, **kwargs):
+        self._id = id
+        self._virtual = _board.current().timer(id)
+        self._channels = {}
+        if freq is not None or prescaler is not None:
+            self.init(freq=freq, prescaler=prescaler, period=period)
+
+    def init(self, freq=None, prescaler=None, period=None, **kwargs):
+        self._virtual.configure(freq=freq, prescaler=prescaler, period=period)
+
+    def deinit(self):
+        self._virtual.setCallback(None)
+
+    def callback(self, fun):
+        self._virtual.setCallback(fun)
+
+    def channel(self, channel, mode=None, pin=None, **kwargs):
+        if mode is None:
+            return self._channels.get(channel)
+        timerChannel = TimerChannel(self, channel, mode, pin)
+        self._channels[channel] = timerChannel
+        return timerChannel
+
+    def freq(self):
+        return 1e6 / self._virtual.periodUs if self._virtual.periodUs else 0
+
+
+class ADC:
+    def __init__(self, pin):
+        self._pinName = pin.name() if isinstance(pin, Pin) else str(pin)
+
+    def read(self):
+        return _board.current().readAdc(self._pinName)
+
+    def read_timed(self, buf, timer):
+        frequency = timer if isinstance(timer, int) else timer.freq()
+        board = _board.current()
+        for i in range(len(buf)):
+            buf[i] = board.readAdc(self._pinName, 1e6 / frequency)
+
+    # On each timer tick the channels are converted one after the other, False when they took longer than the tick
+    @staticmethod
+    def read_timed_multi(adcs, bufs, timer):
+        frequency = timer if isinstance(timer, int) else timer.freq()
+        periodUs = 1e6 / frequency
+        board = _board.current()
+        conversionsUs = len(adcs) * _board.ADC_CONVERSION_US
+        for i in range(len(bufs[0])):
+            for adc, buf in zip(adcs, bufs):
+                buf[i] = board.readAdc(adc._pinName)
+            if conversionsUs < periodUs:
+                board.advance(periodUs - conversionsUs)
+        return conversionsUs <= periodUs
+
+
+class I2C:
+    MASTER = 0
+    SLAVE = 1
+
+    def __init__(self, bus, mode=None, baudrate=400000, **kwargs):
+        self._bus = bus
+        if mode is not None:
+            self.init(mode, baudrate=baudrate)
+
+    def init(self, mode, baudrate=400000, **kwargs):
+        _board.current().i2cBaudrates[self._bus] = baudrate
+
+    def send(self, send, addr=0, timeout=5000):
+        data = bytes((send & 0xff,)) if isinstance(send, int) else bytes(send)
+        _board.current().i2cWrite(self._bus, addr, data)
+
+    def is_ready(self, addr):
+        return (self._bus, addr) in _board.current().i2cDevices
+
+    def scan(self):
+        return sorted(addr for (bus, addr) in _board.current().i2cDevices if bus == self._bus)
+
+
+class UART:
+    def __init__(self, id, baudrate=9600, bits=8, parity=None, stop=1, timeout=0, timeout_char=0, rxbuf=64, **kwargs):
+        self._uart = _board.current().uart(id)
+        self._uart.configure(baudrate, rxbuf)
+
+    def any(self):
+        return self._uart.any()
+
+    def readinto(self, buf, nbytes=None):
+        # timeout 0: None when no byte is there
+        count = self._uart.readinto(buf, len(buf) if nbytes is None else nbytes)
+        return count or None
+
+
+class USB_VCP:
+    def __init__(self, id=0):
+        self._vcp = _board.current().usbVcp
+
+    def isconnected(self):
+        return self._vcp.connected
+
+    def any(self):
+        return False
+
+    def write(self, buf):
+        return self._vcp.write(bytes(buf))
+
+    def _pollEvents(self, mask):
+        return mask & _POLLOUT if self._vcp.writable() else 0
+
+
+_POLLOUT = 4
@@ -0,0 +1,29 @@
+# Host stand-in for the stm module: register addresses plus mem
+# accessors that decode the few registers the virtual board models.
+
+from host.sim import board as _board
+
+
+GPIOA = _board.GPIO_BASE
+GPIOB = _board.GPIO_BASE + 1 * _board.GPIO_PORT_STRIDE
+GPIOC = _board.GPIO_BASE + 2 * _board.GPIO_PORT_STRIDE
+GPIOD = _board.GPIO_BASE + 3 * _board.GPIO_PORT_STRIDE
+GPIO_MODER = 0x00
+GPIO_IDR = _board.GPIO_IDR
+GPIO_ODR = 0x14
+
+
+class _Mem:
+    def __init__(self, width):
+        self._mask = (1 << width) - 1
+
+    def __getitem__(self, address):
+        return _board.current().readRegister32(address & ~3) & self._mask
+
+    def __setitem__(self, address, value):
+        raise NotImplementedError('register writes are not simulated')
+
+
+mem8 = _Mem(8)
+mem16 = _Mem(16)
+mem32 = _Mem(32)
@@ -0,0 +1,24 @@
+# Host stand-in for uos, the file functions the firmware uses. Paths
+# are host paths: the harness points the firmware's *_FILE constants
+# into the simulation's flash directory.
+
+import os as _os
+
+
+def rename(old, new):
+    # like the FAT filesystem of the pyboard flash, no rename over an existing file
+    if _os.path.exists(new):
+        raise OSError(17, 'EEXIST')
+    _os.rename(old, new)
+
+
+def remove(path):
+    _os.remove(path)
+
+
+def stat(path):
+    return tuple(_os.stat(path))
+
+
+def listdir(path='.'):
+    return _os.listdir(path)
@@ -0,0 +1,30 @@
+# Host stand-in for uselect, for the stub streams that implement
+# _pollEvents(mask).
+
+POLLIN = 1
+POLLOUT = 4
+POLLERR = 8
+POLLHUP = 16
+
+
+class poll:
+    def __init__(self):
+        self._registered = {}
+
+    def register(self, obj, eventmask=POLLIN | POLLOUT):
+        self._registered[id(obj)] = (obj, eventmask)
+
+    def unregister(self, obj):
+        self._registered.pop(id(obj), None)
+
+    def modify(self, obj, eventmask):
+        self._registered[id(obj)] = (obj, eventmask)
+
+    def poll(self, timeout=-1):
+        return list(self.ipoll(timeout))
+
+    def ipoll(self, timeout=-1, flags=0):
+        for obj, eventmask in list(self._registered.values()):
+            events = obj._pollEvents(eventmask)
+            if events:
+                yield (obj, events)
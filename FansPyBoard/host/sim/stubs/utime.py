@@ -0,0 +1,43 @@
+# Host stand-in for utime, running on the virtual board clock with
+# the stm32 port's tick wrap-around.
+
+from host.sim import board as _board
+
+_TICKS_MAX = _board.TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _board.TICKS_PERIOD // 2
+
+
+def ticks_us():
+    return _board.current().ticksUs()
+
+
+def ticks_ms():
+    return _board.current().ticksMs()
+
+
+def ticks_cpu():
+    return _board.current().ticksUs()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+def time():
+    return _board.current().seconds()
+
+
+def sleep(seconds):
+    _board.current().delayUs(seconds * 1000000)
+
+
+def sleep_ms(ms):
+    _board.current().delayUs(ms * 1000)
+
+
+def sleep_us(us):
+    _board.current().delayUs(us)
@@ -0,0 +1,131 @@
+#########################################################
+#                                                       #
+#                      simulate.py                      #
+#       Run the fan controller on the host, faster      #
+#                    than real time                     #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.simulate --seconds 120 --fail 3@40 --heat 300
+#     python3 -m host.simulate --seconds 1800 --heat-step 400@600 --telemetry 1 --record run1
+#     python3 -m host.simulate --seconds 600 --pump 1800@120 --pump 0@300 --pump-unplug 450
+#     python3 -m host.simulate --seconds 30 --tach-polling --instrument
+#
+# Prints loop throughput, the missed tach edge rate, what the LCD
+# shows at the end of the run and the scheduler task statistics.
+
+import argparse
+
+from host import recorder
+from host.sim.harness import Simulation
+
+
+def parseFailure(text):
+    fan, atSeconds = text.split('@')
+    return int(fan), float(atSeconds)
+
+
+def parsePumpStep(text):
+    rpm, atSeconds = text.split('@')
+    return float(rpm), float(atSeconds)
+
+
+def parseHeatStep(text):
+    heatW, atSeconds = text.split('@')
+    return float(heatW), float(atSeconds)
+
+
+def heatSchedule(heatW, steps):
+    # the heat load in W at a virtual time in s, heatW until the first step
+    steps = sorted(steps, key=lambda step: step[1])
+
+    def heatAt(seconds):
+        heat = heatW
+        for stepW, atSeconds in steps:
+            if seconds >= atSeconds:
+                heat = stepW
+        return heat
+    return heatAt if steps else heatW
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the FansPyBoard controller on a virtual board')
+    parser.add_argument('--seconds', type=float, default=60.0, help='virtual seconds to run (default 60)')
+    parser.add_argument('--cpu-scale', type=float, default=0.0,
+                        help='also charge this many virtual microseconds per host microsecond of '
+                             'interpreter work (default 0, deterministic)')
+    parser.add_argument('--max-rpm', type=float, default=1500.0, help='fan speed at 100%% duty')
+    parser.add_argument('--heat', type=float, default=250.0, help='heat load in W')
+    parser.add_argument('--heat-step', type=parseHeatStep, action='append', default=[], metavar='W@SECONDS',
+                        help='change the heat load at a virtual time, may be repeated')
+    parser.add_argument('--ambient', type=float, default=24.0, help='ambient temperature in deg C')
+    parser.add_argument('--fail', type=parseFailure, action='append', default=[], metavar='FAN@SECONDS',
+                        help='stop a fan at a virtual time, may be repeated')
+    parser.add_argument('--pump', type=parsePumpStep, action='append', default=[], metavar='RPM@SECONDS',
+                        help='change the pump speed at a virtual time, 0 stops it, may be repeated')
+    parser.add_argument('--pump-unplug', type=float, metavar='SECONDS',
+                        help='disconnect the pump MCU from the pump link at a virtual time')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--telemetry', type=int, default=0, metavar='HZ', help='telemetry frame rate (default off)')
+    parser.add_argument('--record', metavar='DIR', help='decode the telemetry stream into column files in DIR')
+    parser.add_argument('--tach-polling', action='store_true', help='poll every tach pin instead of using ExtInt')
+    parser.add_argument('--instrument', action='store_true',
+                        help='run the instrumented main loop and print its figures at the end')
+    parser.add_argument('--flash', metavar='DIR', help='keep the board flash files (the fan curve cache) in DIR, '
+                                                       'a second run boots on them')
+    args = parser.parse_args()
+
+    def configure(firmware):
+        firmware.TELEMETRY_RATE_HZ = args.telemetry
+        if args.tach_polling:
+            firmware.TACH_ACQUISITION_MODE = firmware.TACH_ACQUISITION_POLLING
+
+    simulation = Simulation(cpuScale=args.cpu_scale, seed=args.seed, maxRpm=args.max_rpm,
+                            heatW=heatSchedule(args.heat, args.heat_step), ambientC=args.ambient, configure=configure, flashDir=args.flash)
+    board = simulation.board
+    if args.instrument:
+        simulation.controller.instrument()
+    events = [(atSeconds, lambda fan=fan: setattr(board.fans[fan], 'failed', True)) for fan, atSeconds in args.fail]
+    events += [(atSeconds, lambda rpm=rpm: setattr(board.pump, 'rpm', rpm)) for rpm, atSeconds in args.pump]
+    if args.pump_unplug is not None:
+        events.append((args.pump_unplug, lambda: setattr(board.pump, 'unplugged', True)))
+    elapsed = 0.0
+    for atSeconds, event in sorted(events, key=lambda event: event[0]):
+        if atSeconds > elapsed:
+            simulation.run(atSeconds - elapsed)
+            elapsed = atSeconds
+        event()
+    report = simulation.run(max(0.0, args.seconds - elapsed))
+
+    print('virtual time       %8.1f s (%.1fx real time)' % (report['virtualSeconds'], report['speedup']))
+    print('tach poll passes   %8.0f /s' % report['pollPassesPerSecond'])
+    print('tach edges         %8d expected, %d counted, %.2f %% missed, %d spurious' % (
+        report['expectedEdges'], report['countedEdges'], 100.0 * report['missedEdgeRate'], report['spuriousEdges']))
+    print('I2C                %8d transactions, %.2f s busy' % (report['i2cTransactions'], report['i2cBusySeconds']))
+    print('water temperature  %8.2f deg C' % report['waterTemperature'])
+    print('fans duty          %8d %%' % report['controlValue'])
+    print('fans RPM           ' + ' '.join('%d' % rpm for rpm in report['fanRpms']))
+    pumpLink = simulation.controller._pumpLink
+    print('pump link          %8d frames, %d bad, %d lost, %d RPM, %d %% demand floor' % (
+        pumpLink.frames, pumpLink.badFrames, pumpLink.lostFrames, pumpLink.rpm, pumpLink.demandFloor()))
+    for line in report['lcd']:
+        print('LCD               |%s|' % line)
+    print('boot               ' + ', '.join('%s %d ms' % (name, ms) for name, ms in report['boot']))
+    for name, runs, overruns, latenessMs, runUs in report['tasks']:
+        print('task %-13s %6d runs, %d overruns, %d ms late, %d us longest' % (name, runs, overruns, latenessMs, runUs))
+    if args.instrument:
+        simulation.controller.printInstrumentation()
+    if args.telemetry:
+        telemetry = simulation.controller._telemetry
+        print('telemetry          %8d frames sent, %d dropped, %d bytes' % (
+            telemetry.sentFrames, telemetry.droppedFrames, len(simulation.board.usbVcp.received)))
+    if args.record:
+        index = recorder.record([bytes(simulation.board.usbVcp.received)], args.record)
+        print('recorded           %8d frames, %d lost, %d bad in %s' % (
+            index['frames'], index['lostFrames'], index['badFrames'], args.record))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#########################################################
+#                                                       #
+#                     thermtable.py                     #
+#     ADC code to temperature table for Thermistor.py   #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory:
+#
+#     python3 -m host.thermtable                       # writes ThermistorTable.py
+#     python3 -m host.thermtable --output OtherSensorTable.py --divider 4700 \
+#         --coefficients A B C D --offset 0.0
+#
+# The sensor is an NTC in a divider with dividerResistance from the
+# ADC pin to ground and the temperature a rational fit of the NTC
+# resistance R:
+#
+#     T = offset + (A * R * R + B * R + C) / (R + D)
+#
+# The defaults are the MatLab fit and the +0.2 compensation used by
+# FanController.py, and the divider is read from its
+# TEMPERATURE_SENSOR_DIVIDER_RESISTANCE.
+# Each entry of TEMPERATURE_SENSORS in FanController.py names the
+# table module of its sensor, one generated with its own divider and
+# coefficients.
+# The table holds centi-degrees every 2**shift ADC codes over the
+# temperature range; the coarsest spacing whose linear interpolation
+# stays within the tolerance at every 1/16 of an ADC code is used.
+
+import argparse
+import re
+
+
+DEFAULT_COEFFICIENTS = (-.0019, 38.14, 43870.0, -827.0)
+DEFAULT_OFFSET = 0.2
+FRACTION_BITS = 4           # averaged readings are interpolated in 1/16 of an ADC code
+MAX_ADC_CODE = 4095
+
+
+def dividerResistanceFromController(path='FanController.py'):
+    with open(path) as source:
+        match = re.search(r'TEMPERATURE_SENSOR_DIVIDER_RESISTANCE\s*=\s*const\((\d+)\)', source.read())
+    return int(match.group(1))
+
+
+class Fit:
+    def __init__(self, dividerResistance, coefficients=DEFAULT_COEFFICIENTS, offset=DEFAULT_OFFSET):
+        self.dividerResistance = dividerResistance
+        self.coefficients = coefficients
+        self.offset = offset
+
+    def temperature(self, adcCode):
+        a, b, c, d = self.coefficients
+        resistance = ((float(MAX_ADC_CODE) / adcCode) - 1.0) * self.dividerResistance
+        return self.offset + (a * resistance * resistance + b * resistance + c) / (resistance + d)
+
+    def codeFor(self, temperature):
+        # the fit rises with the ADC code up to its pole at R = -D
+        low, high = 1.0, float(MAX_ADC_CODE - 1)
+        poleResistance = -self.coefficients[3]
+        if poleResistance > 0:
+            high = min(high, MAX_ADC_CODE / (1.0 + poleResistance / self.dividerResistance) - 1.0)
+        for _ in range(60):
+            middle = 0.5 * (low + high)
+            if self.temperature(middle) < temperature:
+                low = middle
+            else:
+                high = middle
+        return 0.5 * (low + high)
+
+
+def buildTable(fit, shift, minTemperature, maxTemperature):
+    step = 1 << shift
+    firstCode = int(fit.codeFor(minTemperature)) // step * step
+    lastCode = -(-int(fit.codeFor(maxTemperature) + 1) // step) * step
+    centiDegrees = [int(round(100.0 * fit.temperature(code))) for code in range(firstCode, lastCode + 1, step)]
+    return firstCode, centiDegrees
+
+
+def interpolate(firstCode, shift, centiDegrees, codeQ4):
+    # same arithmetic as Thermistor.centiDegrees
+    offset = codeQ4 - (firstCode << FRACTION_BITS)
+    if offset <= 0:
+        return centiDegrees[0]
+    index = offset >> (shift + FRACTION_BITS)
+    if index >= len(centiDegrees) - 1:
+        return centiDegrees[-1]
+    fraction = offset & ((1 << (shift + FRACTION_BITS)) - 1)
+    low = centiDegrees[index]
+    return low + (((centiDegrees[index + 1] - low) * fraction) >> (shift + FRACTION_BITS))
+
+
+def maxError(fit, firstCode, shift, centiDegrees, minTemperature, maxTemperature):
+    worst = 0.0
+    startQ4 = int(fit.codeFor(minTemperature) * (1 << FRACTION_BITS)) + 1
+    endQ4 = int(fit.codeFor(maxTemperature) * (1 << FRACTION_BITS))
+    for codeQ4 in range(startQ4, endQ4 + 1):
+        expected = fit.temperature(codeQ4 / float(1 << FRACTION_BITS))
+        actual = interpolate(firstCode, shift, centiDegrees, codeQ4) / 100.0
+        worst = max(worst, abs(actual - expected))
+    return worst
+
+
+def generate(fit, minTemperature, maxTemperature, tolerance):
+    for shift in (6, 5, 4, 3, 2, 1, 0):
+        firstCode, centiDegrees = buildTable(fit, shift, minTemperature, maxTemperature)
+        error = maxError(fit, firstCode, shift, centiDegrees, minTemperature, maxTemperature)
+        if error <= tolerance:
+            return shift, firstCode, centiDegrees, error
+    raise ValueError('no table spacing meets %.3f deg C' % tolerance)
+
+
+def moduleSource(fit, shift, firstCode, centiDegrees, error, minTemperature, maxTemperature):
+    a, b, c, d = fit.coefficients
+    lines = [
+        '# Generated by host/thermtable.py, do not edit.',
+        '#',
+        '# T = %r + (%r * R * R + %r * R + %r) / (R + %r)' % (fit.offset, a, b, c, d),
+        '# R = (4095 / adc - 1) * %d, %.0f to %.0f deg C, max interpolation error %.4f deg C'
+        % (fit.dividerResistance, minTemperature, maxTemperature, error),
+        '',
+        'from array import array',
+        '',
+        'FIRST_CODE = const(%d)' % firstCode,
+        'CODE_SHIFT = const(%d)       # one entry every %d ADC codes' % (shift, 1 << shift),
+        'CENTI_DEGREES = array(\'h\', (',
+    ]
+    for i in range(0, len(centiDegrees), 10):
+        lines.append('    ' + ', '.join('%d' % value for value in centiDegrees[i:i + 10]) + ',')
+    lines.append('))')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate an ADC code to temperature table module')
+    parser.add_argument('--output', default='ThermistorTable.py')
+    parser.add_argument('--divider', type=int, default=None,
+                        help='divider resistance in ohm (default: TEMPERATURE_SENSOR_DIVIDER_RESISTANCE in FanController.py)')
+    parser.add_argument('--coefficients', type=float, nargs=4, default=DEFAULT_COEFFICIENTS, metavar=('A', 'B', 'C', 'D'))
+    parser.add_argument('--offset', type=float, default=DEFAULT_OFFSET)
+    parser.add_argument('--min', type=float, default=0.0, help='lowest temperature in the table (deg C)')
+    parser.add_argument('--max', type=float, default=100.0, help='highest temperature in the table (deg C)')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='max error in deg C (default 0.05)')
+    args = parser.parse_args()
+
+    divider = args.divider if args.divider is not None else dividerResistanceFromController()
+    fit = Fit(divider, tuple(args.coefficients), args.offset)
+    shift, firstCode, centiDegrees, error = generate(fit, args.min, args.max, args.tolerance)
+    with open(args.output, 'w') as output:
+        output.write(moduleSource(fit, shift, firstCode, centiDegrees, error, args.min, args.max))
+    print('%s: %d entries every %d codes from code %d, max error %.4f deg C' % (
+        args.output, len(centiDegrees), 1 << shift, firstCode, error))
+
+
+if __name__ == '__main__':
+    main()
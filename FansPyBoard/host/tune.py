@@ -0,0 +1,102 @@
+#########################################################
+#                                                       #
+#                        tune.py                        #
+#      PID gains and target from a recorded trace       #
+#                                                       #
+#########################################################
+
+# From the FansPyBoard directory, needs NumPy:
+#
+#     python3 -m host.tune run1                           # telemetry recording
+#     python3 -m host.tune history.bin --start 600        # copy of the history log
+#     python3 -m host.tune run1 --kp 0.5:16:32 --ki 0.005:0.2:32 --kd 0,5,20 --target 33
+#
+# Fits the water temperature model of host/tuning/model.py to the
+# trace, prints it with the demand the fans need at the target, then
+# runs the FixedPID law on the model for every gain set of the grid
+# (ranges are MIN:MAX:COUNT, log spaced, or a comma list) and prints
+# the best ranked ones and where PID_KP/KI/KD of FanController.py
+# stand. The target, the PID period and the derivative filter come
+# from FanController.py too, unless given. A trace to start from can
+# be recorded from the simulator:
+#
+#     python3 -m host.simulate --seconds 2400 --heat-step 400@600 --heat-step 200@1500 --telemetry 1 --record run1
+
+import argparse
+import time
+
+import numpy as np
+
+from host import sim
+from host import tuning
+
+
+def parseRange(text):
+    if ':' in text:
+        low, high, count = text.split(':')
+        return np.geomspace(float(low), float(high), int(count))
+    return np.array([float(value) for value in text.split(',')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune the FansPyBoard PID on a fitted water temperature model')
+    parser.add_argument('trace', help='telemetry recording directory or copy of the history log')
+    parser.add_argument('--fans', type=int, default=12, help='number of fans in a history log (default 12)')
+    parser.add_argument('--start', type=float, help='fit from this time in s of the trace, e.g. after a fan curve sweep')
+    parser.add_argument('--end', type=float, help='fit up to this time in s of the trace')
+    parser.add_argument('--max-dead-time', type=float, default=60.0, help='longest dead time tried in s (default 60)')
+    parser.add_argument('--target', type=float, help='water temperature target (default TARGET_WATER_TEMP)')
+    parser.add_argument('--kp', type=parseRange, default=parseRange('0.25:16:24'))
+    parser.add_argument('--ki', type=parseRange, default=parseRange('0.0025:0.16:24'))
+    parser.add_argument('--kd', type=parseRange, default=parseRange('0,2,5,10,20,50,100,200'))
+    parser.add_argument('--seconds', type=float, default=1800.0, help='length of each scenario (default 1800)')
+    parser.add_argument('--load-step', type=float, default=3.0, help='load step in deg C at a fixed demand (default 3)')
+    parser.add_argument('--band', type=float, default=0.2, help='settled within this of the target (default 0.2)')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    sim.install(sim.VirtualBoard())
+    firmware = sim.loadFirmware()
+    targetC = args.target if args.target is not None else firmware.TARGET_WATER_TEMP
+    periodS = firmware.ADJUST_FANS_RPM_PERIOD_MS / 1000.0
+
+    trace = tuning.load(args.trace, args.fans).window(args.start, args.end)
+    model = tuning.fit(trace, periodS=max(periodS, float(np.median(np.diff(trace.timeS)))),
+                       maxDeadTimeS=args.max_dead_time)
+    model.periodS = periodS             # fit at the trace rate, simulated at the PID rate
+    print('trace              %s, %d samples over %.0f s' % (trace.name, len(trace), trace.durationS))
+    print('model              %.3f deg C per %% demand, time constant %.0f s, dead time %.0f s, %.2f deg C at 0 %%' % (
+        model.gain, model.timeConstantS, model.deadTimeS, model.offsetC))
+    print('model error        %.3f deg C one step ahead, %.3f deg C free run' % (model.rmsErrorC, model.freeRunRmsErrorC))
+    demand = model.demandFor(targetC)
+    print('at %.2f deg C      %.0f %% demand%s' % (targetC, demand, '' if 0 <= demand <= 100 else
+                                                   ', out of reach at this heat load'))
+
+    kP, kI, kD = tuning.gainGrid(args.kp, args.ki, args.kd)
+    kP = np.append(kP, firmware.PID_KP)
+    kI = np.append(kI, firmware.PID_KI)
+    kD = np.append(kD, firmware.PID_KD)
+    startTime = time.time()
+    results = tuning.simulate(model, kP, kI, kD, targetC, seconds=args.seconds,
+                              derivativeFilterMs=firmware.PID_DERIVATIVE_FILTER_MS, loadStepC=args.load_step,
+                              bandC=args.band)
+    elapsed = time.time() - startTime
+    order = tuning.rank(results)
+    print('simulated          %d gain sets, 2 scenarios of %.0f s every %.1f s, in %.2f s' % (
+        len(kP), args.seconds, periodS, elapsed))
+    print()
+    print('%5s %8s %8s %8s %9s %10s %8s %8s' % ('rank', 'kP', 'kI', 'kD', 'settle s', 'overshoot', 'peak', 'noise s'))
+
+    def row(label, i):
+        print('%5s %8.3f %8.4f %8.1f %9.0f %8.2f C %6.2f C %8.1f' % (
+            label, results['kP'][i], results['kI'][i], results['kD'][i], results['settleS'][i],
+            results['overshootC'][i], results['peakC'][i], results['noiseS'][i]))
+    for position, i in enumerate(order[:args.top]):
+        row(position + 1, i)
+    current = len(kP) - 1
+    print('board gains, rank %d of %d:' % (int(np.nonzero(order == current)[0][0]) + 1, len(kP)))
+    row('', current)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+#########################################################
+#                                                       #
+#                 host.tuning package                   #
+#      Controller traces, thermal model, PID grid       #
+#                                                       #
+#########################################################
+
+# Needs NumPy. Usage, from the FansPyBoard directory:
+#
+#     from host import tuning
+#     trace = tuning.load('run1')                     # recorder directory or history log
+#     model = tuning.fit(trace, periodS=1.0)
+#     kP, kI, kD = tuning.gainGrid(kPs, kIs, kDs)
+#     results = tuning.simulate(model, kP, kI, kD, targetC=35.0)
+#     order = tuning.rank(results)
+#
+# host/tune.py does this from the command line with the constants of
+# FanController.py.
+
+from host.tuning.traces import Trace, fromRecording, fromHistory, load
+from host.tuning.model import Fopdt, fit
+from host.tuning.batch import gainGrid, simulate, rank
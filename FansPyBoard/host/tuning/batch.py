@@ -0,0 +1,122 @@
+#########################################################
+#                                                       #
+#                       batch.py                        #
+#       Closed loop runs of many PID gain sets          #
+#                                                       #
+#########################################################
+
+# simulate() runs the FixedPID law of PID.py, in floating point,
+# against a fitted Fopdt for every gain set of a grid at once: the
+# state of the loop is a scenarios x gain sets array and each control
+# period is a handful of NumPy operations on it, so thousands of gain
+# sets take about as long as one.
+#
+# Two scenarios push the water above the target:
+#   - boot: the water starts startRiseC above the target, the PID
+#     starts from 50 % with no integral, like at power on
+#   - load step: the loop is settled at the target when the heat load
+#     rises by what would heat the water loadStepC at a fixed demand
+# The measurement is rounded to centi-degrees with the ADC noise of
+# noiseC (the same noise sequence for every gain set).
+#
+# Per gain set:
+#   settleS     time after which the water stays within bandC of the
+#               target, the longer of the two scenarios, inf if it never does
+#   overshootC  how far the water goes below the target, either scenario
+#   peakC       how far the load step lifts the water above the target
+#   noiseS      fan noise integral: the sound power of a fan goes with
+#               its speed to the fifth power, so the integral of
+#               (demand / 100)**5 is the time at full speed that makes
+#               the same acoustic energy, both scenarios
+#
+# rank() orders the gain sets by the sum of their ranks on settleS,
+# overshootC and noiseS, settling ones first.
+
+import math
+
+import numpy as np
+
+
+Q16_PERCENT = 65536.0
+MAX_ERROR_C = 100.0             # FixedPID clamps the error to MAX_ERROR centi-degrees
+
+
+def gainGrid(kPs, kIs, kDs):
+    # every combination, as three flat arrays
+    kP, kI, kD = np.meshgrid(np.asarray(kPs, dtype=float), np.asarray(kIs, dtype=float),
+                             np.asarray(kDs, dtype=float), indexing='ij')
+    return kP.ravel(), kI.ravel(), kD.ravel()
+
+
+def simulate(model, kP, kI, kD, targetC, seconds=1800.0, derivativeFilterMs=2000, outputMin=0, outputMax=100,
+             startRiseC=5.0, loadStepC=3.0, bandC=0.2, noiseC=0.02, seed=1):
+    periodS = model.periodS
+    dtMs = periodS * 1000.0
+    steps = int(seconds / periodS)
+    delay = int(round(model.deadTimeS / periodS))
+    a = math.exp(-periodS / model.timeConstantS)
+    kP = np.asarray(kP, dtype=float)[np.newaxis, :]
+    kI = np.asarray(kI, dtype=float)[np.newaxis, :]
+    kD = np.asarray(kD, dtype=float)[np.newaxis, :]
+    shape = (2, kP.shape[1])
+
+    # scenario 0 boot, 1 load step
+    settledDemand = min(outputMax, max(outputMin, model.demandFor(targetC)))
+    offsetC = np.array([[model.offsetC], [model.offsetC + loadStepC]])
+    waterC = np.empty(shape)
+    waterC[0] = targetC + startRiseC
+    waterC[1] = targetC
+    integral = np.zeros(shape)
+    integral[1] = settledDemand - 50.0
+    integralMin = outputMin - 50.0
+    integralMax = outputMax - 50.0
+    derivative = np.zeros(shape)
+    lastMeasuredC = None
+    applied = np.empty((delay + 1,) + shape)       # outputs on their way through the dead time
+    applied[:, 0] = 50.0
+    applied[:, 1] = settledDemand
+    alpha = dtMs / (derivativeFilterMs + dtMs)
+    noise = np.random.default_rng(seed).normal(0.0, noiseC, (steps, 2, 1))
+
+    lastOutside = np.full(shape, -1)
+    lowestC = np.full(shape, np.inf)
+    highestC = np.full(shape, -np.inf)
+    noiseS = np.zeros(shape)
+    for k in range(steps):
+        measuredC = np.round((waterC + noise[k]) * 100.0) / 100.0
+        error = np.clip(measuredC - targetC, -MAX_ERROR_C, MAX_ERROR_C)
+        integral = np.clip(integral + kI * error * periodS, integralMin, integralMax)
+        if lastMeasuredC is not None:
+            change = np.clip(measuredC - lastMeasuredC, -MAX_ERROR_C, MAX_ERROR_C)
+            derivative += (kD * change / periodS - derivative) * alpha
+        lastMeasuredC = measuredC
+        output = np.clip(np.floor(50.0 + kP * error + integral + derivative), outputMin, outputMax)
+        applied[k % (delay + 1)] = output
+        demand = applied[(k + 1) % (delay + 1)] if delay else output
+        waterC = a * waterC + (1.0 - a) * (model.gain * demand + offsetC)
+
+        deviationC = waterC - targetC
+        lastOutside[np.abs(deviationC) > bandC] = k
+        np.minimum(lowestC, deviationC, out=lowestC)
+        np.maximum(highestC, deviationC, out=highestC)
+        noiseS += (demand / 100.0) ** 5 * periodS
+
+    settleS = np.where(lastOutside == steps - 1, np.inf, (lastOutside + 1) * periodS).max(axis=0)
+    return {
+        'kP': kP[0], 'kI': kI[0], 'kD': kD[0],
+        'settleS': settleS,
+        'overshootC': np.maximum(0.0, -lowestC).max(axis=0),
+        'peakC': highestC[1],
+        'noiseS': noiseS.sum(axis=0),
+    }
+
+
+def rank(results):
+    # indices of the gain sets, best first
+    def ranks(values):
+        order = np.argsort(values, kind='stable')
+        positions = np.empty(len(values), dtype=np.int64)
+        positions[order] = np.arange(len(values))
+        return positions
+    total = ranks(results['settleS']) + ranks(results['overshootC']) + ranks(results['noiseS'])
+    return np.lexsort((results['settleS'], total, ~np.isfinite(results['settleS'])))
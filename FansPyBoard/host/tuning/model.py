@@ -0,0 +1,91 @@
+#########################################################
+#                                                       #
+#                       model.py                        #
+#     First order plus dead time water temperature      #
+#                                                       #
+#########################################################
+
+# The water temperature T follows the cooling demand u (PID output,
+# % duty) as
+#
+#     timeConstantS * dT/dt = gain * u(t - deadTimeS) + offsetC - T
+#
+# gain is negative (more fan, cooler water) and offsetC is where the
+# water would settle at 0 % demand, for the heat load of the trace.
+# Sampled every periodS with u held in between, this is
+#
+#     T[k+1] = a T[k] + b u[k-d] + c
+#     a = exp(-periodS / timeConstantS), b = (1 - a) gain, c = (1 - a) offsetC
+#
+# and fit() solves the least squares problem for a, b, c for every
+# dead time d from 0 to maxDeadTimeS at once, as one stack of 3x3
+# normal equations, and keeps the d with the smallest residual.
+#
+# The heat load is taken as constant and the response as linear: fit
+# over a part of the trace where the load does not change and the
+# fans follow the demand, neither all at minimum duty nor held at
+# 100 %. The fan curve sweep of a first boot is not under PID control
+# either.
+
+import math
+
+import numpy as np
+
+
+class Fopdt:
+    def __init__(self, gain, timeConstantS, deadTimeS, offsetC, periodS, rmsErrorC=0.0, freeRunRmsErrorC=0.0):
+        self.gain = gain
+        self.timeConstantS = timeConstantS
+        self.deadTimeS = deadTimeS
+        self.offsetC = offsetC
+        self.periodS = periodS
+        self.rmsErrorC = rmsErrorC                  # one step ahead
+        self.freeRunRmsErrorC = freeRunRmsErrorC    # model driven by the recorded demand alone
+
+    def demandFor(self, waterC):
+        # % duty that holds the water at waterC
+        return (waterC - self.offsetC) / self.gain
+
+    def response(self, demand, startC):
+        # water temperatures for a demand sequence sampled every periodS
+        a = math.exp(-self.periodS / self.timeConstantS)
+        delay = int(round(self.deadTimeS / self.periodS))
+        delayed = np.concatenate((np.full(delay, demand[0]), demand))[:len(demand)]
+        waterC = np.empty(len(demand))
+        value = startC
+        for k in range(len(demand)):
+            waterC[k] = value
+            value = a * value + (1.0 - a) * (self.gain * delayed[k] + self.offsetC)
+        return waterC
+
+
+def fit(trace, periodS=1.0, maxDeadTimeS=60.0):
+    trace = trace.resampled(periodS)
+    waterC = trace.waterC
+    demand = trace.demand
+    delays = np.arange(int(maxDeadTimeS / periodS) + 1)
+    first = delays[-1]
+    if len(waterC) - first < 10:
+        raise ValueError('%s: %.0f s is too short to fit with dead times up to %.0f s' % (
+            trace.name, trace.durationS, maxDeadTimeS))
+    k = np.arange(first, len(waterC) - 1)
+    regressors = np.empty((len(delays), len(k), 3))
+    regressors[:, :, 0] = waterC[k]
+    regressors[:, :, 1] = demand[k[np.newaxis, :] - delays[:, np.newaxis]]
+    regressors[:, :, 2] = 1.0
+    observed = waterC[k + 1]
+    normal = np.einsum('dni,dnj->dij', regressors, regressors)
+    projected = np.einsum('dni,n->di', regressors, observed)
+    if np.any(np.abs(np.linalg.det(normal)) < 1e-12):
+        raise ValueError('%s: the demand does not move, nothing to fit' % trace.name)
+    parameters = np.linalg.solve(normal, projected[:, :, np.newaxis])[:, :, 0]
+    residuals = observed[np.newaxis, :] - np.einsum('dni,di->dn', regressors, parameters)
+    rms = np.sqrt(np.mean(residuals ** 2, axis=1))
+    best = int(np.argmin(rms))
+    a, b, c = parameters[best]
+    if not 0.0 < a < 1.0 or b >= 0.0:
+        raise ValueError('%s: no cooling response in the trace (a %.4f, b %.5f)' % (trace.name, a, b))
+    model = Fopdt(b / (1.0 - a), -periodS / math.log(a), delays[best] * periodS, c / (1.0 - a), periodS,
+                  rmsErrorC=rms[best])
+    model.freeRunRmsErrorC = float(np.sqrt(np.mean((model.response(demand, waterC[0]) - waterC) ** 2)))
+    return model
@@ -0,0 +1,94 @@
+#########################################################
+#                                                       #
+#                       traces.py                       #
+#        Controller recordings as NumPy arrays          #
+#                                                       #
+#########################################################
+
+# A Trace holds, for every frame or record of a recording:
+#
+#     timeS    s from the first one
+#     waterC   water temperature in deg C
+#     demand   PID output, % duty, the cooling demand the zones share
+#     duties   frames x 3 PWM duties, top, bottom top, bottom bottom
+#     rpms     frames x fans
+#
+# from a telemetry recording made with host/recorder.py (any frame
+# rate) or from a copy of the history log (a record every 30 s).
+
+import json
+import os
+
+import numpy as np
+
+from host import history
+
+
+TICKS_MASK = 0x1fffffff         # utime.ticks_ms() wraps at 2**29
+
+
+class Trace:
+    def __init__(self, name, timeS, waterC, demand, duties, rpms):
+        self.name = name
+        self.timeS = np.asarray(timeS, dtype=float)
+        self.waterC = np.asarray(waterC, dtype=float)
+        self.demand = np.asarray(demand, dtype=float)
+        self.duties = np.asarray(duties, dtype=float)
+        self.rpms = np.asarray(rpms, dtype=float)
+
+    def __len__(self):
+        return len(self.timeS)
+
+    @property
+    def durationS(self):
+        return self.timeS[-1] - self.timeS[0] if len(self) else 0.0
+
+    def window(self, startS=None, endS=None):
+        # the frames from startS to endS, times still counted from the first frame of the recording
+        keep = np.ones(len(self), dtype=bool)
+        if startS is not None:
+            keep &= self.timeS >= startS
+        if endS is not None:
+            keep &= self.timeS <= endS
+        return Trace(self.name, self.timeS[keep], self.waterC[keep], self.demand[keep], self.duties[keep],
+                     self.rpms[keep])
+
+    def resampled(self, periodS):
+        # on a uniform time grid: temperatures interpolated, demand and duties held from the last frame, like
+        # the board holds them between PID updates
+        timeS = np.arange(self.timeS[0], self.timeS[-1] + 1e-9, periodS)
+        held = np.clip(np.searchsorted(self.timeS, timeS, side='right') - 1, 0, len(self) - 1)
+        return Trace(self.name, timeS, np.interp(timeS, self.timeS, self.waterC), self.demand[held],
+                     self.duties[held], self.rpms[held])
+
+
+def fromRecording(directory):
+    with open(os.path.join(directory, 'columns.json')) as index:
+        columns = {column['name']: np.fromfile(os.path.join(directory, column['file']), dtype=column['dtype'])
+                   for column in json.load(index)['columns']}
+    if not columns or not len(columns['timeMs']):
+        raise ValueError('%s: no frames recorded' % directory)
+    steps = np.diff(columns['timeMs'].astype(np.int64)) & TICKS_MASK
+    timeS = np.concatenate(([0], np.cumsum(steps))) / 1000.0
+    rpms = np.column_stack([columns[name] for name in sorted((name for name in columns if name.startswith('rpm')),
+                                                              key=lambda name: int(name[3:]))])
+    duties = np.column_stack([columns['dutyTop'], columns['dutyBottomTop'], columns['dutyBottomBottom']])
+    return Trace(directory, timeS, columns['waterCentiDegrees'] / 100.0, columns['pidOutput'], duties, rpms)
+
+
+def fromHistory(path, numberOfFans=12, pageSize=1024):
+    with open(path, 'rb') as source:
+        pages, _ = history.readPages(source.read(), pageSize, numberOfFans)
+    records = np.array([record for _, _, records in pages for record in records], dtype=float)
+    if not len(records):
+        raise ValueError('%s: no valid history page' % path)
+    # log time goes on across reboots, records are in log time order
+    duties = 2 + numberOfFans
+    return Trace(path, records[:, 0] - records[0, 0], records[:, 1] / 100.0, records[:, duties + 3],
+                 records[:, duties:duties + 3], records[:, 2:duties])
+
+
+def load(path, numberOfFans=12):
+    if os.path.isdir(path):
+        return fromRecording(path)
+    return fromHistory(path, numberOfFans)
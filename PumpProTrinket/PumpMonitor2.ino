@@ -29,6 +29,20 @@
 // 640 / 1024 = 62%, gives about 3000 RPM
 #define PWM_DUTY_CYCLE 640
 
+// Pump link to the fans PyBoard, FansPyBoard/PumpLink.py, on the TX pin:
+// one frame every second, little endian
+//     magic 0x7ea5 (2 bytes), version, sequence number, RPM (2 bytes),
+//     faults, PWM duty in percent, Fletcher-16 of the previous bytes (2 bytes)
+#define LINK_MAGIC 0x7ea5
+#define LINK_VERSION 1
+#define LINK_FRAME_SIZE 10
+#define LINK_FRAME_PERIOD 1000
+#define PUMP_LOW_RPM 0x01
+#define PUMP_STOPPED 0x02
+#define PUMP_ALERTING 0x04
+// No tach pulse for this long and the pump is reported stopped, a new RPM only comes every 500 pulses
+#define NO_PULSE_STOPPED_MICROS 1000000UL
+
 
 
 // This global variable is accessed both by the interrupt service routine
@@ -74,6 +88,36 @@ void alertTone(int toneDuration) {
 }
 
 
+uint16_t fletcher16(const byte *data, byte length) {
+  uint16_t sum1 = 0;
+  uint16_t sum2 = 0;
+  for(byte i = 0; i < length; i++) {
+    sum1 = (sum1 + data[i]) % 255;
+    sum2 = (sum2 + sum1) % 255;
+  }
+  return (sum2 << 8) | sum1;
+}
+
+byte linkSequence = 0;
+
+// Serial.write only queues the frame, the UART interrupt sends it
+void sendLinkFrame(unsigned int rpm, byte faults) {
+  byte frame[LINK_FRAME_SIZE];
+  frame[0] = LINK_MAGIC & 0xff;
+  frame[1] = LINK_MAGIC >> 8;
+  frame[2] = LINK_VERSION;
+  frame[3] = linkSequence++;
+  frame[4] = rpm & 0xff;
+  frame[5] = rpm >> 8;
+  frame[6] = faults;
+  frame[7] = (byte)(100UL * PWM_DUTY_CYCLE / 1024);
+  uint16_t checksum = fletcher16(frame, LINK_FRAME_SIZE - 2);
+  frame[8] = checksum & 0xff;
+  frame[9] = checksum >> 8;
+  Serial.write(frame, LINK_FRAME_SIZE);
+}
+
+
 void setup() {
   Serial.begin(9600);
 
@@ -96,9 +140,11 @@ void setup() {
 
 
 unsigned long lastTime = 0;
+unsigned long lastFrameTime = 0;
+unsigned long rpm = 0;
+byte faults = 0;
 
 void loop() {
-  unsigned long rpm;
   unsigned long now = millis();
 
   if(requiredNumberOfPulsesElapsed) {
@@ -108,18 +154,30 @@ void loop() {
 
     rpm = (unsigned long)(30. / ((durationSinceLastValueAvailable / NUMBER_OF_PULSES) / 1000));
 
-    Serial.print("Pump RPM: ");
-    Serial.println(rpm);
-
+    faults &= ~(PUMP_LOW_RPM | PUMP_ALERTING);
     if(rpm < LOW_RPM) {
       alertTone(1000);
-      Serial.println("Pump low RPM!");
+      faults |= PUMP_LOW_RPM | PUMP_ALERTING;
     }
   }
 
+  noInterrupts();
+  unsigned long lastPulseMicro = lastMicro;
+  interrupts();
+  if(micros() - lastPulseMicro > NO_PULSE_STOPPED_MICROS) {
+    faults |= PUMP_STOPPED;
+  } else {
+    faults &= ~PUMP_STOPPED;
+  }
+
+  if(now - lastFrameTime >= LINK_FRAME_PERIOD) {
+    lastFrameTime = now;
+    sendLinkFrame(faults & PUMP_STOPPED ? 0 : (rpm > 0xffff ? 0xffff : rpm), faults);
+  }
+
   if((now - lastTime) > THIRTY_SECONDS) { // pump stopped
+    faults |= PUMP_ALERTING;
     alertTone(1000);
     delay(1500);
-    Serial.println("Pump stopped!");
   }
 }